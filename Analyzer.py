@@ -10,7 +10,7 @@ from clang import cindex
 from collections import OrderedDict
 
 import ROOT
-import pprint, copy, os, subprocess, textwrap, re, glob
+import pprint, copy, os, subprocess, textwrap, re, glob, json, hashlib, tempfile
 pp = pprint.PrettyPrinter(indent=4)
 
 # For parsing c++ modules
@@ -20,6 +20,136 @@ cpp_args =  '-x c++ -c --std=c++11 -I %s/include %s -lstdc++'%(rootpath,libs)
 cpp_args = cpp_args.split(' ')
 
 TIMBERPATH = os.environ["TIMBERPATH"]
+_templateFillerCompiled = False
+_reducedPrecisionCompiled = False
+# On-disk cache for the function signatures parsed by ModuleWorker._getFuncInfo()
+FUNCINFO_CACHE = os.environ.get('TIMBERCACHE', os.path.join(os.getcwd(),'.cppcache'))
+# Declare TIMBER/Framework/include headers to Cling only when an expression or module uses one of their symbols.
+# Set TIMBERLAZYHEADERS=0 to declare all of them when the analyzer is built instead.
+LAZY_HEADERS = os.environ.get('TIMBERLAZYHEADERS','1') != '0'
+_headerManifest = None
+_loadedHeaders = []
+# ROOT::RCompressionSetting::EAlgorithm values accepted by Snapshot()
+COMPRESSION_ALGORITHMS = {'ZLIB':1, 'LZMA':2, 'LZ4':4, 'ZSTD':5}
+# On-disk cache of filled results (see ResultCache), its size cap in MB, and TIMBERNORESULTCACHE=1 to bypass it
+RESULT_CACHE = os.environ.get('TIMBERRESULTCACHE', os.path.join(FUNCINFO_CACHE,'results'))
+RESULT_CACHE_MAXSIZE = float(os.environ.get('TIMBERRESULTCACHESIZE','1000'))
+RESULT_CACHE_BYPASS = os.environ.get('TIMBERNORESULTCACHE','0') != '0'
+# Memory budget (MB) of analyzer.Cache() before it spills to disk, and where the spill files go
+NODE_CACHE_BUDGET = float(os.environ.get('TIMBERCACHEBUDGET','2000'))
+NODE_CACHE_DIR = os.environ.get('TIMBERCACHEDIR', tempfile.gettempdir())
+# Names of the uint64 mask columns made by analyzer.PackBits(), which are the only inputs read for bit layouts
+BIT_MASK_COLUMN = r'\w*Bits\d*'
+# C++ sources compiled so far, as name -> (hash of the contents, symbols using it) (see RegisterModuleSource())
+_moduleSources = {}
+
+def RegisterModuleSource(filename,extra='',symbols=None):
+    '''Add a compiled C++ source to the ones hashed into the result cache keys (see ResultCache)
+    so that cached results are not reused once it is edited. Modules, TIMBER headers and
+    TemplateFiller.cc are registered by the analyzer. Sources compiled outside of it should be
+    registered by whatever compiles them (ex. helpers.CompileCppCached()).
+
+    @param filename (str): Path of the source.
+    @param extra (str, optional): Anything else that changes the compiled code or its results
+        (ex. constructor arguments, see _argStamp()). Defaults to ''.
+    @param symbols (list(str), optional): Identifiers through which expressions use the source (ex. the
+        object name of a module). It is then only part of the keys of results whose nodes use one of them,
+        so the keys do not depend on what else was compiled in the process. Defaults to None, in which case
+        it is part of every key (for sources compiled before anything is booked).
+    '''
+    key = hashlib.sha1()
+    with open(filename,'rb') as f:
+        key.update(f.read())
+    key.update(extra.encode('utf-8'))
+    # registering the same source for the same symbols again (ex. a module object rebuilt with other arguments) replaces it
+    name = filename if symbols == None else filename+' '+','.join(sorted(symbols))
+    _moduleSources[name] = (key.hexdigest(), None if symbols == None else frozenset(symbols))
+
+def _argStamp(arg):
+    '''Constructor argument as hashed into the result cache keys: file paths (as given or relative
+    to TIMBERPATH) get the size and modification time of the file appended, so results are not
+    reused once a data file (ex. scale factors) is regenerated.
+    '''
+    arg = str(arg)
+    for f in [arg.strip('"'), TIMBERPATH+arg.strip('"')]:
+        if f != '' and os.path.isfile(f):
+            return '%s[%s:%s]'%(arg,os.path.getsize(f),os.path.getmtime(f))
+    return arg
+
+# both MakeTemplateHistos() paths book their results with 'Template' keys, so both depend on TemplateFiller.cc
+RegisterModuleSource(os.path.dirname(os.path.abspath(__file__))+'/TemplateFiller.cc',symbols=['Template'])
+
+def _skipHeaders():
+    if 'CMSSW_BASE' not in os.environ.keys():
+        return ['JME_common.h','JetSmearer.h','JetRecalibrator.h','JES_weight.h','JER_weight.h','JMS_weight.h','JMR_weight.h']
+    return []
+
+def _getHeaderManifest():
+    '''Symbol -> headers manifest for TIMBER/Framework/include. The symbols are the namespaces,
+    classes/structs, and (unindented) free functions defined in each header. The manifest is built
+    with a regex scan (no clang) and cached in FUNCINFO_CACHE, keyed by the header names and
+    modification times so it is rebuilt when a header changes.
+
+    Returns:
+        dict: `{symbol: [header paths]}`.
+    '''
+    global _headerManifest
+    if _headerManifest != None: return _headerManifest
+
+    headers = sorted([f for f in glob.glob(TIMBERPATH+'TIMBER/Framework/include/*.h') if f.split('/')[-1] not in _skipHeaders()])
+    key = hashlib.sha1(''.join(['%s%s'%(f,os.path.getmtime(f)) for f in headers]).encode('utf-8')).hexdigest()[:16]
+    cachefile = os.path.join(FUNCINFO_CACHE,'header_manifest_%s.json'%key)
+    if os.path.isfile(cachefile):
+        try:
+            with open(cachefile,'r') as f:
+                _headerManifest = dict([(str(k),[str(h) for h in v]) for k,v in json.load(f).items()])
+            return _headerManifest
+        except ValueError:
+            pass
+
+    keywords = ['if','for','while','switch','return','sizeof','using','std','ROOT','RVec','const','static','inline','template','typename']
+    symbol_re = re.compile(r'^\s*(?:namespace\s+(\w+)|(?:class|struct)\s+(\w+)\s*[:{\n])|^[A-Za-z_][\w:<>,\*& ]*?[\s\*&](\w+)\s*\(',re.M)
+    _headerManifest = {}
+    for h in headers:
+        with open(h,'r') as f:
+            text = re.sub(r'//.*|/\*[\s\S]*?\*/','',f.read())
+        for m in symbol_re.finditer(text):
+            symbol = [g for g in m.groups() if g != None][0]
+            if symbol in keywords: continue
+            if symbol not in _headerManifest: _headerManifest[symbol] = []
+            if h not in _headerManifest[symbol]: _headerManifest[symbol].append(h)
+
+    try:
+        if not os.path.isdir(FUNCINFO_CACHE): os.makedirs(FUNCINFO_CACHE)
+        fd,tmpname = tempfile.mkstemp(dir=FUNCINFO_CACHE,suffix='.tmp')
+        with os.fdopen(fd,'w') as f:
+            json.dump(_headerManifest,f)
+        os.rename(tmpname,cachefile)
+    except (IOError,OSError) as e:
+        print ('Could not cache header manifest: %s'%e)
+    return _headerManifest
+
+def _requireHeaders(code):
+    '''Declare to Cling every TIMBER header providing a symbol used in `code`
+    (a Define/Cut expression or the contents of a module) that is not declared yet.
+
+    @param code (str): C++ code.
+
+    Returns:
+        list(str): The headers providing a symbol used in `code` (declared now or before).
+            Empty if LAZY_HEADERS is off (all of them are declared up front).
+    '''
+    if not LAZY_HEADERS: return []
+    manifest = _getHeaderManifest()
+    used = []
+    for token in set(re.findall(r'[A-Za-z_]\w*',code)):
+        for h in manifest.get(token,[]):
+            if h not in used: used.append(h)
+            if h not in _loadedHeaders:
+                _loadedHeaders.append(h)
+                RegisterModuleSource(h,symbols=[t for t,hs in manifest.items() if h in hs])
+                CompileCpp('#include "%s"\n'%h)
+    return sorted(used)
 
 class analyzer(object):
     """Main class for TIMBER. 
@@ -30,7 +160,7 @@ class analyzer(object):
 
     When using class functions to perform actions, an active node will always be tracked so that the next action uses 
     the active node and assigns the output node as the new #ActiveNode"""
-    def __init__(self,fileName,eventsTreeName="Events",runTreeName="Runs",multiSampleStr='',skipEmpty=True):
+    def __init__(self,fileName,eventsTreeName="Events",runTreeName="Runs",multiSampleStr='',skipEmpty=True,fileIndex=None,entryRanges=None,friends=None,friendTreeName='Friends',resultCache=True):
         """Constructor.
         
         Sets up the tracking of actions on an RDataFrame as nodes. Also
@@ -49,6 +179,20 @@ class analyzer(object):
 	@param skipEmpty (bool): If the ROOT file(s) opened for processing by the analyzer have an empty Events TTree, then skip them.
 		By default, this is set to True, and a warning will be issued to the user if they do not wish to skip files with empty
 		Events trees. 
+        @param fileIndex (dict, optional): Input file metadata, as made by helpers.BuildFileIndex(), keyed by file name.
+                Files found in it are added without being opened and genEventSumw/genEventCount and the LHA ID are taken from it
+                instead of looping over the Runs TTree. Defaults to None (every file is opened).
+        @param entryRanges (dict, optional): {file name: (firstEntry, lastEntry)} to only process part of a file
+                (lastEntry excluded), as made by helpers.ShardUp(). Files without an entry are processed in full.
+                The Runs TTree of a file is only added if its range starts at entry 0 so that it is counted once
+                over all of the jobs sharing the file. Unlike Range(), this works with ImplicitMT
+                (a TEntryList is set on the Events TChain). Defaults to None.
+        @param friends (dict, optional): {file name: friend file name} of friend TTrees (same entries as the
+                Events TTree of the file) whose branches should be available as columns. Every input file
+                must have one. Defaults to None.
+        @param friendTreeName (str, optional): Name of the friend TTrees. Defaults to "Friends".
+        @param resultCache (bool, optional): Load results from (and store them in) the #ResultCache. Turn it off
+                for jobs whose results are never booked again in the same place (ex. snapshots on Condor). Defaults to True.
         """
 
         ## @var fileName
@@ -94,6 +238,27 @@ class analyzer(object):
         # ROOT.TChain
         #
         # The TChain of the `<runTreeName>` TTree.
+        ## @var Cutflow
+        # OrderedDict
+        #
+        # Lazy weighted and unweighted event counts booked with BookCutflow(), keyed by label.
+        ## @var Variations
+        # OrderedDict
+        #
+        # Systematic variations registered with Vary(), as variation name -> list of variation tags.
+        ## @var RecordedCuts
+        # OrderedDict
+        #
+        # Cuts made with Cut(..., record=True), as name -> expression, in bit order (see CutBits()).
+        ## @var BitMasks
+        # OrderedDict
+        #
+        # Bit mask columns made with PackBits(), as mask column -> packed column names in bit order.
+        ## @var ResultCache
+        # ResultCache
+        #
+        # On-disk cache of the results booked with BookCached() (and so by MakeHistsWithBinning(), Nminus1Histos(),
+        # MakeTemplateHistos() and BookCutflow()). Set `ResultCache.bypass = True` to always run the event loop.
 
         super(analyzer, self).__init__()
         self.fileName = fileName 
@@ -101,6 +266,10 @@ class analyzer(object):
         self._runTreeName = runTreeName
         self.silent = False
 	self.skipEmpty = skipEmpty
+        self._fileIndex = {} if fileIndex == None else fileIndex
+        self._indexedRunFiles = [] # metadata of files added to RunChain from the index
+        self._entryRanges = {} if entryRanges == None else entryRanges
+        self._chainRanges = {} # file name as added to the TChain -> (firstEntry, lastEntry)
         if multiSampleStr != '':
             multiSampleStr = 'YMass_%s'%multiSampleStr
         genEventSumw_str = 'genEventSumw_'+multiSampleStr
@@ -121,12 +290,31 @@ class analyzer(object):
 		for f in ProgressBar(fNames, "Opening files: "):
 		    self._addFile(f)
 
+        if len(self._entryRanges) > 0:
+            self._entryList = self._makeEntryList()
+            self._eventsChain.SetEntryList(self._entryList)
+
+        self._friendChain = None
+        if friends != None and len(friends) > 0:
+            self._friendChain = self._makeFriendChain(friends,friendTreeName)
+            self._eventsChain.AddFriend(self._friendChain)
+
         # Make base RDataFrame
         BaseDataFrame = ROOT.RDataFrame(self._eventsChain) 
         self.BaseNode = Node('base',BaseDataFrame) 
         self.BaseNode.children = [] # protect against memory issue when running over multiple sets in one script
         self.AllNodes = [self.BaseNode] 
         self.Corrections = {} 
+        self.Cutflow = OrderedDict()
+        self.Variations = OrderedDict()
+        self.RecordedCuts = OrderedDict()
+        self.BitMasks = OrderedDict()
+        self._inputBitMasks = None # read by GetBitMasks()
+        self._templateWeights = {} # weight column names -> packed RVec<double> column used by MakeTemplateHistos()
+        self._weightStrings = {} # packed RVec<double> column -> (weight order, string-built weights) for CheckWeightCols()
+        self.ResultCache = ResultCache(bypass=RESULT_CACHE_BYPASS or not resultCache)
+        self._inputHash = None # hash of the input files for the result cache keys (see ResultKey())
+        self._spillFiles = [] # made by Cache(), removed by Close()
 
         # Check if dealing with data
         if hasattr(self._eventsChain,'genWeight'):
@@ -137,48 +325,50 @@ class analyzer(object):
         # Count number of generated events if not data
         self.genEventSumw = 0.0
         self.genEventCount = 0
-        if not self.isData: 
-            for i in range(self.RunChain.GetEntries()): 
-                self.RunChain.GetEntry(i)
-                if hasattr(self.RunChain,'genEventSumw'):
-                    self.genEventSumw+= self.RunChain.genEventSumw
-                    self.genEventCount+= self.RunChain.genEventCount
-                elif hasattr(self.RunChain,genEventSumw_str):
-                    self.genEventSumw+= getattr(self.RunChain,genEventSumw_str)
-                    self.genEventCount+= getattr(self.RunChain,genEventCount_str)
-                else:
-                    raise NameError('In attempt to deduce sum of event weights, could not access branch genEventSumw or %s in TTree %s.'%(genEventSumw_str,self._runTreeName))
+        self._genEventSums = None
+        if not self.isData:
+            sums = self.GetGenEventSums()
+            if 'genEventSumw' in sums['genEventSumw']:
+                self.genEventSumw = sums['genEventSumw']['genEventSumw']
+                self.genEventCount = sums['genEventCount']['genEventCount']
+            elif genEventSumw_str in sums['genEventSumw']:
+                self.genEventSumw = sums['genEventSumw'][genEventSumw_str]
+                self.genEventCount = sums['genEventCount'][genEventCount_str]
+            elif self.RunChain.GetNtrees() > 0: # jobs with only part of a file may have no Runs TTree (see entryRanges)
+                raise NameError('In attempt to deduce sum of event weights, could not access branch genEventSumw or %s in TTree %s.'%(genEventSumw_str,self._runTreeName))
 
         # Get LHAID from LHEPdfWeights branch
         self.lhaid = "-1"
         if not self.isData:
-            pdfbranch = self._eventsChain.GetBranch("LHEPdfWeight")
-            if pdfbranch != None:
-                branch_title = pdfbranch.GetTitle()
-                if branch_title != '': 
-                    self.lhaid = ''
-                    for c in branch_title:
-                        if c.isdigit(): 
-                            self.lhaid+=str(c)
-                        elif self.lhaid == '':
-                            continue
-                        else:
-                            break
-                    self.lhaid = str(int(self.lhaid)-1) if self.lhaid[-1] == "1" else self.lhaid
-                    print ('LHA ID: '+self.lhaid)
+            if len(self._indexedRunFiles) > 0:
+                branch_title = self._indexedRunFiles[0]['LHEPdfWeightTitle']
+            else:
+                pdfbranch = self._eventsChain.GetBranch("LHEPdfWeight")
+                branch_title = '' if pdfbranch == None else pdfbranch.GetTitle()
+            if branch_title != '': 
+                self.lhaid = ''
+                for c in branch_title:
+                    if c.isdigit(): 
+                        self.lhaid+=str(c)
+                    elif self.lhaid == '':
+                        continue
+                    else:
+                        break
+                self.lhaid = str(int(self.lhaid)-1) if self.lhaid[-1] == "1" else self.lhaid
+                print ('LHA ID: '+self.lhaid)
         self.lhaid = int(self.lhaid)
 
         self.ActiveNode = self.BaseNode
         # Auto create collections
         self._collectionOrg = CollectionOrganizer(BaseDataFrame)
 
-        skipHeaders = []
-        if 'CMSSW_BASE' not in os.environ.keys():
-            skipHeaders = ['JME_common.h','JetSmearer.h','JetRecalibrator.h','JES_weight.h','JER_weight.h','JMS_weight.h','JMR_weight.h']
-
-        for f in glob.glob(os.environ["TIMBERPATH"]+'TIMBER/Framework/include/*.h'):
-            if f.split('/')[-1] in skipHeaders: continue
-            CompileCpp('#include "%s"\n'%f)
+        # TIMBER headers are declared on first use (see _requireHeaders()) unless LAZY_HEADERS is off
+        if not LAZY_HEADERS:
+            for f in glob.glob(os.environ["TIMBERPATH"]+'TIMBER/Framework/include/*.h'):
+                if f.split('/')[-1] in _skipHeaders() or f in _loadedHeaders: continue
+                _loadedHeaders.append(f)
+                RegisterModuleSource(f)
+                CompileCpp('#include "%s"\n'%f)
 
     def _parseTxt(self,f):
 	'''Parse .txt file and return list of all lines in it
@@ -193,9 +383,30 @@ class analyzer(object):
         Args:
             f (str): File to add.
         '''
-        if f.endswith(".root"): 
+        if f.endswith(".root") and f in self._fileIndex:
+            # validated when the index was built - no need to open the file
+            meta = self._fileIndex[f]
+            entryRange = self._entryRanges.get(f,None)
             if 'root://' not in f and f.startswith('/store/'):
                 f='root://cms-xrd-global.cern.ch/'+f
+            if entryRange != None: self._chainRanges[f] = entryRange
+            if not meta['exists']:
+                raise ReferenceError('File %s does not exist'%f)
+            if not meta['empty']:
+                self._eventsChain.Add(f)
+            elif self.skipEmpty:
+                print("WARNING: The following file contains an empty Events TTree, skipping. If you wish to add regardless, please call the analyzer with 'skipEmpty=False'\n\tFile: {}".format(f))
+            else:
+                print("WARNING: The following file contains an empty Events TTree, adding to analyzer regardless. If you wish to skip, please call analyzer with 'skipEmpty=True' (default).\n\tFile: {}".format(f))
+                self._eventsChain.Add(f)
+            if meta['hasRuns'] and (entryRange == None or entryRange[0] == 0):
+                self.RunChain.Add(f)
+                self._indexedRunFiles.append(meta)
+        elif f.endswith(".root"): 
+            entryRange = self._entryRanges.get(f,None)
+            if 'root://' not in f and f.startswith('/store/'):
+                f='root://cms-xrd-global.cern.ch/'+f
+            if entryRange != None: self._chainRanges[f] = entryRange
             #self._eventsChain.Add(f)
             if ROOT.TFile.Open(f,'READ') == None:
                 raise ReferenceError('File %s does not exist'%f)	    
@@ -209,7 +420,7 @@ class analyzer(object):
 		else:
 		    print("WARNING: The following file contains an empty Events TTree, adding to analyzer regardless. If you wish to skip, please call analyzer with 'skipEmpty=True' (default).\n\tFile: {}".format(f))
 		    self._eventsChain.Add(f)
-            if tempF.Get(self._runTreeName) != None:
+            if tempF.Get(self._runTreeName) != None and (entryRange == None or entryRange[0] == 0):
                 self.RunChain.Add(f)
             tempF.Close()
         elif f.endswith(".txt"): 
@@ -220,6 +431,104 @@ class analyzer(object):
         else:
             raise Exception("File name extension not supported. Please provide a single or list of .root files or a .txt file with a line-separated list of .root files to chain together.")
 
+    def _makeFriendChain(self,friends,friendTreeName):
+        '''Build the TChain of friend TTrees in the same file order as the Events TChain.
+
+        Raises:
+            NameError: If a file in the Events TChain has no friend.
+
+        Returns:
+            TChain
+        '''
+        byChainName = {}
+        for f,friend in friends.items():
+            if 'root://' not in f and f.startswith('/store/'):
+                f='root://cms-xrd-global.cern.ch/'+f
+            byChainName[f] = friend
+        chain = ROOT.TChain(friendTreeName)
+        for element in self._eventsChain.GetListOfFiles():
+            if element.GetTitle() not in byChainName:
+                raise NameError('No friend TTree given for %s.'%element.GetTitle())
+            chain.Add(byChainName[element.GetTitle()])
+        return chain
+
+    def _makeEntryList(self):
+        '''Build the TEntryList restricting the Events TChain to the entry ranges given to the constructor.
+        Every file in the chain needs a sub-list so files without a range get all of their entries.
+
+        Returns:
+            TEntryList
+        '''
+        elist = ROOT.TEntryList('entryRanges','entryRanges')
+        for element in self._eventsChain.GetListOfFiles():
+            f = element.GetTitle()
+            if f in self._chainRanges:
+                first, last = self._chainRanges[f]
+            else:
+                tempF = ROOT.TFile.Open(f,'READ')
+                first, last = 0, tempF.Get(self._eventsTreeName).GetEntries()
+                tempF.Close()
+            sublist = ROOT.TEntryList('','',self._eventsTreeName,f)
+            sublist.EnterRange(first,last)
+            elist.Add(sublist)
+        return elist
+
+    def GetGenEventSums(self):
+        '''Sums of every `genEventSumw*` and `genEventCount*` branch of the `<runTreeName>` TTree,
+        including the `genEventSumw_YMass_<mass>` branches of samples with several mass points.
+        If all of the files came from the file index, the sums are taken from it. Otherwise
+        they are computed with one RDataFrame Sum() per branch, all booked on the same
+        dataframe so the Runs chain is only read once. The result is cached.
+
+        Returns:
+            dict: {'genEventSumw':{branch:sum}, 'genEventCount':{branch:sum}}
+        '''
+        if self._genEventSums != None:
+            return self._genEventSums
+
+        sums = {'genEventSumw':{}, 'genEventCount':{}}
+        if len(self._indexedRunFiles) > 0 and len(self._indexedRunFiles) == self.RunChain.GetNtrees():
+            # everything is in the file index - no need to read the Runs chain
+            for meta in self._indexedRunFiles:
+                for k in sums.keys():
+                    for b in meta[k]:
+                        if b not in sums[k]: sums[k][b] = 0
+                        sums[k][b]+= meta[k][b]
+        elif self.RunChain.GetNtrees() > 0:
+            branches = [b.GetName() for b in self.RunChain.GetListOfBranches()]
+            rdf = ROOT.RDataFrame(self.RunChain)
+            ptrs = {'genEventSumw':{}, 'genEventCount':{}}
+            for b in branches:
+                for k in ptrs.keys():
+                    if b == k or b.startswith(k+'_'):
+                        ptrs[k][b] = rdf.Sum(b)
+            # first GetValue() triggers the single loop for all of them
+            for k in ptrs.keys():
+                for b in ptrs[k]:
+                    sums[k][b] = ptrs[k][b].GetValue()
+
+        for b in sums['genEventCount']:
+            sums['genEventCount'][b] = int(sums['genEventCount'][b])
+        self._genEventSums = sums
+        return self._genEventSums
+
+    def GetGenEventSumw(self,massPoints=None):
+        '''Sum of generator weights per mass point of a multi-sample (signal grid) file.
+
+        @param massPoints (list(str), optional): Mass points (as in `genEventSumw_YMass_<mass>`) to return.
+            Defaults to None in which case all mass points found are returned.
+
+        Returns:
+            dict: {mass point (str): sum of weights}. Empty for single samples.
+        '''
+        out = {}
+        for b,v in self.GetGenEventSums()['genEventSumw'].items():
+            if not b.startswith('genEventSumw_YMass_'): continue
+            mass = b[len('genEventSumw_YMass_'):]
+            if massPoints == None or mass in massPoints:
+                out[mass] = v
+        return out
+
     def Close(self):
         '''Safely deletes analyzer instance.
         
@@ -228,6 +537,9 @@ class analyzer(object):
         '''
         self.BaseNode.Close()
         self._eventsChain.Reset()
+        for f in self._spillFiles:
+            if os.path.isfile(f): os.remove(f)
+        self._spillFiles = []
 
     def __str__(self):
         '''Call with `print(<analyzer>)` to print a nicely formatted description
@@ -255,7 +567,8 @@ class analyzer(object):
         '''        
         return self.ActiveNode.DataFrame
 
-    def Snapshot(self,columns,outfilename,treename,lazy=False,openOption='RECREATE',saveRunChain=False):
+    def Snapshot(self,columns,outfilename,treename,lazy=False,openOption='RECREATE',saveRunChain=False,
+                 compressionAlgorithm='ZLIB',compressionLevel=1,basketSize=None,autoFlush=None,precision=None):
         '''@see Node#Snapshot for full description.
 
         @param columns ([str] or str): List of columns to keep (str) with regex matching.
@@ -265,6 +578,12 @@ class analyzer(object):
         @param lazy (bool, optional): If False, the RDataFrame actions until this point will be executed here. Defaults to False.
         @param openOption (str, optional): TFile opening options. Defaults to 'RECREATE'.
         @param saveRunChain (bool, optional): Whether to save the TTree specified by runTreeName with the snapshot. Defaults to True.
+        @param compressionAlgorithm (str, optional): ZLIB, LZMA, LZ4 or ZSTD. Defaults to 'ZLIB'.
+        @param compressionLevel (int, optional): Defaults to 1.
+        @param basketSize (int, optional): Basket size in bytes. Defaults to None (ROOT default).
+        @param autoFlush (int, optional): Cluster size (see TTree::SetAutoFlush()). Defaults to None (ROOT default).
+        @param precision (dict, optional): {column regex: mantissa bits} for float columns to store with reduced precision.
+                Defaults to None (full precision).
 
         Returns:
             None
@@ -274,7 +593,8 @@ class analyzer(object):
                 raise ValueError('Cannot %s file while also saving Runs TTree. Change openOption to RECREATE.'%openOption)
             self.SaveRunChain(outfilename,merge=False)
             openOption = 'UPDATE' # switch option so snapshot can be saved with RunChain file
-        self.ActiveNode.Snapshot(columns,outfilename,treename,lazy,openOption)
+        self.ActiveNode.Snapshot(columns,outfilename,treename,lazy,openOption,
+                                 compressionAlgorithm,compressionLevel,basketSize,autoFlush,precision)
 
     def SaveRunChain(self,filename,merge=True):
         '''Save the Run tree (chain of all input files) to filename.
@@ -420,6 +740,8 @@ class analyzer(object):
     def GetTriggerString(self,trigList):
         '''Checks input list for missing triggers and drops those missing (#FilterColumnNames)
         and then concatenates those remaining into an OR (`||`) string.
+        Triggers packed into a bit mask column (see #PackBits()) are tested with one
+        `(mask & bits) != 0` per mask column instead.
 
         @param trigList [str]: List of trigger names 
 
@@ -427,13 +749,20 @@ class analyzer(object):
             str: Statement to evaluate as the set of triggers.
         '''
         trig_string = ''
+        packed,trigList = self._packedBits(trigList)
         available_trigs = self.FilterColumnNames(trigList)
-        trig_string = ConcatCols(available_trigs,'1','||')
+        if len(packed) == 0:
+            return ConcatCols(available_trigs,'1','||')
+        tests = ['((%s & %sull) != 0)'%(col,bits) for col,bits in packed.items()]
+        if len(available_trigs) > 0: tests.append(ConcatCols(available_trigs,'1','||'))
+        trig_string = '(%s)'%(' || '.join(tests))
         return trig_string
 
     def GetFlagString(self,flagList=GetStandardFlags()):
         '''Checks input list for missing flags and drops those missing (#FilterColumnNames)
         and then concatenates those remaining into an AND string.
+        Flags packed into a bit mask column (see #PackBits()) are tested with one
+        `(mask & bits) == bits` per mask column instead.
 
         @param flagList [str]: List of flag names 
 
@@ -441,8 +770,13 @@ class analyzer(object):
             str: Statement to evaluate as the set of flags.
         '''
         flag_string = ''
+        packed,flagList = self._packedBits(flagList)
         available_flags = self.FilterColumnNames(flagList)
-        flag_string = ConcatCols(available_flags,'1','&&')
+        if len(packed) == 0:
+            return ConcatCols(available_flags,'1','&&')
+        tests = ['((%s & %sull) == %sull)'%(col,bits,bits) for col,bits in packed.items()]
+        if len(available_flags) > 0: tests.append(ConcatCols(available_flags,'1','&&'))
+        flag_string = '(%s)'%(' && '.join(tests))
         return flag_string
 
     def GetFileName(self):
@@ -458,7 +792,7 @@ class analyzer(object):
     # benefit of class keeping track of an Active Node (reset by #
     # each action and used by default).                          #
     #------------------------------------------------------------#
-    def Cut(self,name,cuts,node=None,nodetype=None):
+    def Cut(self,name,cuts,node=None,nodetype=None,record=False):
         '''Apply a cut/filter to a provided node or the #ActiveNode by default.
         Will add the resulting node to tracking and set it as the #ActiveNode.
 
@@ -467,9 +801,15 @@ class analyzer(object):
         @param node (Node, optional): Node on which to apply the cut/filter. Defaults to #ActiveNode.
         @param nodetype (str, optional): Defaults to None in which case the new Node will
             be type "Define".
+        @param record (bool, optional): Instead of filtering, store whether the event passes in the
+            bool column `CutBit_<name>` and keep the event. The recorded cuts are packed into one
+            uint32 column with #CutBits() so they can be applied later with #ApplyCutBits().
+            Only for string cuts. Later expressions must not rely on the recorded cut (ex. for a valid index).
+            Defaults to False.
 
         Raises:
             TypeError: If argument type is not Node.
+            ValueError: If more than 32 cuts are recorded.
 
         Returns:
             Node: New #ActiveNode.
@@ -477,6 +817,14 @@ class analyzer(object):
         if node == None: node = self.ActiveNode
         newNode = node
 
+        if record:
+            if not isinstance(cuts,str):
+                raise TypeError("Only single string cuts can be recorded.")
+            if len(self.RecordedCuts) >= 32:
+                raise ValueError('Cannot record more than 32 cuts in the uint32 CutBits column.')
+            self.RecordedCuts[name] = cuts
+            return self.Define('CutBit_'+name,'bool(%s)'%cuts,node=node)
+
         if isinstance(cuts,CutGroup):
             for c in cuts.keys():
                 cut = cuts[c]
@@ -532,6 +880,37 @@ class analyzer(object):
 
         return self.SetActiveNode(newNode)
 
+    def Vary(self,columns,expression,variationTags,variationName,node=None):
+        '''Registers systematic variations of existing columns on top of a provided node
+        or the #ActiveNode by default, using the
+        [RDataFrame Vary method](https://root.cern/doc/master/classROOT_1_1RDF_1_1RInterface.html).
+        Every column, cut, and histogram downstream of the varied columns is then evaluated
+        for every variation in the same event loop as the nominal. #MakeTemplateHistos()
+        picks the variations up automatically. Requires ROOT >= 6.26.
+
+        @param columns (str, [str]): Column or list of columns to vary (they must already be defined).
+        @param expression (str): One-line C++ string that evaluates to an `RVec<T>` of the varied values
+            (one entry per tag) for a single column, or to an `RVec<RVec<T>>` of [column][tag] for a list of columns.
+        @param variationTags ([str]): Names of the individual variations (ex. ["up","down"]).
+        @param variationName (str): Name of the systematic. Must be unique.
+        @param node (Node, optional): Node to vary the columns on. Defaults to #ActiveNode.
+
+        Raises:
+            NameError: If a variation of the same name already exists.
+
+        Returns:
+            Node: New ActiveNode.
+        '''
+        if node == None: node = self.ActiveNode
+        if variationName in self.Variations.keys():
+            raise NameError('Variation "%s" already exists.'%variationName)
+        if isinstance(columns,str): columns = [columns]
+
+        newNode = node.Vary(columns,expression,variationTags,variationName,silent=self.silent)
+        self.Variations[variationName] = list(variationTags)
+        self.TrackNode(newNode)
+        return self.SetActiveNode(newNode)
+
     # Applies a bunch of action groups (cut or var) in one-shot in the order they are given
     def Apply(self,actionGroupList,node=None,trackEach=True):
         '''Applies a single CutGroup/VarGroup or an ordered list of Groups to the provided node or the #ActiveNode by default.
@@ -750,6 +1129,469 @@ class analyzer(object):
         # self.TrackNode(returnNode)
         return self.SetActiveNode(newNode)
 
+    #---------#
+    # Cutflow #
+    #---------#
+    def _inputKey(self):
+        '''Hash of the input files (name, size and modification time of local files; name, entries and
+        genEventSumw from the file index, or else the TFile UUID, of remote ones) of the Events and friend
+        TChains and of the entry ranges. Computed once.
+
+        Returns:
+            str: Hex digest.
+        '''
+        if self._inputHash == None:
+            key = hashlib.sha1()
+            for chain in [self._eventsChain,self._friendChain]:
+                if chain == None: continue
+                key.update(chain.GetName().encode('utf-8'))
+                for element in chain.GetListOfFiles():
+                    f = element.GetTitle()
+                    indexName = f.replace('root://cms-xrd-global.cern.ch/','',1)
+                    if os.path.isfile(f):
+                        stamp = '%s:%s:%s'%(f,os.path.getsize(f),os.path.getmtime(f))
+                    elif indexName in self._fileIndex: # no need to open the file again
+                        meta = self._fileIndex[indexName]
+                        stamp = '%s:%s:%s'%(f,meta['entries'],sorted(meta['genEventSumw'].items()))
+                    else:
+                        tempF = ROOT.TFile.Open(f,'READ')
+                        stamp = '%s:%s'%(f,tempF.GetUUID().AsString())
+                        tempF.Close()
+                    key.update(stamp.encode('utf-8'))
+            key.update(repr(sorted(self._chainRanges.items())).encode('utf-8'))
+            self._inputHash = key.hexdigest()
+        return self._inputHash
+
+    def ResultKey(self,keyParts,node=None):
+        '''Key of a result in the #ResultCache: a hash of everything the result is computed from,
+        namely the input files (see #_inputKey()), the type, name and C++ string of every node from `node`
+        back to the base node, the registered variations, the compiled C++ sources these use (see RegisterModuleSource())
+        and the ROOT version, plus `keyParts` describing the result itself (ex. the histogram model and columns).
+
+        @param keyParts (tuple): Description of the result. Its repr() is hashed.
+        @param node (Node, optional): Node the result is booked on. Defaults to #ActiveNode.
+
+        Returns:
+            str: Hex digest.
+        '''
+        if node == None: node = self.ActiveNode
+        key = hashlib.sha1(self._inputKey().encode('utf-8'))
+        symbols = set(re.findall(r'[A-Za-z_]\w*',repr(keyParts)+repr(list(self.Variations.items()))))
+        while node != None:
+            if node.type != 'Cache': # same results with or without Cache()
+                key.update(('%s|%s|%s\n'%(node.type,node.name,node.action)).encode('utf-8'))
+                symbols.update(re.findall(r'[A-Za-z_]\w*',str(node.action)))
+            node = node.parent
+        key.update(repr(list(self.Variations.items())).encode('utf-8'))
+        # only the sources used by this result, in a fixed order
+        used = sorted([(name,h) for name,(h,uses) in _moduleSources.items() if uses == None or not uses.isdisjoint(symbols)])
+        key.update(repr(used).encode('utf-8'))
+        key.update(ROOT.gROOT.GetVersion().encode('utf-8'))
+        key.update(repr(keyParts).encode('utf-8'))
+        return key.hexdigest()
+
+    def BookCached(self,book,keyParts,node=None,name=None,title=None):
+        '''Book a result through the #ResultCache. If a result with the same key (see #ResultKey())
+        is already cached, nothing is booked and accessing the result loads it from disk without running
+        the event loop. Otherwise `book()` is called and the result is cached once it has been filled.
+
+        @param book (callable): Books the result (ex. `lambda: node.DataFrame.Sum('genWeight')`) and returns
+            the RResultPtr (or DeferredHist).
+        @param keyParts (tuple): Description of the result for the key. Must identify everything `book()`
+            does on top of `node` (ex. the histogram model, columns and weight).
+        @param node (Node, optional): Node the result is booked on. Defaults to #ActiveNode.
+        @param name (str, optional): Name to give the histogram. Defaults to None (keep its own name).
+        @param title (str, optional): Title to give the histogram. Defaults to None (keep its own title).
+
+        Returns:
+            CachedResult: Stands in for the result.
+        '''
+        if node == None: node = self.ActiveNode
+        # the key is not needed (and the inputs are not looked at) with the cache off
+        key = '' if self.ResultCache.bypass else self.ResultKey(keyParts,node)
+        return CachedResult(self.ResultCache,key,book,name,title)
+
+    def _columnBytes(self,node,column):
+        '''Rough in-memory size per event of `column`: the uncompressed size per entry of its branch
+        in the input or, for defined columns, the size of its type (RVecs are assumed to hold 4 elements).
+
+        Returns:
+            float: Bytes per event.
+        '''
+        branch = self._eventsChain.GetBranch(column) if self._eventsChain.GetNtrees() > 0 else None
+        if branch != None and branch.GetEntries() > 0:
+            return float(branch.GetTotBytes('*'))/branch.GetEntries()
+        ctype = str(node.DataFrame.GetColumnType(column))
+        sizes = [('bool',1),('char',1),('short',2),('Long64',8),('long',8),('double',8),('int',4),('float',4)]
+        elemBytes = 8
+        for t,nbytes in sizes:
+            if t in ctype.split('<')[-1]:
+                elemBytes = nbytes
+                break
+        if 'RVec' in ctype or 'vector' in ctype:
+            return 32.+4*elemBytes
+        return float(elemBytes)
+
+    def Cache(self,node=None,columns=None,entries=None,memoryBudget=NODE_CACHE_BUDGET,spillDir=NODE_CACHE_DIR):
+        '''Materialise `columns` of the events passing `node` so that later event loops over it (and its
+        children) read them from memory instead of re-reading the input and re-evaluating the Defines.
+        The size is estimated from `entries` (or the number of input entries, an upper bound) and #_columnBytes().
+        If it fits in `memoryBudget` the node's RDataFrame is cached in memory with RDataFrame::Cache(),
+        otherwise the events are written with LZ4 compression to a temporary file in `spillDir` (removed by #Close())
+        and read back from it. Either way this runs an event loop over `node` here, which also fills
+        every result booked on the analyzer so far.
+
+        The returned node (type "Cache") is a child of `node` and becomes the #ActiveNode. Build every
+        later branch on it (ex. reset to it instead of `node` with #SetActiveNode()). Only `columns` are available
+        on it and the #ResultCache keys are the same as on `node`. Nothing is done if variations have been
+        registered with #Vary(), since they cannot be cached.
+
+        @param node (Node, optional): Node to cache. Defaults to #ActiveNode.
+        @param columns ([str], optional): Columns to keep. Defaults to None (all columns, except those of the friend TTrees
+            under their "<friend tree>." prefix).
+        @param entries (int, CachedResult, optional): Number of events passing `node` (or an upper bound), either as a number or
+            as a Count() booked on `node` or one of its parents (ex. with #BookCached()). Getting the value of a count that
+            is not filled yet runs an event loop first. Defaults to None (number of input entries).
+        @param memoryBudget (float, optional): In MB. Defaults to NODE_CACHE_BUDGET ($TIMBERCACHEBUDGET or 2000).
+        @param spillDir (str, optional): Directory for the spill file. Defaults to NODE_CACHE_DIR ($TIMBERCACHEDIR or the system temporary directory).
+
+        Returns:
+            Node: Cached node.
+        '''
+        if node == None: node = self.ActiveNode
+        if len(self.Variations) > 0:
+            print('Cache: not caching %s since variations have been registered with Vary().'%node.name)
+            return node
+        if columns == None:
+            columns = [str(c) for c in node.DataFrame.GetColumnNames() if '.' not in str(c)]
+
+        if entries == None:
+            entries = self._entryList.GetN() if len(self._entryRanges) > 0 else self._eventsChain.GetEntries()
+        elif hasattr(entries,'GetValue'):
+            entries = entries.GetValue()
+        size = entries*sum([self._columnBytes(node,c) for c in columns])/1024./1024.
+        cols = ROOT.std.vector('std::string')()
+        for c in columns: cols.push_back(c)
+
+        action = 'Cache(%s)'%(', '.join(columns))
+        if size <= memoryBudget:
+            print('Cache: caching %s columns of %s in memory (at most %.0f MB)'%(len(columns),node.name,size))
+            df = node.DataFrame.Cache(cols)
+        else:
+            fd,spill = tempfile.mkstemp(prefix='TIMBERcache_',suffix='.root',dir=spillDir)
+            os.close(fd)
+            self._spillFiles.append(spill)
+            print('Cache: %s columns of %s could take up to %.0f MB (budget %.0f MB), writing them to %s'%(len(columns),node.name,size,memoryBudget,spill))
+            node.Snapshot(columns,spill,'Events',compressionAlgorithm='LZ4',compressionLevel=4)
+            df = ROOT.RDataFrame('Events',spill)
+
+        newNode = Node(node.name+'_cache',df,children=[],parent=node,action=action,nodetype='Cache')
+        node.SetChild(newNode)
+        self.TrackNode(newNode)
+        return self.SetActiveNode(newNode)
+
+    def BookCutflow(self,name,node=None,weight=None):
+        '''Books the weighted and unweighted number of events at `node` (#ActiveNode by default)
+        under the label `name`. Nothing is evaluated here. The counts are filled in the same event loop
+        as the next action that triggers execution (ex. a non-lazy Snapshot) and can be accessed
+        afterwards via #GetCutflow() or #WriteCutflow(). They are booked with #BookCached() so counts
+        already in the #ResultCache are not booked again.
+
+        @param name (str): Label for the cutflow entry (ex. "NPROC").
+        @param node (Node, optional): Node at which to count events. Defaults to #ActiveNode.
+        @param weight (str, optional): Column to sum for the weighted count. Defaults to None in which case
+                "genWeight" is used for simulation and the weighted count is the number of events for data.
+
+        Raises:
+            NameError: If an entry with the same label has already been booked.
+
+        Returns:
+            None
+        '''
+        if node == None: node = self.ActiveNode
+        if name in self.Cutflow.keys():
+            raise NameError('Cutflow entry "%s" has already been booked.'%name)
+        if weight == None and not self.isData: weight = 'genWeight'
+
+        df = node.DataFrame
+        recorded = [c for c in self.RecordedCuts.keys() if 'CutBit_'+c in node.DataFrame.GetColumnNames()]
+        if len(recorded) > 0: # count as if the recorded cuts had been applied
+            df = df.Filter(' && '.join('CutBit_'+c for c in recorded))
+        unweighted = self.BookCached(lambda: df.Count(),('Count',recorded),node)
+        weighted = unweighted if weight == None else self.BookCached(lambda: df.Sum(weight),('Sum',weight,recorded),node)
+        self.Cutflow[name] = {'weighted':weighted,'unweighted':unweighted}
+
+    def GetCutflow(self,name='cutflow',weighted=True):
+        '''Builds a histogram with one labeled bin per entry booked via #BookCutflow() (in booking order).
+        Accessing the values will run the event loop if it has not already been run.
+
+        @param name (str, optional): Name of the output histogram. Defaults to "cutflow".
+        @param weighted (bool, optional): Fill with the weighted counts. Defaults to True.
+
+        Raises:
+            ValueError: If no cutflow entries have been booked.
+
+        Returns:
+            TH1D: Cutflow histogram.
+        '''
+        if len(self.Cutflow.keys()) == 0:
+            raise ValueError('GetCutflow() called but no cutflow entries have been booked. Use BookCutflow() first.')
+        key = 'weighted' if weighted else 'unweighted'
+        nbins = len(self.Cutflow.keys())
+        out = ROOT.TH1D(name,'Number of events after each cut',nbins,0.5,nbins+0.5)
+        out.SetDirectory(0)
+        for ibin,label in enumerate(self.Cutflow.keys()):
+            out.GetXaxis().SetBinLabel(ibin+1,label)
+            out.SetBinContent(ibin+1,self.Cutflow[label][key].GetValue())
+        return out
+
+    def WriteCutflow(self,outfilename,openOption='UPDATE'):
+        '''Writes the weighted ("cutflow") and unweighted ("cutflow_unweighted") cutflow
+        histograms to `outfilename`. Does nothing if no entries have been booked.
+
+        @param outfilename (str): Name of the output file.
+        @param openOption (str, optional): TFile opening options. Defaults to 'UPDATE' so that
+                the histograms can be added next to a Snapshot.
+
+        Returns:
+            None
+        '''
+        if len(self.Cutflow.keys()) == 0: return
+        f = ROOT.TFile.Open(outfilename,openOption)
+        f.cd()
+        self.GetCutflow('cutflow',True).Write()
+        self.GetCutflow('cutflow_unweighted',False).Write()
+        f.Close()
+
+    def CutBits(self,name='CutBits',node=None):
+        '''Packs the pass/fail of every cut made with `Cut(..., record=True)` into the uint32 column `name`.
+        Bit i is set if the event passes the i-th recorded cut (see #RecordedCuts).
+
+        @param name (str, optional): Name of the column. Defaults to 'CutBits'.
+        @param node (Node, optional): Node on which to define the column. Defaults to #ActiveNode.
+
+        Raises:
+            ValueError: If no cuts have been recorded.
+
+        Returns:
+            Node: New #ActiveNode.
+        '''
+        if len(self.RecordedCuts) == 0:
+            raise ValueError('CutBits() called but no cuts have been recorded. Use Cut(..., record=True) first.')
+        bits = ['(uint32_t(CutBit_%s) << %s)'%(c,i) for i,c in enumerate(self.RecordedCuts.keys())]
+        return self.Define(name,'uint32_t(%s)'%(' | '.join(bits)),node=node)
+
+    def WriteCutBits(self,outfilename,name='cutbits',openOption='UPDATE'):
+        '''Writes which cut each bit of the #CutBits() column is, as a histogram with one bin
+        per bit labeled with the cut name and titled with its expression. Does nothing if no cuts were recorded.
+
+        @param outfilename (str): Name of the output file.
+        @param name (str, optional): Name of the histogram. Defaults to 'cutbits'.
+        @param openOption (str, optional): TFile opening options. Defaults to 'UPDATE'.
+
+        Returns:
+            None
+        '''
+        if len(self.RecordedCuts) == 0: return
+        nbits = len(self.RecordedCuts)
+        h = ROOT.TH1I(name,' && '.join(self.RecordedCuts.values()),nbits,-0.5,nbits-0.5)
+        h.SetDirectory(0)
+        for i,c in enumerate(self.RecordedCuts.keys()):
+            h.GetXaxis().SetBinLabel(i+1,c)
+        f = ROOT.TFile.Open(outfilename,openOption)
+        f.cd()
+        h.Write()
+        f.Close()
+
+    def GetCutBitLabels(self,name='cutbits'):
+        '''Reads the cut names of the bits of the CutBits column from the `name` histogram
+        written by #WriteCutBits() in the first input file.
+
+        @param name (str, optional): Name of the histogram. Defaults to 'cutbits'.
+
+        Raises:
+            NameError: If the histogram is not in the input file.
+
+        Returns:
+            list(str): Cut names in bit order.
+        '''
+        fname = self._eventsChain.GetListOfFiles()[0].GetTitle()
+        f = ROOT.TFile.Open(fname,'READ')
+        h = f.Get(name)
+        if h == None:
+            raise NameError('No %s histogram in %s. Was the snapshot made with recorded cuts?'%(name,fname))
+        labels = [h.GetXaxis().GetBinLabel(i) for i in range(1,h.GetNbinsX()+1)]
+        f.Close()
+        return labels
+
+    def ApplyCutBits(self,cuts,column='CutBits',labels=None,node=None):
+        '''Applies recorded cuts (see `Cut(..., record=True)`) by testing their bits in `column`.
+
+        @param cuts (list(str)): Names of the recorded cuts that the events must pass.
+        @param column (str, optional): Name of the packed column. Defaults to 'CutBits'.
+        @param labels (list(str), optional): Cut names in bit order. Defaults to None in which case they
+            are read from the input file with #GetCutBitLabels().
+        @param node (Node, optional): Node to apply the cut to. Defaults to #ActiveNode.
+
+        Raises:
+            NameError: If one of `cuts` was not recorded.
+
+        Returns:
+            Node: New #ActiveNode.
+        '''
+        if labels == None: labels = self.GetCutBitLabels()
+        mask = 0
+        for c in cuts:
+            if c not in labels:
+                raise NameError('Cut %s was not recorded. Recorded cuts are: %s'%(c,', '.join(labels)))
+            mask |= 1 << labels.index(c)
+        return self.Cut('%s_%s'%(column,'_'.join(cuts)),'(%s & %su) == %su'%(column,mask,mask),node=node)
+
+    def PackBits(self,name,columns,node=None,absent=False):
+        '''Packs boolean columns (ex. the HLT paths or MET filters) into uint64 bit mask columns so that
+        they can be stored and read as one branch and an OR/AND of them (#GetTriggerString(), #GetFlagString())
+        is a single mask test. Up to 64 columns go into the column `name`. With more, they are split
+        over `name`0, `name`1, ... Which column and bit each one is in is kept in #BitMasks
+        (write it next to a snapshot with #WriteBitMasks()). The columns are packed in the order given
+        (the matches of a regular expression in alphabetical order). Columns given by name that are
+        not at `node` still get their bit, set to `absent`, so that packing every input with the same
+        list of names gives the same bits whatever branches the input has.
+
+        @param name (str): Name of the mask column (or prefix of the mask columns). Must end in "Bits"
+            (see BIT_MASK_COLUMN) so that #GetBitMasks() recognises the columns in inputs made with them.
+        @param columns ([str]): Boolean columns to pack, as names or regular expressions (matched like in Snapshot()).
+        @param node (Node, optional): Node on which to define the columns. Defaults to #ActiveNode.
+        @param absent (bool, optional): Value of the bits of named columns that are not at `node`. Defaults to False,
+            so that an OR of them (#GetTriggerString()) ignores them. Use True for columns tested with an AND (#GetFlagString()).
+
+        Raises:
+            ValueError: If `name` does not end in "Bits" or none of the `columns` are boolean columns at `node`.
+
+        Returns:
+            Node: New #ActiveNode.
+        '''
+        if node == None: node = self.ActiveNode
+        if not re.match(r'\w*Bits$',name):
+            raise ValueError('PackBits(): the mask column name %s does not end in "Bits".'%name)
+        available = [str(c) for c in node.DataFrame.GetColumnNames() if str(node.DataFrame.GetColumnType(c)) in ['Bool_t','bool']]
+        tobits, missing = [], []
+        for p in columns:
+            matches = sorted([c for c in available if re.match('(%s)$'%p,c)])
+            if len(matches) == 0 and re.match(r'\w+$',p): # named but not in this input
+                matches = [p]
+                missing.append(p)
+            tobits.extend([c for c in matches if c not in tobits])
+        if len(tobits) == len(missing):
+            raise ValueError('PackBits(): no boolean columns match %s.'%(', '.join(columns)))
+
+        chunks = [tobits[i:i+64] for i in range(0,len(tobits),64)]
+        for i,chunk in enumerate(chunks):
+            col = name if len(chunks) == 1 else '%s%s'%(name,i)
+            bits = ['(ULong64_t(%s) << %s)'%(c if c not in missing else ('true' if absent else 'false'),ibit) for ibit,c in enumerate(chunk)]
+            node = self.Define(col,'ULong64_t(%s)'%(' | '.join(bits)),node=node)
+            self.BitMasks[col] = chunk
+        return node
+
+    def WriteBitMasks(self,outfilename,openOption='UPDATE'):
+        '''Writes which column each bit of the #PackBits() columns is, as one histogram per
+        mask column (named "bits_<mask column>") with one bin per bit labeled with the column name.
+        Does nothing if no columns were packed.
+
+        @param outfilename (str): Name of the output file.
+        @param openOption (str, optional): TFile opening options. Defaults to 'UPDATE'.
+
+        Returns:
+            None
+        '''
+        if len(self.BitMasks) == 0: return
+        f = ROOT.TFile.Open(outfilename,openOption)
+        f.cd()
+        for col,labels in self.BitMasks.items():
+            h = ROOT.TH1I('bits_'+col,col,len(labels),-0.5,len(labels)-0.5)
+            h.SetDirectory(0)
+            for i,c in enumerate(labels):
+                h.GetXaxis().SetBinLabel(i+1,c)
+            h.Write()
+        f.Close()
+
+    def GetBitMasks(self):
+        '''Bit mask columns made with #PackBits(), here or when the input was made
+        (read from the "bits_*" histograms of #WriteBitMasks() in the input files). The input files are
+        only opened if the input has uint64 mask columns (see BIT_MASK_COLUMN).
+
+        Raises:
+            ValueError: If the input files do not all have the same bits (ex. made from inputs with different HLT paths),
+                since one expression cannot test them all.
+
+        Returns:
+            OrderedDict: Mask column -> packed column names in bit order.
+        '''
+        if self._inputBitMasks == None:
+            base = self.BaseNode.DataFrame
+            hasMasks = any(re.match('(%s)$'%BIT_MASK_COLUMN,str(c)) and str(base.GetColumnType(c)) in ['ULong64_t','unsigned long long']
+                           for c in base.GetColumnNames())
+            layouts = OrderedDict()
+            for element in (self._eventsChain.GetListOfFiles() if hasMasks else []):
+                masks = OrderedDict()
+                f = ROOT.TFile.Open(element.GetTitle(),'READ')
+                for key in f.GetListOfKeys():
+                    if key.GetName().startswith('bits_') and key.GetClassName() == 'TH1I':
+                        h = key.ReadObj()
+                        masks[key.GetName()[5:]] = [h.GetXaxis().GetBinLabel(i) for i in range(1,h.GetNbinsX()+1)]
+                f.Close()
+                layouts[element.GetTitle()] = masks
+            different = [f for f,masks in layouts.items() if masks != list(layouts.values())[0]]
+            if len(different) > 0:
+                raise ValueError('The bit masks (bits_* histograms) of %s differ from those of %s. Make these inputs with the same packed columns, or without PackBits().'%(', '.join(different),list(layouts.keys())[0]))
+            self._inputBitMasks = list(layouts.values())[0] if len(layouts) > 0 else OrderedDict()
+        out = OrderedDict(self._inputBitMasks)
+        out.update(self.BitMasks)
+        return out
+
+    def _packedBits(self,columns):
+        '''Splits `columns` into those that are packed in a bit mask column (see #GetBitMasks())
+        and the others.
+
+        Returns:
+            (OrderedDict, list): Mask column -> mask of the bits of `columns` in it, and the columns not packed.
+        '''
+        masks = self.GetBitMasks()
+        packed = OrderedDict()
+        rest = []
+        for c in columns:
+            for col,labels in masks.items():
+                if c in labels:
+                    packed[col] = packed.get(col,0) | (1 << labels.index(c))
+                    break
+            else:
+                rest.append(c)
+        return packed,rest
+
+    def UnpackBits(self,columns,node=None):
+        '''Defines boolean columns again from the bit mask columns they were packed into (see #PackBits()),
+        for expressions that use them directly.
+
+        @param columns ([str]): Names of the packed columns.
+        @param node (Node, optional): Node on which to define the columns. Defaults to #ActiveNode.
+
+        Raises:
+            NameError: If a column is not packed.
+
+        Returns:
+            Node: New #ActiveNode.
+        '''
+        if node == None: node = self.ActiveNode
+        packed,rest = self._packedBits(columns)
+        if len(rest) > 0:
+            raise NameError('Columns %s are not packed in any bit mask column.'%(', '.join(rest)))
+        masks = self.GetBitMasks()
+        for c in columns:
+            for col,labels in masks.items():
+                if c in labels:
+                    node = self.Define(c,'bool((%s >> %s) & 1ull)'%(col,labels.index(c)),node=node)
+                    break
+        return node
+
     #---------------------#
     # Corrections/Weights #
     #---------------------#
@@ -870,7 +1712,7 @@ class analyzer(object):
 
         return correctionsToApply
 
-    def MakeWeightCols(self,name='',node=None,correctionNames=None,dropList=[],correlations=[],extraNominal=''):
+    def MakeWeightCols(self,name='',node=None,correctionNames=None,dropList=[],correlations=[],extraNominal='',asVector=False):
         '''Makes columns/variables to store total weights based on the Corrections that have been added.
 
         This function automates the calculation of the columns that store the nominal weight and the 
@@ -895,6 +1737,10 @@ class analyzer(object):
                 to correlate syst1 and syst2, provide [("syst1","syst2")]. To anti-correlate, add a "!" infront of the correction name. Ex. [("syst1","!syst2")]
         @param extraNominal (str): String to prepend to all weight calculations. Will be multiplied by the rest of the pieces
                 put together automatically. Defaults to ''.
+        @param asVector (bool): Calculate all of the weights in one compiled `RVec<double>` column, `weights<name>`
+                (nominal first), where the nominal product is computed once per event and each variation is derived from it
+                by swapping the ratio of the varied and nominal factors. The `weight_<name>__*` columns are still made,
+                as accessors into the vector. Defaults to False.
 
         Returns:
             Node: New #ActiveNode.
@@ -917,6 +1763,9 @@ class analyzer(object):
         if weights['nominal'] == '':  weights['nominal'] = '1'
 
         # Vary nominal weight for each correction ("weight" and "uncert")
+        # (and keep track of what changed wrt the nominal for asVector)
+        weightOrder = ['nominal']
+        swaps, extras = {}, {}
         countedByCorrelation = []
         for corrname in correctionsToApply:
             if corrname in countedByCorrelation:
@@ -934,23 +1783,36 @@ class analyzer(object):
             if corr.GetType() == 'corr': continue
             weights[corrname+'_up'] = weights['nominal']
             weights[corrname+'_down'] = weights['nominal']
+            for v in ['_up','_down']:
+                weightOrder.append(corrname+v)
+                swaps[corrname+v], extras[corrname+v] = [], []
 
             for correctionName in correlatedWithOthers:
                 if corr.GetType() == 'weight':
                     if correctionName.startswith('!'): #anti-correlated
                         weights[corrname+'_up'] = weights[corrname+'_up'].replace(' '+correctionName[1:]+'__nom',' '+correctionName[1:]+'__down') #extra space at beginning of replace to avoid substrings
                         weights[corrname+'_down'] = weights[corrname+'_down'].replace(' '+correctionName[1:]+'__nom',' '+correctionName[1:]+'__up')
+                        if ' '+correctionName[1:]+'__nom' in weights['nominal']: # replace() above is a no-op otherwise
+                            swaps[corrname+'_up'].append((correctionName[1:]+'__nom',correctionName[1:]+'__down'))
+                            swaps[corrname+'_down'].append((correctionName[1:]+'__nom',correctionName[1:]+'__up'))
                     else:
                         weights[corrname+'_up'] = weights[corrname+'_up'].replace(' '+correctionName+'__nom',' '+correctionName+'__up')
                         weights[corrname+'_down'] = weights[corrname+'_down'].replace(' '+correctionName+'__nom',' '+correctionName+'__down')
+                        if ' '+correctionName+'__nom' in weights['nominal']:
+                            swaps[corrname+'_up'].append((correctionName+'__nom',correctionName+'__up'))
+                            swaps[corrname+'_down'].append((correctionName+'__nom',correctionName+'__down'))
             
                 elif corr.GetType() == 'uncert':
                     if correctionName.startswith('!'): #anti-correlated
                         weights[corrname+'_up'] += ' * '+correctionName+'__down'
                         weights[corrname+'_down'] += ' * '+correctionName+'__up'
+                        extras[corrname+'_up'].append(correctionName+'__down')
+                        extras[corrname+'_down'].append(correctionName+'__up')
                     else:
                         weights[corrname+'_up'] += ' * '+correctionName+'__up'
                         weights[corrname+'_down'] += ' * '+correctionName+'__down'
+                        extras[corrname+'_up'].append(correctionName+'__up')
+                        extras[corrname+'_down'].append(correctionName+'__down')
 
                 elif corr.GetType() == 'corr':
                     continue
@@ -960,12 +1822,75 @@ class analyzer(object):
 
         # Make a node with all weights calculated
         returnNode = node
-        for weight in weights.keys():
-            returnNode = self.Define('weight%s__'%(namemod)+weight,weights[weight],returnNode,nodetype='Weight')
+        if asVector:
+            vecname = 'weights%s'%namemod
+            returnNode = self.Define(vecname,self._weightVectorKernel(weights,weightOrder,swaps,extras),returnNode,nodetype='Weight')
+            self._templateWeights[tuple(['weight%s__'%(namemod)+w for w in weightOrder])] = vecname
+            self._weightStrings[vecname] = (weightOrder, dict(weights))
+            for i,weight in enumerate(weightOrder):
+                returnNode = self.Define('weight%s__'%(namemod)+weight,'%s[%s]'%(vecname,i),returnNode,nodetype='Weight')
+        else:
+            for weight in weights.keys():
+                returnNode = self.Define('weight%s__'%(namemod)+weight,weights[weight],returnNode,nodetype='Weight')
         
         # self.TrackNode(returnNode)
         return self.SetActiveNode(returnNode)
 
+    def _weightVectorKernel(self,weights,weightOrder,swaps,extras):
+        '''Body of the `RVec<double>` weight column made by #MakeWeightCols() with `asVector=True`.
+        The nominal product is calculated once and each variation is the nominal times the
+        ratios of the swapped factors (and times any "uncert" factors). If one of the nominal
+        factors being divided out is zero, the full product for that variation is used instead.
+
+        Returns:
+            str: C++ function body (with return statement) for Define().
+        '''
+        body = 'const double nominal = %s; ROOT::RVec<double> w(%s); w[0] = nominal; '%(weights['nominal'],len(weightOrder))
+        for i,weight in enumerate(weightOrder):
+            if weight == 'nominal': continue
+            ratio = ''.join([' * (double(%s)/%s)'%(new,old) for old,new in swaps[weight]])
+            ratio += ''.join([' * %s'%extra for extra in extras[weight]])
+            if len(swaps[weight]) > 0:
+                nonzero = ' && '.join(['%s != 0'%old for old,new in swaps[weight]])
+                body += 'w[%s] = (%s) ? nominal%s : double(%s); '%(i,nonzero,ratio,weights[weight])
+            else:
+                body += 'w[%s] = nominal%s; '%(i,ratio)
+        body += 'return w;'
+        return body
+
+    def CheckWeightCols(self,name='',node=None,tolerance=1e-6):
+        '''Check the weights made by #MakeWeightCols() with `asVector=True` against the same
+        weights built as one string product per variation (as with `asVector=False`).
+        Runs an event loop over `node` and is meant for validating a new set of corrections.
+
+        @param name (str): Name given to MakeWeightCols() for the group of weights. Defaults to ''.
+        @param node (Node): Node with the weight columns. Defaults to #ActiveNode.
+        @param tolerance (float): Largest relative difference allowed. Defaults to 1e-6.
+
+        Raises:
+            NameError: If the weights were not made with `asVector=True`.
+            ValueError: If any event has a weight that differs by more than `tolerance`.
+
+        Returns:
+            int: Number of events checked.
+        '''
+        if node == None: node = self.ActiveNode
+        vecname = 'weights%s'%('' if name == '' else '_'+name)
+        if vecname not in self._weightStrings:
+            raise NameError('No weight vector `%s`. Was MakeWeightCols(name="%s",asVector=True) called?'%(vecname,name))
+        weightOrder, weights = self._weightStrings[vecname]
+        diffs = ['std::abs(%s[%s] - double(%s))/std::max(1.,std::abs(double(%s)))'%(vecname,i,weights[w],weights[w]) for i,w in enumerate(weightOrder)]
+        check = node.Define('%s_check'%vecname,'ROOT::RVec<double>{%s}'%(', '.join(diffs)),silent=True)
+        worst = check.DataFrame.Define('%s_worst'%vecname,'ROOT::VecOps::Max(%s_check)'%vecname)
+        maxdiff = worst.Max('%s_worst'%vecname)
+        nchecked = worst.Count()
+        if maxdiff.GetValue() > tolerance:
+            bad = check.DataFrame.Filter('ROOT::VecOps::Max(%s_check) > %s'%(vecname,tolerance))
+            perweight = [int(bad.Filter('%s_check[%s] > %s'%(vecname,i,tolerance)).Count().GetValue()) for i in range(len(weightOrder))]
+            raise ValueError('Weight vector `%s` differs from the string-built weights by up to %s: %s'%(
+                vecname,maxdiff.GetValue(),', '.join(['%s (%s events)'%(w,n) for w,n in zip(weightOrder,perweight) if n > 0])))
+        return nchecked.GetValue()
+
     def GetWeightName(self,corr,variation,name=""):
         '''Return the branch/column name of the requested weight
 
@@ -989,7 +1914,7 @@ class analyzer(object):
             raise NameError("The weight name `%s` does not exist in the current columns. Are you sure the correction has been made and MakeWeightCols has been called?"%weightname)
         return weightname
 
-    def MakeTemplateHistos(self,templateHist,variables,node=None,lazy=True):
+    def MakeTemplateHistos(self,templateHist,variables,node=None,lazy=True,accumulate=True):
         '''Generates the uncertainty template histograms based on the weights created by #MakeWeightCols(). 
 
         @param templateHist (TH1,TH2,TH3,tuple): A TH1, TH2, TH3, or a tuple describing the TH* options.
@@ -999,6 +1924,13 @@ class analyzer(object):
         @param lazy (bool): Make the action lazy which, in this case, means skipping the axis title
             naming. The axis names will be saved in meta data of the returned group (Group.item_meta).
             If using HistGroup.Do(), the axis titles will later be applied automatically.
+        @param accumulate (bool): Fill the templates of all weights with one TemplateFiller action
+            (see TemplateFiller.cc) instead of one Histo1D/2D action per weight. Ignored (one action
+            per weight) for 3D templates and when variations have been registered with #Vary(). Defaults to True.
+
+        The templates are booked with #BookCached() (except when variations have been registered,
+        since the varied templates are made from the nominal RResultPtr) so templates already in
+        the #ResultCache are loaded from it instead of being filled again.
 
         Returns:
             HistGroup: Uncertainty template histograms.
@@ -1013,7 +1945,11 @@ class analyzer(object):
 
         if isinstance(variables,str): variables = [variables]
 
-        for cname in weight_cols:
+        accumulated = accumulate and dimension < 3 and len(self.Variations) == 0
+        if accumulated:
+            self._accumulateTemplates(templateHist,variables,weight_cols,node,out,lazy)
+
+        for cname in ([] if accumulated else weight_cols):
             histname = '%s__%s'%(baseName,cname.replace('weight__',''))
             histtitle = '%s__%s'%(baseTitle,cname.replace('weight__','').replace('__nominal',''))
 
@@ -1021,20 +1957,33 @@ class analyzer(object):
             template_attr = (histname,histtitle) + binningTuple
 
             if dimension == 1: 
-                thishist = node.DataFrame.Histo1D(template_attr,variables[0],cname)
+                book = lambda: node.DataFrame.Histo1D(template_attr,variables[0],cname)
                 meta_data = {"xtitle":variables[0]}
             elif dimension == 2: 
-                thishist = node.DataFrame.Histo2D(template_attr,variables[0],variables[1],cname)
+                book = lambda: node.DataFrame.Histo2D(template_attr,variables[0],variables[1],cname)
                 meta_data = {"xtitle":variables[0], "ytitle":variables[1]}
             elif dimension == 3: 
-                thishist = node.DataFrame.Histo3D(template_attr,variables[0],variables[1],variables[2],cname)
+                book = lambda: node.DataFrame.Histo3D(template_attr,variables[0],variables[1],variables[2],cname)
                 meta_data = {"xtitle":variables[0], "ytitle":variables[1], "ztitle":variables[2]}
+            if len(self.Variations) == 0:
+                thishist = self.BookCached(book,('Template',template_attr,tuple(variables),cname),node)
+            else:
+                thishist = book()
 
             if lazy:
                 out.Add(histname,thishist,meta_data)
             else:
                 out.Add(histname,thishist)
 
+            # Varied copies of the nominal (booked before the loop runs so they are filled with it)
+            if cname == 'weight__nominal' and len(self.Variations) > 0:
+                varied = ROOT.RDF.Experimental.VariationsFor(thishist)
+                for vname,vtags in self.Variations.items():
+                    for vtag in vtags:
+                        out.Add('%s__%s'%(baseName,vtag),
+                                VariationResult(varied,'%s:%s'%(vname,vtag),'%s__%s'%(baseName,vtag),'%s__%s'%(baseTitle,vtag)),
+                                meta_data)
+
         # Wait to GetValue and SetTitle so that the histogram filling happens simultaneously
         if not lazy:
             for k in out.keys():
@@ -1050,6 +1999,75 @@ class analyzer(object):
 
         return out
 
+    def _accumulateTemplates(self,templateHist,variables,weight_cols,node,out,lazy=True):
+        '''Books the templates of #MakeTemplateHistos() as a single TemplateFiller action.
+        The variables are cast to double and the weights packed into one RVec<double> column
+        (both defined on `node` unless they already exist) and the histograms for each weight are
+        added to `out` as TemplateResult items, in the same order and with the same names as the
+        one-action-per-weight path.
+        '''
+        global _templateFillerCompiled
+        if not _templateFillerCompiled:
+            CompileCpp(os.path.dirname(os.path.abspath(__file__))+'/TemplateFiller.cc')
+            _templateFillerCompiled = True
+
+        baseName = templateHist.GetName()
+        baseTitle = templateHist.GetTitle()
+        columns = [str(c) for c in node.DataFrame.GetColumnNames()]
+        df = node.DataFrame
+
+        # x, y (= x for 1D) as double
+        xy = []
+        for v in variables[:2]:
+            vcol = 'TemplateVar__'+v
+            if vcol not in columns:
+                _requireHeaders(v)
+                df = df.Define(vcol,'double(%s)'%v)
+                columns.append(vcol)
+            xy.append(vcol)
+        if len(xy) == 1: xy.append(xy[0])
+
+        # all weights in one column
+        # (reusing a MakeWeightCols(asVector=True) column if it has exactly these weights)
+        for packed in self._templateWeights.keys():
+            if sorted(packed) == sorted(weight_cols) and self._templateWeights[packed] in columns:
+                weight_cols = list(packed)
+                break
+        if tuple(weight_cols) not in self._templateWeights.keys():
+            self._templateWeights[tuple(weight_cols)] = 'TemplateWeights%s'%len(self._templateWeights)
+        wcol = self._templateWeights[tuple(weight_cols)]
+        if wcol not in columns:
+            wexpr = 'ROOT::RVec<double>{%s}'%(','.join(['double(%s)'%w for w in weight_cols]))
+            _requireHeaders(wexpr)
+            df = df.Define(wcol,wexpr)
+
+        names = ROOT.std.vector('std::string')()
+        for cname in weight_cols:
+            names.push_back('%s__%s'%(baseName,cname.replace('weight__','')))
+        # only booked if one of the templates is not in the result cache
+        templates = []
+        def bookFiller():
+            if len(templates) == 0:
+                templates.append(ROOT.BookTemplateFiller(ROOT.RDF.AsRNode(df),templateHist,names,xy[0],xy[1],wcol))
+            return templates[0]
+
+        binningTuple = GetHistBinningTuple(templateHist)[0]
+        meta_data = {"xtitle":variables[0]}
+        if len(variables) > 1: meta_data["ytitle"] = variables[1]
+        for i,cname in enumerate(weight_cols):
+            histname = '%s__%s'%(baseName,cname.replace('weight__',''))
+            histtitle = '%s__%s'%(baseTitle,cname.replace('weight__','').replace('__nominal',''))
+            # same key as the one-action-per-weight path, which fills identical histograms
+            h = self.BookCached(lambda i=i,histname=histname,histtitle=histtitle: TemplateResult(bookFiller(),i,histname,histtitle),
+                                ('Template',(histname,histtitle)+binningTuple,tuple(variables),cname),
+                                node,histname,histtitle)
+            if lazy:
+                out.Add(histname,h,meta_data)
+            else: # axis titles are set by MakeTemplateHistos()
+                out.Add(histname,h)
+
+        return out
+
     def DrawTemplates(self,hGroup,saveLocation,projection='X',projectionArgs=(),fileType='pdf'):
         '''Draw the template uncertainty histograms created by #MakeTemplateHistos(). 
 
@@ -1275,6 +2293,47 @@ a.CalibrateVars(varCalibDict,evalArgs,"CorrectedFatJets")
 
         return nminusones
 
+    def Nminus1Histos(self,cutgroup,binning,weight=None,node=None,name=''):
+        '''Build the N-1 node structure with #Nminus1() and book one histogram
+        per N-1 node, of the variable whose cut was dropped. The variable name is taken
+        from the cut name with any "_cut" suffix removed (ex. "pt_cut" -> "pt") and must
+        be a column on the N-1 node.
+
+        Nothing is evaluated here. All histograms hang off of the same RDataFrame so they
+        are filled together in one event loop, the first time any of them is accessed
+        (ex. by `HistGroup.Do('Write')`). Do not call GetValue() on them one at a time
+        before all are booked. Histograms already in the #ResultCache are loaded from it
+        (see #BookCached()).
+
+        @param cutgroup (CutGroup): Group of N cuts to apply.
+        @param binning (dict): Formatted as `{<variable name>: [nbins, low, high]}`. N-1 nodes
+            whose variable is not in `binning` are skipped.
+        @param weight (str, optional): Weight column to fill with. Defaults to None (unweighted).
+        @param node (Node, optional): Node to build on. Defaults to #ActiveNode.
+        @param name (str, optional): Name for the output HistGroup. Defaults to '' in which case
+            "nminus1Hists" will be used.
+
+        Returns:
+            HistGroup: N-1 histograms keyed by variable name.
+        '''
+        nminusones = self.Nminus1(cutgroup,node)
+        out = HistGroup(name if name != '' else 'nminus1Hists')
+
+        for cut in cutgroup.keys():
+            var = cut.replace('_cut','')
+            if var not in binning.keys():
+                print ('Nminus1Histos: No binning provided for %s. Skipping.'%var)
+                continue
+            hist_tuple = (var,var,binning[var][0],binning[var][1],binning[var][2])
+            df = nminusones[cut].DataFrame
+            if weight == None:
+                h = self.BookCached(lambda: df.Histo1D(hist_tuple,var),('Histo',hist_tuple,var),nminusones[cut])
+            else:
+                h = self.BookCached(lambda: df.Histo1D(hist_tuple,var,weight),('Histo',hist_tuple,var,weight),nminusones[cut])
+            out.Add(var,h)
+
+        return out
+
     def PrintNodeTree(self,outfilename,verbose=False,toSkip=['SubCollDefine']):
         '''Print a PDF image of the node structure of the analysis.
         Requires python graphviz package which should be an installed dependency.
@@ -1333,6 +2392,8 @@ a.CalibrateVars(varCalibDict,evalArgs,"CorrectedFatJets")
             #ActiveNode will be used.
         @param weight (str, optional): Weight (as a string) to apply to all histograms. Defaults to None.
 
+        The histograms are booked with #BookCached().
+
         Returns:
             dict: Dictionary with same structure as the input (column names for keys) with 
                 new histograms evaluated on the #ActiveNode as the values.
@@ -1350,21 +2411,23 @@ a.CalibrateVars(varCalibDict,evalArgs,"CorrectedFatJets")
             # Get name for histgroup entry
             entry_name = '_vs_'.join(varnames)+'_'+out.name
             # Add weight to args if specified
+            df = self.DataFrame
             if len(varnames) == 1:
                 if weight == None: 
-                    h = self.DataFrame.Histo1D(this_tuple,varnames[0])
+                    book = lambda: df.Histo1D(this_tuple,varnames[0])
                 else:
-                    h = self.DataFrame.Histo1D(this_tuple,varnames[0],weight)
+                    book = lambda: df.Histo1D(this_tuple,varnames[0],weight)
             elif len(varnames) == 2:
                 if weight == None: 
-                    h = self.DataFrame.Histo2D(this_tuple,varnames[0],varnames[1])
+                    book = lambda: df.Histo2D(this_tuple,varnames[0],varnames[1])
                 else:
-                    h = self.DataFrame.Histo2D(this_tuple,varnames[0],varnames[1],weight)
+                    book = lambda: df.Histo2D(this_tuple,varnames[0],varnames[1],weight)
             elif len(varnames) == 3:
                 if weight == None:
-                    h = self.DataFrame.Histo3D(this_tuple,varnames[0],varnames[1],varnames[2])
+                    book = lambda: df.Histo3D(this_tuple,varnames[0],varnames[1],varnames[2])
                 else:
-                    h = self.DataFrame.Histo3D(this_tuple,varnames[0],varnames[1],varnames[2],weight)
+                    book = lambda: df.Histo3D(this_tuple,varnames[0],varnames[1],varnames[2],weight)
+            h = self.BookCached(book,('Histo',this_tuple,tuple(varnames),weight))
             out.Add(entry_name, h)
            
         return out
@@ -1524,11 +2587,34 @@ class Node(object):
             Node: New Node object with new column added.
         '''
         if not silent: print('Defining %s: %s' %(name,var))
+        _requireHeaders(var)
         newNodeType = 'Define' if nodetype == None else nodetype
         newNode = Node(name,self.DataFrame.Define(name,var),children=[],parent=self,action=var,nodetype=newNodeType)
         self.SetChild(newNode)
         return newNode
 
+    def Vary(self,columns,expression,variationTags,variationName,silent=False):
+        '''Produces a new Node with systematic variations registered for `columns`.
+
+        @param columns ([str]): Columns to vary.
+        @param expression (str): One-line C++ string that evaluates to the varied values.
+        @param variationTags ([str]): Names of the individual variations.
+        @param variationName (str): Name of the systematic.
+        @param silent (bool, optional): If False, prints the action to the terminal. Defaults to False.
+
+        Returns:
+            Node: New Node object with the variations registered.
+        '''
+        if not silent: print('Varying %s (%s): %s' %(', '.join(columns),variationName,expression))
+        _requireHeaders(expression)
+        if len(columns) == 1:
+            newDF = self.DataFrame.Vary(columns[0],expression,variationTags,variationName)
+        else:
+            newDF = self.DataFrame.Vary(columns,expression,variationTags,variationName)
+        newNode = Node(variationName,newDF,children=[],parent=self,action=expression,nodetype='Vary')
+        self.SetChild(newNode)
+        return newNode
+
     def Cut(self,name,cut,nodetype=None,silent=False):
         '''Produces a new Node with the provided cut/filter applied.
 
@@ -1542,6 +2628,7 @@ class Node(object):
             Node: New Node object with cut applied.
         '''
         if not silent: print('Filtering %s: %s' %(name,cut))
+        _requireHeaders(cut)
         newNodeType = 'Define' if nodetype == None else nodetype
         newNode = Node(name,self.DataFrame.Filter(cut,name),children=[],parent=self,action=cut,nodetype=newNodeType)
         self.SetChild(newNode)
@@ -1556,6 +2643,7 @@ class Node(object):
         Returns:
             dict: Dictionary with keys "pass" and "fail" corresponding to the passing and failing Nodes stored as values.
         '''
+        _requireHeaders(discriminator)
         passfail = {
             "pass":Node(name+"_pass",self.DataFrame.Filter(discriminator,name+"_pass"),children=[],parent=self,action=discriminator,nodetype='Cut'),
             "fail":Node(name+"_fail",self.DataFrame.Filter("!("+discriminator+")",name+"_fail"),children=[],parent=self,action="!("+discriminator+")",nodetype='Cut')
@@ -1603,9 +2691,11 @@ class Node(object):
         return Node(self.name+'_range', self.DataFrame.Range(*argv),
                     action=action_name, nodetype='range', children=[], parent=self)
 
-    def Snapshot(self,columns,outfilename,treename,lazy=False,openOption='RECREATE'): # columns can be a list or a regular expression or 'all'
+    def Snapshot(self,columns,outfilename,treename,lazy=False,openOption='RECREATE',
+                 compressionAlgorithm='ZLIB',compressionLevel=1,basketSize=None,autoFlush=None,precision=None): # columns can be a list or a regular expression or 'all'
         '''Takes a snapshot of the RDataFrame corresponding to this Node.
-        Compression algorithm set to 1 (ZLIB) and compression level are set to 1.
+        Compression algorithm and level default to ZLIB and 1. LZ4 is faster to read back
+        (good for intermediate files read many times) and ZSTD/LZMA give smaller files.
 
         IMPORTANT: When writing a variable size array through Snapshot, it is required
         that the column indicating its size is also written out and it appears before
@@ -1618,28 +2708,71 @@ class Node(object):
         @param treename ([type]): Name of the output TTree
         @param lazy (bool, optional): If False, the RDataFrame actions until this point will be executed here. Defaults to False.
         @param openOption (str, optional): TFile opening options. Defaults to 'RECREATE'.
+        @param compressionAlgorithm (str, optional): ZLIB, LZMA, LZ4 or ZSTD. Defaults to 'ZLIB'.
+        @param compressionLevel (int, optional): Defaults to 1.
+        @param basketSize (int, optional): Basket size in bytes. Defaults to None (ROOT default).
+        @param autoFlush (int, optional): Cluster size (see TTree::SetAutoFlush()). Defaults to None (ROOT default).
+        @param precision (dict, optional): Per-column precision policy as {column regex: mantissa bits}. Float (and RVec<float>)
+                columns fully matching a regex (the first that does, so use an OrderedDict for overlapping ones) are
+                rounded to that many of the 23 mantissa bits before being written (see ReducedPrecision.cc). They are still
+                Float_t branches but compress to less. The relative error is at most 2^-(bits+1).
+                Defaults to None (full precision).
+
+        Raises:
+            ValueError: If the compression algorithm is not known.
 
         Returns:
             None
         '''
+        if compressionAlgorithm.upper() not in COMPRESSION_ALGORITHMS:
+            raise ValueError('Compression algorithm %s not supported. Options are %s.'%(compressionAlgorithm,', '.join(COMPRESSION_ALGORITHMS.keys())))
         opts = ROOT.RDF.RSnapshotOptions()
         opts.fLazy = lazy
         opts.fMode = openOption
-        opts.fCompressionAlgorithm =1 
-        opts.fCompressionLevel = 1
+        opts.fCompressionAlgorithm = COMPRESSION_ALGORITHMS[compressionAlgorithm.upper()]
+        opts.fCompressionLevel = compressionLevel
+        if basketSize != None: opts.fBasketSize = basketSize
+        if autoFlush != None: opts.fAutoFlush = autoFlush
         print("Snapshotting columns: %s"%columns)
         print("Saving tree %s to file %s"%(treename,outfilename))
+        df = self.DataFrame if precision == None else self._reducePrecision(precision)
         if columns == 'all':
-            self.DataFrame.Snapshot(treename,outfilename,'',opts)
+            df.Snapshot(treename,outfilename,'',opts)
         elif type(columns) == str:
-            self.DataFrame.Snapshot(treename,outfilename,columns,opts)
+            df.Snapshot(treename,outfilename,columns,opts)
         else:
             column_vec = ''
             for c in columns:
                 if c == '': continue
                 column_vec += c+'|'
             column_vec = column_vec[:-1]
-            self.DataFrame.Snapshot(treename,outfilename,column_vec,opts)
+            df.Snapshot(treename,outfilename,column_vec,opts)
+
+    def _reducePrecision(self,precision):
+        '''Redefines the float columns matched by the `precision` policy (see #Snapshot()) with their
+        mantissas truncated. Only used for the snapshot, so the node itself is not changed.
+
+        @param precision (dict): {column regex: mantissa bits}.
+
+        Returns:
+            RNode: DataFrame to snapshot.
+        '''
+        global _reducedPrecisionCompiled
+        if not _reducedPrecisionCompiled:
+            CompileCpp(os.path.dirname(os.path.abspath(__file__))+'/ReducedPrecision.cc')
+            _reducedPrecisionCompiled = True
+        df = ROOT.RDF.AsRNode(self.DataFrame)
+        for c in [str(c) for c in self.DataFrame.GetColumnNames() if '.' not in str(c)]:
+            ctype = str(self.DataFrame.GetColumnType(c))
+            if ctype not in ['Float_t','float'] and not (('RVec' in ctype or 'vector' in ctype) and ('<float>' in ctype or '<Float_t>' in ctype)):
+                continue
+            for pattern,bits in precision.items():
+                if re.match('(%s)$'%pattern,c):
+                    expr = 'TruncateMantissa(%s,%s)'%(c,bits)
+                    _requireHeaders(expr)
+                    df = ROOT.RDF.AsRNode(df.Redefine(c,expr))
+                    break
+        return df
 
     def GetBaseNode(self):
         '''Returns the top-most parent Node by climbing node tree until a Node with no parent is reached.
@@ -1929,6 +3062,258 @@ class HistGroup(Group):
             self.items[key] = self._ptrs[key].GetValue()
         return self.items[key]
 
+class DeferredHist(object):
+    '''Stands in for a histogram that only exists inside another RDataFrame result so it can be
+    stored in a HistGroup next to regular RResultPtrs. Accessing it evaluates the result (and so
+    the event loop, if it has not run yet) and names the histogram `name`.'''
+    def __init__(self,name,title):
+        '''Constructor
+
+        @param name (str): Name to give the histogram.
+        @param title (str): Title to give the histogram.
+        '''
+        self.name = name
+        self.title = title
+        self._hist = None
+
+    def _fetch(self):
+        raise NotImplementedError('DeferredHist is a base class.')
+
+    def GetHandle(self):
+        '''The lazy RDataFrame result the histogram comes from, to pass to ROOT.RDF.RunGraphs().
+
+        Returns:
+            RResultPtr or None: None if the result cannot be passed on its own (it is filled with another one).
+        '''
+        return None
+
+    def GetValue(self):
+        '''Get the histogram.
+
+        Returns:
+            TH1: Histogram.
+        '''
+        if self._hist == None:
+            self._hist = self._fetch()
+            self._hist.SetName(self.name)
+            self._hist.SetTitle(self.title)
+        return self._hist
+
+    def __getattr__(self,attr):
+        return getattr(self.GetValue(),attr)
+
+class VariationResult(DeferredHist):
+    '''One varied histogram from an RDataFrame RResultMap (see analyzer.Vary()).
+    It is filled with the nominal result the map was made from.'''
+    def __init__(self,resultMap,key,name,title):
+        '''Constructor
+
+        @param resultMap (RResultMap): Output of ROOT.RDF.Experimental.VariationsFor().
+        @param key (str): Variation key in the map ("<variation name>:<tag>").
+        @param name (str): Name to give the histogram.
+        @param title (str): Title to give the histogram.
+        '''
+        super(VariationResult,self).__init__(name,title)
+        self.resultMap = resultMap
+        self.key = key
+
+    def _fetch(self):
+        return self.resultMap[self.key]
+
+class TemplateResult(DeferredHist):
+    '''One weight's histogram from a TemplateFiller action (see analyzer.MakeTemplateHistos()).'''
+    def __init__(self,resultPtr,index,name,title):
+        '''Constructor
+
+        @param resultPtr (RResultPtr<TemplateSet>): Booked TemplateFiller action.
+        @param index (int): Index of the weight in the action.
+        @param name (str): Name to give the histogram.
+        @param title (str): Title to give the histogram.
+        '''
+        super(TemplateResult,self).__init__(name,title)
+        self.resultPtr = resultPtr
+        self.index = index
+
+    def GetHandle(self):
+        return self.resultPtr
+
+    def _fetch(self):
+        return self.resultPtr.GetValue().at(self.index)
+
+class CachedResult(DeferredHist):
+    '''A result booked through a ResultCache (see analyzer.BookCached()). If the cache already
+    holds the result nothing is booked and GetValue() loads it from disk. Otherwise the result is
+    booked and written to the cache the first time it is accessed.
+    Scalar results (ex. Count() or Sum()) are returned as float.'''
+    def __init__(self,cache,key,book,name=None,title=None):
+        '''Constructor
+
+        @param cache (ResultCache): Cache to load the result from or store it in.
+        @param key (str): Key of the result (see analyzer.ResultKey()).
+        @param book (callable): Books the result and returns the RResultPtr (or DeferredHist). Only called on a cache miss.
+        @param name (str, optional): Name to give the histogram. Defaults to None (keep its own name).
+        @param title (str, optional): Title to give the histogram. Defaults to None (keep its own title).
+        '''
+        super(CachedResult,self).__init__(name,title)
+        self.cache = cache
+        self.key = key
+        self._result = None if cache.Has(key) else book()
+
+    def GetHandle(self):
+        '''The lazy RDataFrame result, to pass to ROOT.RDF.RunGraphs().
+
+        Returns:
+            RResultPtr or None: None if the result comes from the cache.
+        '''
+        if isinstance(self._result,DeferredHist):
+            return self._result.GetHandle()
+        return self._result
+
+    def _fetch(self):
+        if self._result == None:
+            return self.cache.Load(self.key)
+        value = self._result.GetValue()
+        self.cache.Store(self.key,value)
+        return value
+
+    def GetValue(self):
+        '''Get the result.
+
+        Returns:
+            TH1 or float: Histogram or scalar result.
+        '''
+        if self._hist == None:
+            self._hist = self._fetch()
+            if self.name != None: self._hist.SetName(self.name)
+            if self.title != None: self._hist.SetTitle(self.title)
+        return self._hist
+
+class ResultCache(object):
+    '''On-disk cache of filled results (histograms and scalars), one ROOT file per result named
+    by its key (see analyzer.ResultKey()). The least recently used results are dropped once
+    the cache is larger than `maxSize`.'''
+    def __init__(self,path=RESULT_CACHE,maxSize=RESULT_CACHE_MAXSIZE,bypass=RESULT_CACHE_BYPASS):
+        '''Constructor
+
+        @param path (str, optional): Cache directory. Defaults to RESULT_CACHE ($TIMBERRESULTCACHE or .cppcache/results).
+        @param maxSize (float, optional): Size cap in MB. Defaults to RESULT_CACHE_MAXSIZE ($TIMBERRESULTCACHESIZE or 1000).
+        @param bypass (bool, optional): Never load from (or store in) the cache. Defaults to RESULT_CACHE_BYPASS
+            (True if $TIMBERNORESULTCACHE is set to something other than 0).
+        '''
+        ## @var bypass
+        # bool
+        # Book and fill every result as if the cache were empty, without storing them.
+        ## @var hits
+        # int
+        # Results found in the cache.
+        ## @var misses
+        # int
+        # Results that had to be booked.
+        self.path = path
+        self.maxSize = maxSize
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+
+    def _file(self,key):
+        return os.path.join(self.path,key+'.root')
+
+    def Has(self,key):
+        '''Check if the result with `key` is cached (and count the hit or miss).
+
+        @param key (str): Result key.
+
+        Returns:
+            bool
+        '''
+        if not self.bypass and os.path.isfile(self._file(key)):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def Load(self,key):
+        '''Load a cached result and mark it as recently used.
+
+        @param key (str): Result key.
+
+        Raises:
+            NameError: If the result is not cached.
+
+        Returns:
+            TH1 or float: Histogram or scalar result.
+        '''
+        f = ROOT.TFile.Open(self._file(key),'READ')
+        if f == None or f.IsZombie() or f.Get('result') == None:
+            raise NameError('Result %s is not in the cache %s.'%(key,self.path))
+        obj = f.Get('result')
+        if obj.InheritsFrom('TH1'):
+            obj.SetDirectory(0)
+        else:
+            obj = obj.GetVal()
+        f.Close()
+        os.utime(self._file(key),None)
+        return obj
+
+    def Store(self,key,value):
+        '''Write a filled result to the cache (via a temporary file so that parallel jobs never
+        see a partial one) and drop the least recently used results if it is over the size cap.
+
+        @param key (str): Result key.
+        @param value (TH1, float): Result.
+        '''
+        if self.bypass: return
+        if not os.path.isdir(self.path):
+            try: os.makedirs(self.path)
+            except OSError: pass # made by another process in the meantime
+        fd,tmpname = tempfile.mkstemp(suffix='.tmp',dir=self.path)
+        os.close(fd)
+        f = ROOT.TFile.Open(tmpname,'RECREATE')
+        if isinstance(value,ROOT.TObject):
+            f.WriteObject(value,'result')
+        else:
+            ROOT.TParameter('double')('result',float(value)).Write()
+        f.Close()
+        os.rename(tmpname,self._file(key))
+        self.stored += 1
+        self.Prune()
+
+    def Prune(self):
+        '''Drop the least recently used results until the cache is no larger than #maxSize.'''
+        files = []
+        for f in glob.glob(os.path.join(self.path,'*.root')):
+            try: files.append((os.path.getmtime(f),os.path.getsize(f),f))
+            except OSError: pass # removed by another process
+        total = sum(f[1] for f in files)
+        for mtime,size,f in sorted(files):
+            if total <= self.maxSize*1024*1024: break
+            try: os.remove(f)
+            except OSError: pass
+            total -= size
+            self.evicted += 1
+
+    def Clear(self):
+        '''Remove every cached result.'''
+        for f in glob.glob(os.path.join(self.path,'*.root')):
+            os.remove(f)
+
+    def GetStats(self):
+        '''Get the cache statistics of this session.
+
+        Returns:
+            dict: Number of cache hits, misses, results stored and results evicted.
+        '''
+        return {'hits':self.hits,'misses':self.misses,'stored':self.stored,'evicted':self.evicted}
+
+    def PrintStats(self):
+        '''Print the cache statistics.'''
+        total = self.hits+self.misses
+        print('Result cache %s: %s/%s hits (%.0f%%), %s stored, %s evicted%s'%(
+              self.path,self.hits,total,100.*self.hits/total if total > 0 else 0.,
+              self.stored,self.evicted,' (bypassed)' if self.bypass else ''))
+
 ###########################
 # Module handling classes #
 ###########################
@@ -1974,6 +3359,12 @@ class ModuleWorker(object):
         if not isClone:
             if not self._mainFunc.endswith(mainFunc):
                 raise ValueError('ModuleWorker() instance provided with %s argument does not exist in %s (%s)'%(mainFunc,self._script, self._mainFunc))
+            # TIMBER headers the module relies on without including them
+            if '.h' in self._script and self._script not in _loadedHeaders: _loadedHeaders.append(self._script)
+            with open(self._script,'r') as f:
+                headers = _requireHeaders(f.read())
+            # keyed by the object name, with the data files it is given and the headers it calls into
+            RegisterModuleSource(self._script,'%s(%s)%s'%(self.name,', '.join([_argStamp(c) for c in constructor]),''.join([' +'+_argStamp(h) for h in headers])),symbols=[self.name])
             if '.h' in self._script:
                 CompileCpp('#include "%s"\n'%self._script)
             else:
@@ -2021,7 +3412,60 @@ class ModuleWorker(object):
             raise NameError('File %s does not exist'%outname)
         return outname
 
+    def _funcInfoCacheFile(self,funcname):
+        '''Cache file for #_getFuncInfo() of `funcname` in the current script, keyed
+        by the hash of the script contents, `funcname` and the clang arguments (so it changes
+        whenever the module is edited).
+
+        @param funcname (str): C++ class method name to search for in script.
+
+        Returns:
+            str: Path to the JSON cache file (which may not exist yet).
+        '''
+        key = hashlib.sha1()
+        with open(self._script,'rb') as f:
+            key.update(f.read())
+        key.update((funcname+' '+' '.join(cpp_args)).encode('utf-8'))
+        return os.path.join(FUNCINFO_CACHE,'funcinfo_%s_%s.json'%(os.path.basename(self._script),key.hexdigest()[:16]))
+
     def _getFuncInfo(self,funcname):
+        '''Gets the function information including name, namespace, and argument names
+        from the on-disk cache or, if not cached yet, by parsing the script with clang (#_parseFuncInfo())
+        and caching the result.
+
+        @param funcname (str): C++ class method name to search for in script.
+
+        Returns:
+            OrderedDict: Dictionary organized as `myreturn[methodname][argname] = argtype`.
+        '''
+        cachefile = self._funcInfoCacheFile(funcname)
+        if os.path.isfile(cachefile):
+            try:
+                with open(cachefile,'r') as f:
+                    cached = json.load(f)
+                self._script = str(cached['script'])
+                funcs = OrderedDict()
+                for methodname,args in cached['funcs']:
+                    funcs[str(methodname)] = OrderedDict([(str(a),None if d == None else str(d)) for a,d in args])
+                return funcs
+            except (ValueError,KeyError):
+                print ('Ignoring unreadable cache file %s'%cachefile)
+
+        funcs = self._parseFuncInfo(funcname)
+
+        # Write to a temporary file and move it in place so parallel jobs never read a partial file
+        try:
+            if not os.path.isdir(FUNCINFO_CACHE): os.makedirs(FUNCINFO_CACHE)
+            fd,tmpname = tempfile.mkstemp(dir=FUNCINFO_CACHE,suffix='.tmp')
+            with os.fdopen(fd,'w') as f:
+                json.dump({'script':self._script,'funcs':[[m,list(a.items())] for m,a in funcs.items()]},f)
+            os.rename(tmpname,cachefile)
+        except (IOError,OSError) as e:
+            print ('Could not cache function info for %s: %s'%(self._script,e))
+
+        return funcs
+
+    def _parseFuncInfo(self,funcname):
         '''Parses script with clang to get the function information including name, namespace, and argument names.
 
         @param funcname (str): C++ class method name to search for in script.
@@ -2086,7 +3530,7 @@ class ModuleWorker(object):
         if len(list(funcs.keys())) == 0:
             if ('TIMBER/Framework/src' in self._script):
                 self._script = self._script.replace('TIMBER/Framework/src','TIMBER/Framework/include').replace('.cc','.h')
-                funcs = self._getFuncInfo(funcname)
+                funcs = self._parseFuncInfo(funcname)
             else:
                 raise ValueError('Could not find `%s` in file %s'%(funcname,self._script))
 
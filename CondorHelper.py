@@ -1,6 +1,8 @@
 import subprocess
 from optparse import OptionParser
 import time
+import os, json, shlex, multiprocessing
+from multiprocessing.pool import ThreadPool
 
 
 parser = OptionParser()
@@ -17,14 +19,140 @@ parser.add_option('-a', '--args', metavar='FILE', type='string', action='store',
                 default   =   '',
                 dest      =   'args',
                 help      =   'Text file with python arguments')
+parser.add_option('--local', action='store_true',
+                default   =   False,
+                dest      =   'local',
+                help      =   'Run the jobs as subprocesses on this machine instead of submitting to condor')
+parser.add_option('-j', '--nproc', metavar='N', type='int', action='store',
+                default   =   multiprocessing.cpu_count(),
+                dest      =   'nproc',
+                help      =   'Number of jobs to run at once with --local (defaults to the number of cores)')
+parser.add_option('--retries', metavar='N', type='int', action='store',
+                default   =   2,
+                dest      =   'retries',
+                help      =   'Number of times to retry a failed job with --local')
+parser.add_option('-o', '--outputs', metavar='PATTERN', type='string', action='store',
+                default   =   '',
+                dest      =   'outputs',
+                help      =   'Output file(s) of each job (comma separated) with the values of its arguments filled in by flag, ex. "THsnapshot_{s}_{y}_{j}of{n}.root". Used with --local to check the outputs and to skip jobs already done')
+parser.add_option('--status', metavar='FILE', type='string', action='store',
+                default   =   '',
+                dest      =   'status',
+                help      =   'JSON file to write the status of the --local jobs to (defaults to logs/<args file name>_status.json)')
 
 
 (options, args) = parser.parse_args()
 
+def JobOutputs(line,pattern):
+    '''Output files of the job with arguments `line`. Each {flag} in the
+    comma separated `pattern` is replaced by the value following -flag (or --flag)
+    in the arguments.
+
+    Raises:
+        ValueError: If the pattern has a {flag} that is not in the arguments (or is malformed).
+    '''
+    if pattern == '': return []
+    argv = shlex.split(line)
+    values = {}
+    for i,a in enumerate(argv):
+        if a.startswith('-') and i+1 < len(argv) and not argv[i+1].startswith('-'):
+            values[a.lstrip('-')] = argv[i+1]
+    try:
+        return [p.strip().format(**values) for p in pattern.split(',')]
+    except KeyError as e:
+        raise ValueError('Bad --outputs pattern "%s": no -%s in the arguments "%s"'%(pattern,e.args[0],line))
+    except (IndexError,ValueError) as e:
+        raise ValueError('Bad --outputs pattern "%s": %s'%(pattern,e))
+
+def ValidOutput(filename):
+    '''Check that a (ROOT) output file exists, is not empty and was closed properly.'''
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        return False
+    if not filename.endswith('.root'):
+        return True
+    import ROOT
+    f = ROOT.TFile.Open(filename,'READ')
+    if f == None or f.IsZombie():
+        return False
+    good = not f.TestBit(ROOT.TFile.kRecovered) and f.GetListOfKeys().GetSize() > 0
+    f.Close()
+    return good
+
+def RunLocal(runscript,argsfile,nproc,retries,outputs,statusfile):
+    '''Run `runscript` once per line of `argsfile` as a subprocess, `nproc` at a time.
+    The output of each job goes to logs/<args file name>/job_<N>.log and a job is
+    retried up to `retries` times if it fails or its outputs are not valid.
+    Jobs whose outputs already exist and are valid are skipped so the same command
+    can be run again to resume. The status of every job is written to `statusfile`.
+    '''
+    lines = [l.strip() for l in open(argsfile,'r').readlines() if l.strip() != '']
+    tag = os.path.basename(argsfile).split('.')[0]
+    logdir = 'logs/'+tag
+    if not os.path.exists(logdir): os.makedirs(logdir)
+    if statusfile == '': statusfile = 'logs/%s_status.json'%tag
+
+    status = {}
+    def save():
+        with open(statusfile+'.tmp','w') as f:
+            json.dump(status,f,indent=2,sort_keys=True)
+        os.rename(statusfile+'.tmp',statusfile)
+
+    def run(ijob):
+        line = lines[ijob]
+        job = status[str(ijob)]
+        for attempt in range(retries+1):
+            job['attempts'] = attempt+1
+            start = time.time()
+            with open('%s/job_%s.log'%(logdir,ijob),'w' if attempt == 0 else 'a') as log:
+                log.write('>>> attempt %s: sh %s %s\n'%(attempt+1,runscript,line))
+                log.flush()
+                job['returncode'] = subprocess.call(['sh',runscript]+shlex.split(line),stdout=log,stderr=subprocess.STDOUT)
+            job['time'] = time.time()-start
+            if job['returncode'] == 0 and all(ValidOutput(o) for o in job['outputs']):
+                job['status'] = 'done'
+                return ijob
+            job['status'] = 'failed'
+        return ijob
+
+    todo = []
+    for ijob,line in enumerate(lines):
+        job = {'args':line, 'outputs':JobOutputs(line,outputs), 'status':'pending', 'attempts':0}
+        if len(job['outputs']) > 0 and all(ValidOutput(o) for o in job['outputs']):
+            job['status'] = 'skipped'
+        else:
+            todo.append(ijob)
+        status[str(ijob)] = job
+    save()
+    print('Running %s of %s jobs locally with %s processes (logs in %s/)'%(len(todo),len(lines),nproc,logdir))
+
+    # the threads only wait on the subprocesses (and check the outputs)
+    if any(o.endswith('.root') for ijob in todo for o in status[str(ijob)]['outputs']):
+        import ROOT
+        ROOT.EnableThreadSafety()	# ValidOutput() opens the ROOT files from the pool threads
+    pool = ThreadPool(max(1,nproc))
+    for ijob in pool.imap_unordered(run,todo):
+        save()
+        print('Job %s: %s (%s attempt(s))'%(ijob,status[str(ijob)]['status'],status[str(ijob)]['attempts']))
+    pool.close()
+    pool.join()
+
+    counts = {}
+    for job in status.values():
+        counts[job['status']] = counts.get(job['status'],0)+1
+    print('Finished: %s. Status written to %s'%(', '.join('%s %s'%(v,k) for k,v in sorted(counts.items())),statusfile))
+    return counts.get('failed',0) == 0
+
 commands = []
 
 print(options.args)
 
+if options.local:
+    try:
+        ok = RunLocal(options.runscript,options.args,options.nproc,options.retries,options.outputs,options.status)
+    except ValueError as e:
+        parser.error(str(e))
+    raise SystemExit(0 if ok else 1)
+
 # Tar stuff
 if options.inputs != '':
     commands.append("tar czvf tarball.tgz "+options.inputs)
@@ -6,6 +6,7 @@ from argparse import ArgumentParser
 #DP EDIT
 #from THClass import THClass
 from TTClass import TTClass
+from helpers import CompileCppCached
 
 parser = ArgumentParser()
 parser.add_argument('-s', type=str, dest='setname',
@@ -26,7 +27,7 @@ start = time.time()
 
 #DP EDIT
 #CompileCpp('THmodules.cc')
-CompileCpp('TTmodules.cc')
+CompileCppCached('TTmodules.cc')
 #selection = THClass('raw_nano/%s_%s.txt'%(args.setname,args.era),args.era,args.ijob,args.njobs)
 selection = TTClass('raw_nano/%s_%s.txt'%(args.setname,args.era),args.era,args.ijob,args.njobs)
 
@@ -132,8 +133,6 @@ NCuts.Add('AdPhi_cut','abs(Diphoton_phi[0]-Diphoton_phi[1])<6.4')
 
 nodeToPlot = selection.a.Apply([jets,plotting_vars])
 #nodeToPlot = selection.a.Apply([photons,plotting_vars])
-nminus1Nodes = selection.a.Nminus1(NCuts, node=nodeToPlot)
-nminus1Hists = HistGroup('nminus1Hists')
 
 oFile = ROOT.TFile.Open('rootfiles/NMinus1_v9d_{}_{}_{}of{}.root'.format(args.setname, args.era, args.ijob, args.njobs),'RECREATE')
 oFile.cd()
@@ -160,24 +159,8 @@ binning = {
 }
 
 print('Plotting')
-print(nminus1Nodes)
-for nkey in nminus1Nodes.keys():
-    print('1')
-    if nkey=='full': continue
-    print('\t{}'.format(nkey))
-#    if ('mtop' not in nkey) and ('pt0' not in nkey) and ('pt1' not in nkey) and ('deltaEta' not in nkey) and ('topTag0' not in nkey) and ('topTag1' not in nkey):
-    if ('dPhi' not in nkey) and ('AdPhi' not in nkey) and ('photonMvaID' not in nkey) and ('tmass' not in nkey) and ('Apt' not in nkey) and ('Smass' not in nkey) and ('deltaR' not in nkey) and ('photonTag' not in nkey) and ('mtop' not in nkey) and ('pt' not in nkey) and ('deltaEta' not in nkey) and ('topTag' not in nkey):
-	continue
-    print('2')	
-    var = nkey.replace('_cut','').replace('minus_','')
-    print('3')
-    hist_tuple = (var,var,binning[var][0],binning[var][1],binning[var][2])
-    print('4')
-    hist = nminus1Nodes[nkey].DataFrame.Histo1D(hist_tuple,var,'norm')
-    print('5')
-    hist.GetValue()
-    print('6')
-    nminus1Hists.Add(var,hist)
+# all N-1 histograms are booked here and filled in a single event loop on Write
+nminus1Hists = selection.a.Nminus1Histos(NCuts, binning, weight='norm', node=nodeToPlot)
 
 print('X1')
 nminus1Hists.Do('Write')
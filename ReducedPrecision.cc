@@ -0,0 +1,41 @@
+#include "ROOT/RVec.hxx"
+#include <cmath>
+#include <cstdint>
+#include <cstring>
+
+/*****************************************************************
+ *  TruncateMantissa
+ *  ----------------
+ *  Used by Node.Snapshot(precision=...) to store floats with
+ *  fewer significant bits. The value is rounded to the nearest
+ *  float with only the `bits` most significant of the 23 mantissa
+ *  bits set, so it is still written as a Float_t but the zeroed
+ *  low bits compress away. The relative rounding error is at most
+ *  2^-(bits+1) (ex. 2.4e-4 for 11 bits).
+ *  Values that would round up to inf are truncated instead
+ *  (relative error below 2^-bits). NaN and inf are left alone.
+ *****************************************************************/
+float TruncateMantissa(float x, int bits) {
+    if (bits >= 23 || !std::isfinite(x)) {return x;}
+    if (bits < 0) {bits = 0;}
+    uint32_t u;
+    std::memcpy(&u, &x, sizeof(u));
+    const uint32_t drop = 23 - bits;
+    const uint32_t mask = ~((uint32_t(1) << drop) - 1);
+    // round half up on the magnitude; a carry into the exponent gives the next power of two,
+    // unless that is the all-ones exponent (inf), then truncate to stay finite
+    const uint32_t rounded = u + (uint32_t(1) << (drop-1));
+    if (((rounded >> 23) & 0xFF) == 0xFF) {u &= mask;}
+    else {u = rounded & mask;}
+    float out;
+    std::memcpy(&out, &u, sizeof(out));
+    return out;
+}
+
+ROOT::RVec<float> TruncateMantissa(const ROOT::RVec<float> &x, int bits) {
+    ROOT::RVec<float> out(x.size());
+    for (size_t i = 0; i < x.size(); i++) {
+        out[i] = TruncateMantissa(x[i], bits);
+    }
+    return out;
+}
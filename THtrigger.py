@@ -37,7 +37,7 @@ def MakeEfficiency(year, HT=0):
     selection.a.Cut('HT_cut', 'HT > {}'.format(HT))
     after = selection.a.DataFrame.Count()
     
-    noTag = selection.a.Cut('pretrig','HLT_Mu50==1')
+    noTag = selection.a.Cut('pretrig',selection.a.GetTriggerString(['HLT_Mu50']))
 
     # Baseline - no tagging
     hists.Add('preTagDenominator',selection.a.DataFrame.Histo1D(('preTagDenominator','',22,800,3000),'mth_trig'))
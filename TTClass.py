@@ -1,36 +1,77 @@
-import ROOT
+import ROOT, os, re, hashlib
+from collections import OrderedDict
 from TIMBER.Analyzer import Correction, CutGroup, ModuleWorker, analyzer
-from TIMBER.Tools.Common import CompileCpp, OpenJSON
+from TIMBER.Tools.Common import CompileCpp, OpenJSON, GetStandardFlags
 from TIMBER.Tools.AutoPU import ApplyPU
-from helpers import SplitUp
+from helpers import SplitUp, ShardUp, LoadFileIndex, IndexFiles, FileStamp
 import TIMBER.Tools.AutoJME as AutoJME
 
 AutoJME.AK8collection = 'Dijet'
 
+# snapshot cuts that can be recorded instead of applied - no later step relies on them having been applied
+RECORDABLE_CUTS = ['flags','pT','deltaEta_cut','photonNotElec','photonBaccept','tightMu_veto','tightEl_veto','goodMu_veto','goodEl_veto']
+
+# default precision policy for Snapshot(precision=...): mantissa bits kept (of 23) per float column regex, first match wins.
+# 12 bits is a relative precision of 1.2e-4 (kinematics, JME factors), 10 bits 4.9e-4 (tagger scores, weights).
+# Check a new policy with precisionValidation.py.
+REDUCED_PRECISION = OrderedDict([
+    ('(Dijet|Diphoton)_(pt|eta|phi|mass|msoftdrop)', 12),
+    ('Dijet_(JES|JER|JMS|JMR)_.*', 12),
+    ('(A|jptALL)(pt|eta|phi|mass)?[01]', 12),
+    ('Dijet_(deepTag|particleNet).*|Dijet_tau.*|Dijet_rawFactor|Diphoton_mvaID|jTvsQCDALL[01]', 10),
+    ('.*__(nom|up|down)|L1PreFiringWeight_(Nom|Up|Dn)', 10),
+])
+
+# friend trees with the DerivedColumns() of each snapshot file (see TTClass.MakeFriends() and makeFriends.py)
+FRIEND_DIR = os.environ.get('TTFRIENDDIR','friends')
+FRIEND_TREE = 'Friends'
+# stored next to the derived columns to check that the friend entries line up with the events (see FriendAlignmentCut())
+FRIEND_IDS = ['run','event']
+
 class TTClass:
-    def __init__(self,inputfile,year,ijob,njobs):
+    def __init__(self,inputfile,year,ijob,njobs,balanceJobs=True,shardFiles=False,friendVariation='None',resultCache=True):
         if inputfile.endswith('.txt'): 
-            infiles = SplitUp(inputfile, njobs)[ijob-1]
+	    # the files are checked once, when the metadata index of the .txt list is built (see buildFileIndex.py)
+	    # jobs only read it, and open just their own files if they are missing from it (or changed since)
+	    fileIndex = LoadFileIndex(inputfile)
+	    entryRanges = None
+	    if shardFiles:
+		# split into entry ranges so that large files are shared between jobs
+		# (only this job's two cuts are placed, so at most two files are opened for their cluster boundaries)
+		shard = ShardUp(inputfile, njobs, fileIndex, ijob)
+		infiles = [f for f,first,last in shard]
+		entryRanges = dict((f,(first,last)) for f,first,last in shard)
+	    else:
+		# split by number of events rather than number of files so the jobs take about the same time
+		# (by number of files if there is no index yet)
+		infiles = SplitUp(inputfile, njobs, fileIndex=fileIndex if balanceJobs else None)[ijob-1]
+	    fileIndex.update(IndexFiles([f for f in infiles if f not in fileIndex]))
 	    # there is an issue with empty events TTrees, so make sure they don't make it through to the analyzer (mainly seen in V+Jets, esp at low HT)
 	    invalidFiles = []
 	    for iFile in infiles:
 		print('Adding {} to Analyzer'.format(iFile))
-		f = ROOT.TFile.Open(iFile)
-		if not f.Get('Events'):
+		if not fileIndex[iFile]['hasEvents']:
 		    print('\tWARNING: {} has no Events TTree - will not be added to analyzer'.format(iFile))
 		    invalidFiles.append(iFile)
-		    continue
-		if not f.Get('Events').GetEntry():
+		elif fileIndex[iFile]['empty']:
 		    print('\tWARNING: {} has an empty Events TTree - will not be added to analyzer'.format(iFile))
 		    invalidFiles.append(iFile)
-		f.Close()
 	    inputFiles = [i for i in infiles if i not in invalidFiles]
 	    if len(inputFiles) == 0:
 		print("\n\t WARNING: None of the files given contain an Events TTree.")
-	    self.a = analyzer(inputFiles)
+	    friends = self._findFriends(inputFiles, friendVariation)
+	    self.a = analyzer(inputFiles, fileIndex=fileIndex, entryRanges=entryRanges, friends=friends, friendTreeName=FRIEND_TREE, resultCache=resultCache)
         else:
             infiles = inputfile
-            self.a = analyzer(infiles)
+            friends = self._findFriends([infiles] if infiles.endswith('.root') else [], friendVariation)
+            self.a = analyzer(infiles, friends=friends, friendTreeName=FRIEND_TREE, resultCache=resultCache)
+        if self.friendVariation != None:
+            # friends are paired with the events by entry number - stop if they do not line up
+            self.a.Cut('friendsAligned', FriendAlignmentCut())
+
+        # snapshots made with slimGen=True store the slimmed generator record as GenPartSlim
+        if 'nGenPartSlim' in self.a.GetColumnNames() and 'nGenPart' not in self.a.GetColumnNames():
+            self.a.SubCollection('GenPart','GenPartSlim','')
 
         if inputfile.endswith('.txt'):
             self.setname = inputfile.split('/')[-1].split('_')[0]
@@ -39,6 +80,9 @@ class TTClass:
         self.year = str(year)	# most of the time this class will be instantiated from other scripts with CLI args, so just convert to string for internal use
         self.ijob = ijob
         self.njobs = njobs
+        self.genScalarIds = [25,35,36,9000006]	# pdgIds of the scalar (S) kept by SlimGenParticles()
+        # snapshot cuts to only record in the CutBits column instead of applying (see RECORDABLE_CUTS)
+        self.recordCuts = []
 #DP EDIT THconfig to TTconfig
         self.config = OpenJSON('TTconfig.json')
         self.cuts = self.config['CUTS']
@@ -103,15 +147,27 @@ class TTClass:
 	else:
 	    return self.a.DataFrame.Count().GetValue()
 
+    def _findFriends(self,files,variation):
+        # attach the friend trees only if every file has an up-to-date one
+        self.friendVariation = None
+        self.friendColumns = []
+        if variation == None or len(files) == 0:
+            return {}
+        friends = FindFriends(files, variation)
+        if len(friends) != len(files):
+            if len(friends) > 0:
+                print('WARNING: only {} of {} files have up-to-date friend trees for {} - recomputing the derived columns'.format(len(friends), len(files), variation))
+            return {}
+        print('Reading the derived columns for {} from friend trees in {}/'.format(variation, FRIEND_DIR))
+        self.friendVariation = variation
+        self.friendColumns = list(DerivedColumns(variation, False).keys())
+        return friends
+
     ####################
     # Snapshot related #
     ####################
-    def ApplyKinematicsSnap(self): # For snapshotting only
-	# total number processed
-	#self.NPROC = self.a.genEventSumw	# follow Matej https://github.com/mroguljic/X_YH_4b/blob/9602da767d1c1cf0e9fc19bade7b104b1da40212/eventSelection.py#L90
-	self.NPROC = self.getNweighted()
-	self.AddCutflowColumn(self.NPROC, "NPROC")
-
+    def MetFilters(self):
+	'''MET filters required in ApplyKinematicsSnap() for this year.'''
 	flags = [
 	    'Flag_goodVertices',
 	    'Flag_globalSuperTightHalo2016Filter',
@@ -124,29 +180,47 @@ class TTClass:
 	]
 	if self.year == '17' or self.year == '18':
 	    flags.append('Flag_ecalBadCalibFilter')
+	return flags
+
+    def PackedTriggers(self,columns=[]):
+	'''
+	Fixed list of HLT paths packed into TrigBits by Snapshot(packTrigs=True), so every job of a year
+	gets the same bits whatever HLT branches its input files have: the triggers of ApplyTrigs()
+	(self.trigs) and ApplyNewTrigs() (TTconfig.json) for this year, plus the HLT columns named
+	explicitly (not by a regex) in `columns`, ex. HLT_Mu50 for the trigger efficiency scripts.
+	'''
+	trigs = set(self.trigs[int(self.year) if 'APV' not in self.year else 16])
+	for subyear,subyearTrigs in self.newTrigs.items():
+	    if subyear.split('_')[-1] == self.year:
+		trigs.update([str(t) for t in subyearTrigs])
+	trigs.update([c for c in columns if c.startswith('HLT_') and re.match(r'\w+$',c)])
+	return sorted(trigs)
+
+    def ApplyKinematicsSnap(self): # For snapshotting only
+	# total number processed
+	#self.NPROC = self.a.genEventSumw	# follow Matej https://github.com/mroguljic/X_YH_4b/blob/9602da767d1c1cf0e9fc19bade7b104b1da40212/eventSelection.py#L90
+	# cutflow counts are booked lazily and filled in the same event loop as the Snapshot (see Snapshot())
+	self.a.BookCutflow('NPROC')
+
+	flags = self.MetFilters()
 	MET_filters = self.a.GetFlagString(flags)	# string valid (existing in RDataFrame node) flags together w logical and
-	self.a.Cut('flags', MET_filters)
-	self.NFLAGS = self.getNweighted()
-	self.AddCutflowColumn(self.NFLAGS, "NFLAGS")
+	self.a.Cut('flags', MET_filters,record='flags' in self.recordCuts)
+	self.a.BookCutflow('NFLAGS')
 
         self.a.Cut('njets','nFatJet >= 2')
-	self.NJETS = self.getNweighted()
-	self.AddCutflowColumn(self.NJETS, "NJETS")
+	self.a.BookCutflow('NJETS')
 
 #DP EDIT ADD 2 photon Preselection - change it back to no requirement
         self.a.Cut('nPhotons','nPhoton > 1')
-        self.NPHOTONS = self.getNweighted()
-        self.AddCutflowColumn(self.NPHOTONS, "NPHOTONS")
+        self.a.BookCutflow('NPHOTONS')
 
         # jetId cut: https://cms-pub-talk.web.cern.ch/t/jme-or/6547
         # INFO: https://twiki.cern.ch/twiki/bin/viewauth/CMS/JetID#nanoAOD_Flags
         self.a.Cut('jetId', 'Jet_jetId[0] > 1 && Jet_jetId[1] > 1')    # drop any events whose dijets did not both pass tight jetId requirement
-        self.NJETID = self.getNweighted()
-        self.AddCutflowColumn(self.NJETID, "NJETID")
+        self.a.BookCutflow('NJETID')
 
-        self.a.Cut('pT', 'FatJet_pt[0] > {0} && FatJet_pt[1] > {0}'.format(self.cuts['pt']))
-	self.NPT = self.getNweighted()
-	self.AddCutflowColumn(self.NPT, "NPT")
+        self.a.Cut('pT', 'FatJet_pt[0] > {0} && FatJet_pt[1] > {0}'.format(self.cuts['pt']),record='pT' in self.recordCuts)
+	self.a.BookCutflow('NPT')
 
 #        self.a.Cut('ApT', 'Photon_pt[0] > {0}  && Photon_pt[1] > {0}'.format(self.cuts['Apt']))
 #        self.NAPT = self.getNweighted()
@@ -154,8 +228,7 @@ class TTClass:
 
         self.a.Define('DijetIdxs','PickDijets(FatJet_pt, FatJet_eta, FatJet_phi, FatJet_msoftdrop)')
         self.a.Cut('dijetsExist','DijetIdxs[0] > -1 && DijetIdxs[1] > -1')
-        self.NKIN = self.getNweighted()
-        self.AddCutflowColumn(self.NKIN, "NKIN")
+        self.a.BookCutflow('NKIN')
 
         self.a.Define('DiphotonIdxs','PickDiphotons(Photon_pt, Photon_eta, Photon_phi, Photon_mass,Photon_cutBased)')
 #        self.a.Define('DiphotonTagIdxs','PickDiphotonsTag(Photon_pt, Photon_eta, Photon_phi, Photon_mass, Photon_cutBased, 1)')
@@ -163,8 +236,7 @@ class TTClass:
 #        self.NPHOTON = self.getNweighted()
 #        self.AddCutflowColumn(self.NPHOTON, "NPHOTON")
         self.a.Cut('diphotonsExist','Photon_pt[DiphotonIdxs[0]] > {0} && Photon_pt[DiphotonIdxs[1]] > {0}'.format(self.cuts['Apt']))
-	self.NPHOTONKIN = self.getNweighted()
-	self.AddCutflowColumn(self.NPHOTONKIN, "NPHOTONKIN")
+	self.a.BookCutflow('NPHOTONKIN')
 
         self.a.SubCollection('Dijet','FatJet','DijetIdxs',useTake=True)
         self.a.Define('Dijet_vect','hardware::TLvector(Dijet_pt, Dijet_eta, Dijet_phi, Dijet_msoftdrop)')
@@ -174,18 +246,15 @@ class TTClass:
 #        self.a.Define('DiphotonTag_vect','hardware::TLvector(DiphotonTag_pt, DiphotonTag_eta, DiphotonTag_phi, DiphotonTag_mass)')
 
 	self.a.Define('deltaEta','abs(Dijet_eta[0]-Dijet_eta[1])')
-	self.a.Cut('deltaEta_cut','deltaEta < 1.6')
-	self.NDELTAETA = self.getNweighted()
-	self.AddCutflowColumn(self.NDELTAETA,'NDELTAETA')
+	self.a.Cut('deltaEta_cut','deltaEta < 1.6',record='deltaEta_cut' in self.recordCuts)
+	self.a.BookCutflow('NDELTAETA')
     #DP edit: also add electron-veto photon AND photons within the acceptable barrel region
-        self.a.Cut('photonNotElec','Photon_electronVeto[DiphotonIdxs[0]] && Photon_electronVeto[DiphotonIdxs[1]]')
+        self.a.Cut('photonNotElec','Photon_electronVeto[DiphotonIdxs[0]] && Photon_electronVeto[DiphotonIdxs[1]]',record='photonNotElec' in self.recordCuts)
 #        self.a.Cut('photonNotElec','Photon_electronVeto[DiphotonTagIdxs[0]] && Photon_electronVeto[DiphotonTagIdxs[1]]')
-        self.NPHOTONNOTELEC = self.getNweighted()
-        self.AddCutflowColumn(self.NPHOTONNOTELEC,'NPHOTONNOTELEC')
-        self.a.Cut('photonBaccept','(Photon_isScEtaEB[DiphotonIdxs[0]] || Photon_isScEtaEE[DiphotonIdxs[0]]) && (Photon_isScEtaEB[DiphotonIdxs[1]] || Photon_isScEtaEE[DiphotonIdxs[1]])')
+        self.a.BookCutflow('NPHOTONNOTELEC')
+        self.a.Cut('photonBaccept','(Photon_isScEtaEB[DiphotonIdxs[0]] || Photon_isScEtaEE[DiphotonIdxs[0]]) && (Photon_isScEtaEB[DiphotonIdxs[1]] || Photon_isScEtaEE[DiphotonIdxs[1]])',record='photonBaccept' in self.recordCuts)
 #        self.a.Cut('photonBaccept','(Photon_isScEtaEB[DiphotonTagIdxs[0]] || Photon_isScEtaEE[DiphotonTagIdxs[0]]) && (Photon_isScEtaEB[DiphotonTagIdxs[1]] || Photon_isScEtaEE[DiphotonTagIdxs[1]])')
-        self.NPHOTONINBARR = self.getNweighted()
-        self.AddCutflowColumn(self.NPHOTONINBARR,'NPHOTONINBARR')
+        self.a.BookCutflow('NPHOTONINBARR')
         return self.a.GetActiveNode()
 
     def ApplyStandardCorrections(self,snapshot=False):
@@ -333,27 +402,21 @@ class TTClass:
 	so we will first check if the event has muons (nMuon<1) and if there are, we loop over the leptons in the event and 
 	immediately return true if a lepton in the event meets the veto criteria. See THmodules.cc for implementation.
 	'''
-	self.PreLeptonVeto = self.getNweighted()
-	self.AddCutflowColumn(self.PreLeptonVeto,'PreLepVeto')
+	self.a.BookCutflow('PreLepVeto')
 	# tightMu inversion
-	self.a.Cut('tightMu_veto','TightMuVeto(nMuon, Muon_tightId, Muon_pt, Muon_pfRelIso04_all, Muon_eta)==0')
-	self.NTightMu = self.getNweighted()
-	self.AddCutflowColumn(self.NTightMu, "NTightMu")
+	self.a.Cut('tightMu_veto','TightMuVeto(nMuon, Muon_tightId, Muon_pt, Muon_pfRelIso04_all, Muon_eta)==0',record='tightMu_veto' in self.recordCuts)
+	self.a.BookCutflow('NTightMu')
 	# tightEl inversion
-	self.a.Cut('tightEl_veto','TightElVeto(nElectron, Electron_mvaFall17V2Iso_WP80, Electron_pt, Electron_eta)==0')
-	self.NTightEl = self.getNweighted()
-	self.AddCutflowColumn(self.NTightEl, "NTightEl")
+	self.a.Cut('tightEl_veto','TightElVeto(nElectron, Electron_mvaFall17V2Iso_WP80, Electron_pt, Electron_eta)==0',record='tightEl_veto' in self.recordCuts)
+	self.a.BookCutflow('NTightEl')
 	# goodMu inversion
-	self.a.Cut('goodMu_veto','GoodMuVeto(nMuon, Muon_pt, Muon_looseId, Muon_dxy, Muon_eta)==0')
-	self.NGoodMu = self.getNweighted()
-	self.AddCutflowColumn(self.NGoodMu, "NGoodMu")
+	self.a.Cut('goodMu_veto','GoodMuVeto(nMuon, Muon_pt, Muon_looseId, Muon_dxy, Muon_eta)==0',record='goodMu_veto' in self.recordCuts)
+	self.a.BookCutflow('NGoodMu')
 	# goodEl inversion
-	self.a.Cut('goodEl_veto','GoodElVeto(nElectron, Electron_pt, Electron_mvaFall17V2noIso_WP90, Electron_dxy, Electron_eta)==0')
-	self.NGoodEl = self.getNweighted()
-	self.AddCutflowColumn(self.NGoodEl, "NGoodEl")
+	self.a.Cut('goodEl_veto','GoodElVeto(nElectron, Electron_pt, Electron_mvaFall17V2noIso_WP90, Electron_dxy, Electron_eta)==0',record='goodEl_veto' in self.recordCuts)
+	self.a.BookCutflow('NGoodEl')
 
-	self.PostLeptonVeto = self.getNweighted()
-	self.AddCutflowColumn(self.PostLeptonVeto,'PostLepVeto')
+	self.a.BookCutflow('PostLepVeto')
 	return self.a.GetActiveNode()
 #DP EDIT
     def analysis1(self):
@@ -383,9 +446,18 @@ class TTClass:
         self.a.Define('jTvsQCDALL1','jetALL_vector[10]')
         self.a.Define('TPmass_LNL','TPmassCalcLeading(AA_vector,jetIdsDP,FatJet_pt,FatJet_eta,FatJet_phi,FatJet_mass)')
 
-    def Snapshot(self,node=None, colNames=[]):
+    def Snapshot(self,node=None, colNames=[], compression='ZLIB:1', basketSize=None, autoFlush=None, slimGen=False, packTrigs=False, precision=None):
 	'''
 	colNames [str] (optional): list of column names to add to the snapshot 
+	compression (str, optional): "<algorithm>:<level>" with algorithm ZLIB, LZMA, LZ4 or ZSTD
+	basketSize, autoFlush (int, optional): see analyzer.Snapshot()
+	slimGen (bool, optional): for MC, only keep the GenPart entries used downstream (see SlimGenParticles())
+	packTrigs (bool, optional): store the HLT paths of PackedTriggers() and the MET filters (MetFilters() and
+	    GetStandardFlags()) as uint64 bit masks (TrigBits, FlagBits) instead of one bool branch each, with the same
+	    bits in every job of the year (see analyzer.PackBits()). Missing paths are stored as 0, missing filters as 1.
+	    Other HLT columns selected by `columns` are kept as bool branches. ApplyTrigs()/ApplyNewTrigs() then test the masks.
+	precision (dict, optional): {column regex: mantissa bits} to store floats with reduced precision, ex. REDUCED_PRECISION
+	    (see Node.Snapshot()). Default None keeps full precision.
 	'''
         startNode = self.a.GetActiveNode()
         if node == None: node = self.a.GetActiveNode()
@@ -411,10 +483,7 @@ class TTClass:
 #            'DiphotonTag_mvaID','DiphotonTag_cutBased',
             'HLT_PFHT.*', 'HLT_PFJet.*', 'HLT_AK8.*', 'HLT_Mu50', 'HLT_IsoMu*', 'HLT_Ele27_WPTight_Gsf', 'HLT_Ele35_WPTight_Gsf',
             'HLT_Diphoton*','HLT_DoublePhoton*',
-            'event', 'eventWeight', 'luminosityBlock', 'run',
-	    'NPROC', 'NFLAGS', 'NJETS', 'NPHOTONS','NJETID', 'NPT', 'NKIN', 
-            'NPHOTONKIN','NDELTAETA','NPHOTONNOTELEC', 'NPHOTONINBARR',
-            'NTightMu', 'NTightEl', 'NGoodMu', 'NGoodEl', 'PreLepVeto', 'PostLepVeto'
+            'event', 'eventWeight', 'luminosityBlock', 'run'
         ]
 
         if not self.a.isData:
@@ -446,22 +515,54 @@ class TTClass:
 	if (len(colNames) > 0):
 	    columns.extend(colNames)
 
+        outname = 'THsnapshot_%s_%s_%sof%s.root'%(self.setname,self.year,self.ijob,self.njobs)
         self.a.SetActiveNode(node)
-        self.a.Snapshot(columns,'THsnapshot_%s_%s_%sof%s.root'%(self.setname,self.year,self.ijob,self.njobs),'Events',openOption='RECREATE',saveRunChain=True)
+        if slimGen and not self.a.isData:
+            self.SlimGenParticles()
+            columns = [c for c in columns if c not in ['GenPart_.*','nGenPart']]+['GenPartSlim_.*','nGenPartSlim']
+        if len(self.a.RecordedCuts) > 0:
+            self.a.CutBits()
+            columns.append('CutBits')
+        if packTrigs:
+            trigs = self.PackedTriggers(columns)
+            hlt = [c for c in columns if c.startswith('HLT_')]
+            unpacked = [c for c in self.a.GetColumnNames() if c.startswith('HLT_') and c not in trigs and any(re.match('(%s)$'%p,c) for p in hlt)]
+            self.a.PackBits('TrigBits', trigs)
+            self.a.PackBits('FlagBits', sorted(set(self.MetFilters()+list(GetStandardFlags())+['Flag_ecalBadCalibFilter'])), absent=True)
+            columns = [c for c in columns if not c.startswith('HLT_')]+unpacked+list(self.a.BitMasks.keys())
+        algo, level = compression.split(':') if ':' in compression else (compression, 1)
+        self.a.Snapshot(columns,outname,'Events',openOption='RECREATE',saveRunChain=True,
+                        compressionAlgorithm=algo,compressionLevel=int(level),basketSize=basketSize,autoFlush=autoFlush,
+                        precision=precision)
+        # cutflow counts (NPROC, NFLAGS, ...) were filled in the same event loop as the snapshot
+        self.a.WriteCutflow(outname)
+        self.a.WriteCutBits(outname)
+        self.a.WriteBitMasks(outname)
         self.a.SetActiveNode(startNode)
 
+    def SlimGenParticles(self):
+        '''Make the GenPartSlim collection with only the generator particles used downstream
+        (top pT reweighting and truth matching): last-copy tops, W bosons and scalars, photons from
+        the scalars and the hard-process particles. genPartIdxMother points to the closest kept ancestor
+        in the slimmed collection. When a snapshot with GenPartSlim is read back, it is made available
+        as GenPart again (see __init__).
+        '''
+        self.a.Define('GenSlim_idx','GenSlimIdx(GenPart_pdgId, GenPart_statusFlags, GenPart_genPartIdxMother, {%s})'%(','.join(str(i) for i in self.genScalarIds)))
+        self.a.SubCollection('GenPartSlim','GenPart','GenSlim_idx',useTake=True,skip=['genPartIdxMother'])
+        self.a.Define('GenPartSlim_genPartIdxMother','GenSlimMother(GenSlim_idx, GenPart_genPartIdxMother)')
+        return self.a.GetActiveNode()
+
     #####################
     # Selection related #
     #####################
     def OpenForSelection(self,variation):
+        # cuts recorded in the snapshot (see RECORDABLE_CUTS) - apply them all unless ApplyCutBits() was already used
+        if 'CutBits' in self.a.GetColumnNames() and not any(n.startswith('CutBits_') for n in self.a.GetTrackedNodeNames()):
+            self.a.ApplyCutBits(self.a.GetCutBitLabels())
         self.a.Define('Dijet_particleNetMD_HbbvsQCD','Dijet_particleNetMD_Xbb/(Dijet_particleNetMD_Xbb+Dijet_particleNetMD_QCD)')
         self.ApplyStandardCorrections(snapshot=False)
         self.a.Define('Dijet_vect_trig','hardware::TLvector(Dijet_pt, Dijet_eta, Dijet_phi, Dijet_msoftdrop)')
         self.a.Define('Top1_vect_trig','hardware::TLvector(Dijet_pt[0], Dijet_eta[0], Dijet_phi[0], Dijet_msoftdrop[0])')
-        self.a.Define('Photon1_vect','hardware::TLvector(Diphoton_pt[0],Diphoton_eta[0], Diphoton_phi[0], Diphoton_mass[0])')
-#        self.a.Define('Photon1_vect_trig','hardware::TLvector(Apt0,Aeta0,Aphi0,Amass0)')
-        self.a.Define('Photon2_vect','hardware::TLvector(Diphoton_pt[1],Diphoton_eta[1], Diphoton_phi[1], Diphoton_mass[1])')
-#        self.a.Define('Photon2_vect_trig','hardware::TLvector(Apt1,Aeta1,Aphi1,Amass1)')
 #DP EDIT comment out next four lines when running TTtrig and TTdist!!!
 #        self.a.Define('PhotonEffSF','getPhotonSF(Diphoton_pt,Diphoton_eta,Diphoton_cutBased,1.0,0,"2018")')
 #        self.a.Define('PhotonEffSF1','getPhotonSF(Diphoton_pt,Diphoton_eta,Diphoton_cutBased,1.0,1,"2018")')
@@ -478,40 +579,68 @@ class TTClass:
 #        self.a.Define('DiPhotonCat','getDiPhotonCat(DiphotonTag_cutBased,1.0)')
 
 #        self.a.Define('DiPhotonCat','int(((Diphoton_cutBased[0] >= 1) && (Diphoton_cutBased[1] >= 1)))+(1-int(((Diphoton_cutBased[0] < 1) && (Diphoton_cutBased[1] < 1))))')
+#        self.a.Define('Diph_mvaID','ConvertToVecF(AmvaID0,AmvaID1)')
+        return self.DefineDerived(variation)
+
+    def DefineDerived(self,variation):
+        '''Define the JME-corrected kinematics used by the selection steps (see DerivedColumns()).
+        Columns that come from an attached friend tree (see MakeFriends()) are not recomputed.
+        '''
+        if self.friendVariation != None and variation != self.friendVariation:
+            raise ValueError('Friend trees for variation %s are attached but OpenForSelection() was called with %s.'%(self.friendVariation,variation))
+        derived = DerivedColumns(variation, self.a.isData)
+        def define(name):
+            if name not in self.friendColumns:
+                self.a.Define(name, derived[name])
+
+        self.a.Define('Photon1_vect','hardware::TLvector(Diphoton_pt[0],Diphoton_eta[0], Diphoton_phi[0], Diphoton_mass[0])')
+#        self.a.Define('Photon1_vect_trig','hardware::TLvector(Apt0,Aeta0,Aphi0,Amass0)')
+        self.a.Define('Photon2_vect','hardware::TLvector(Diphoton_pt[1],Diphoton_eta[1], Diphoton_phi[1], Diphoton_mass[1])')
+#        self.a.Define('Photon2_vect_trig','hardware::TLvector(Apt1,Aeta1,Aphi1,Amass1)')
 #        self.a.Define('Smass_trig','hardware::InvariantMass({Photon1_vect_trig,Photon2_vect_trig})')
-        self.a.Define('Smass','hardware::InvariantMass({Photon1_vect,Photon2_vect})')
+        define('Smass')
         self.a.Define('Smass_trig','Smass')
-        self.a.Define('m_javg','(Dijet_msoftdrop[0]+Dijet_msoftdrop[1])/2')
-#        self.a.Define('Diph_mvaID','ConvertToVecF(AmvaID0,AmvaID1)')
+        define('m_javg')
         # JME variations
-        if not self.a.isData:
-            pt_calibs, top_mass_calibs = JMEvariationStr('Top',variation)     # the pt calibs are the same for
-            pt_calibs, higgs_mass_calibs = JMEvariationStr('Higgs',variation) # top and H
-            self.a.Define('Dijet_pt_corr','hardware::MultiHadamardProduct(Dijet_pt,%s)'%pt_calibs)
-            self.a.Define('Dijet_msoftdrop_corrT','hardware::MultiHadamardProduct(Dijet_msoftdrop,%s)'%top_mass_calibs)
-            self.a.Define('Dijet_msoftdrop_corrH','hardware::MultiHadamardProduct(Dijet_msoftdrop,%s)'%higgs_mass_calibs)
-        else:
-            self.a.Define('Dijet_pt_corr','hardware::MultiHadamardProduct(Dijet_pt,{Dijet_JES_nom})')
-            self.a.Define('Dijet_msoftdrop_corrT','hardware::MultiHadamardProduct(Dijet_msoftdrop,{Dijet_JES_nom})')
-            self.a.Define('Dijet_msoftdrop_corrH','hardware::MultiHadamardProduct(Dijet_msoftdrop,{Dijet_JES_nom})')
+        # variation == 'JME' defines the nominal columns and registers all JME up/down variations on them,
+        # so the varied HT, mth, cuts and templates all come out of the same event loop
+        define('Dijet_pt_corr')
+        define('Dijet_msoftdrop_corrT')
+        define('Dijet_msoftdrop_corrH')
+        if not self.a.isData and variation == 'JME':
+            self.a.Vary(['Dijet_pt_corr','Dijet_msoftdrop_corrT','Dijet_msoftdrop_corrH'], JMEvaryStr(), JMEvariations, 'JME')
 	#########################################################################################
 	# This is *not* a viable description of HT
 	# need to fix
 	#########################################################################################
         self.a.Define('Top1_vect','hardware::TLvector(Dijet_pt_corr[0], Dijet_eta[0], Dijet_phi[0], Dijet_msoftdrop_corrT[0])')
         self.a.Define('Top2_vect','hardware::TLvector(Dijet_pt_corr[1], Dijet_eta[1], Dijet_phi[1], Dijet_msoftdrop_corrT[1])')
-        self.a.Define('mth1','hardware::InvariantMass({Top1_vect,Photon1_vect,Photon2_vect})')
-        self.a.Define('mth2','hardware::InvariantMass({Top2_vect,Photon1_vect,Photon2_vect})')
-        self.a.Define('topchoice','int((Dijet_particleNet_TvsQCD[0]>0.8) || (Dijet_particleNet_TvsQCD[1]<0.8))')
-        self.a.Define('mth','topchoice*mth1+(1-topchoice)*mth2')
+        define('mth1')
+        define('mth2')
+        define('topchoice')
+        define('mth')
 #        self.a.Define('mth','mth1')
         # for trigger studies
         self.a.Define('mth_trig','mth1')
-        self.a.Define('pt0','Dijet_pt_corr[0]')
-        self.a.Define('pt1','Dijet_pt_corr[1]')
-        self.a.Define('HT','pt0+pt1')
+        define('pt0')
+        define('pt1')
+        define('HT')
         return self.a.GetActiveNode()
 
+    def MakeFriends(self,variation,outname):
+        '''Write the columns of DerivedColumns(variation) (and FRIEND_IDS) for every entry of the input (no cuts) to
+        the "Friends" TTree of `outname`, with the FriendKey() of the input file. Use on an instance
+        made from a single snapshot file (see makeFriends.py), with implicit multithreading off since
+        a multithreaded Snapshot does not keep the entry order.
+        '''
+        if ROOT.ROOT.IsImplicitMTEnabled():
+            raise ValueError('Friend trees must be written single-threaded (the entry order has to match the snapshot). Call ROOT.ROOT.DisableImplicitMT() first.')
+        self.DefineDerived(variation)
+        self.a.Snapshot(FRIEND_IDS+list(DerivedColumns(variation, self.a.isData).keys()), outname, FRIEND_TREE, openOption='RECREATE')
+        f = ROOT.TFile.Open(outname, 'UPDATE')
+        ROOT.TNamed('friendKey', FriendKey(self.a.fileName, variation)).Write()
+        f.Close()
+
 #DP EDIT consider the case of two tops
     def ApplyTopPick_SR(self, TopTagger, pt, TopScoreCut, eff0, eff1, year, TopVariation):
 	objIdxs = 'ObjIdxs_{}'.format(TopTagger)
@@ -521,9 +650,6 @@ class TTClass:
 	    # or, if neither passed it will look like {-1,-1}
 	   self.a.Define('tIdx0','{}[0]'.format(objIdxs))
 	   self.a.Define('tIdx1','{}[1]'.format(objIdxs))
-	#DEBUG
-	nTot = self.a.DataFrame.Sum("genWeight").GetValue()
-	print('NTot before TopPick (signal) = {}'.format(nTot))
         self.a.Cut('HasTop','(tIdx0 > -1) || (tIdx1 > -1)')
         return self.a.GetActiveNode()	
 
@@ -535,9 +661,6 @@ class TTClass:
             # or, if neither passed it will look like {-1,-1}
            self.a.Define('tIdx0CR','{}[0]'.format(objIdxsCR))
            self.a.Define('tIdx1CR','{}[1]'.format(objIdxsCR))
-        #DEBUG
-        nTot = self.a.DataFrame.Sum("genWeight").GetValue()
-        print('NTot before TopPick (signal) = {}'.format(nTot))
         self.a.Cut('HasTopCR','(tIdx0CR > -1) || (tIdx1CR > -1)')
         return self.a.GetActiveNode()
 
@@ -725,77 +848,51 @@ class TTClass:
         return SmasspassTest
 
     def ApplySTagTopTagSF(self, SRorCR, Toptagger, ToptaggerWP, Stagger, StaggerWP):
+        '''
+	Splits the SR or CR into the photon tag categories (pass/fail/failfail) after the photon SF update,
+	i.e. using the DiPhotonCatSF (SR) or DiPhotonCatCRSF (CR) columns.
+	The yields in each category are booked lazily via BookCutflow() (the SR also with the PhotonEffSF weight)
+	so they are filled in the same event loop as the templates instead of one loop per number.
+	'''
         assert(SRorCR == 'SR' or SRorCR == 'CR')
         checkpoint = self.a.GetActiveNode()
-        nTotOrig = self.getNweighted()
-        print("nTotOrig = {}".format(nTotOrig))
-        nTotSF = self.a.DataFrame.Sum("PhotonEffSF").GetValue()
-        print("nTotSF = {}".format(nTotSF))
+        self.a.BookCutflow('nTotOrig_{}_SF'.format(SRorCR))
+        self.a.BookCutflow('nTotSF_{}_SF'.format(SRorCR), weight='PhotonEffSF')
         passFailSF = {}
         # Higgs Pass + cutflow info
         if (SRorCR == 'SR'):
             totSR_SF = self.a.Cut('STagSR_SF','(Dijet_{0}[0] > {1}) && (Dijet_{0}[1] > {1})'.format(Toptagger, ToptaggerWP))
-            self.higgs_SR_SF = self.getNweighted()
-            self.eventSumSR_SF = self.a.DataFrame.Sum("PhotonEffSF").GetValue()
-            self.AddCutflowColumn(self.higgs_SR_SF, "higgs_SR_SF")
-            print('Obtaining efficiencies for SR_SF')
-            eff = self.higgs_SR_SF/nTotOrig
-            print('SR: eff = {}'.format(eff*100.))
-            effSF = self.eventSumSR_SF/nTotSF
-            print('SR: effSF = {}'.format(effSF*100))
+            self.a.BookCutflow('higgs_SR_SF')
+            self.a.BookCutflow('eventSumSR_SF', weight='PhotonEffSF')
 #            passFailSF["pass"] = self.a.Cut('STagSR_pass_SF','(Diphoton_{2}[0] >= {3}) && (Diphoton_{2}[1] >= {3}) && (Dijet_{0}[0] > {1}) && (Dijet_{0}[1] > {1})'.format(Toptagger, ToptaggerWP, Stagger, StaggerWP))
             passFailSF["pass"] = self.a.Cut('STagSR_pass_SF','(DiPhotonCatSF == 2) && (Dijet_{0}[0] > {1}) && (Dijet_{0}[1] > {1})'.format(Toptagger, ToptaggerWP))
-            self.higgsP_SR_SF = self.getNweighted()
-            self.AddCutflowColumn(self.higgsP_SR_SF, "higgsP_SR_SF")
-            effpass = self.higgsP_SR_SF/nTotOrig
-            print('SR: effpass = {}'.format(effpass*100))
-            self.eventSumSRpass_SF = self.a.DataFrame.Sum("PhotonEffSF").GetValue()
-            effSFpass = self.eventSumSRpass_SF/nTotSF
-            print('SR: effSFpass = {}'.format(effSFpass*100))
-#            self.a.Define('passFailSF','hardware::MultiHadamardProduct(%s,PhotonEffSF)'%passFail)
-#            effnorm = effSFpass/effpass
+            self.a.BookCutflow('higgsP_SR_SF')
+            self.a.BookCutflow('eventSumSRpass_SF', weight='PhotonEffSF')
             self.a.SetActiveNode(checkpoint)
 #            passFailSF["fail"] = self.a.Cut('STagSR_fail_SF','((Diphoton_{2}[0] >= {3} && Diphoton_{2}[1] < {3}) || (Diphoton_{2}[1] >= {3} && Diphoton_{2}[0] < {3})) && (Dijet_{0}[0] > {1} && Dijet_{0}[1] > {1})'.format(Toptagger, ToptaggerWP, Stagger, StaggerWP))
             passFailSF["fail"] = self.a.Cut('STagSR_fail_SF','(DiPhotonCatSF == 1) && (Dijet_{0}[0] > {1} && Dijet_{0}[1] > {1})'.format(Toptagger, ToptaggerWP))
-            self.higgsF_SR_SF = self.getNweighted()
-            self.AddCutflowColumn(self.higgsF_SR_SF, "higgsF_SR_SF")
-            efffail = self.higgsF_SR_SF/nTotOrig
-            print('SR: efffail = {}'.format(efffail*100))
-            self.eventSumSRfail_SF = self.a.DataFrame.Sum("PhotonEffSF").GetValue()
-            effSFfail = self.eventSumSRfail_SF/nTotSF
-            print('SR: effSFfail = {}'.format(effSFfail*100))
+            self.a.BookCutflow('higgsF_SR_SF')
+            self.a.BookCutflow('eventSumSRfail_SF', weight='PhotonEffSF')
             self.a.SetActiveNode(checkpoint)
 #            passFailSF["failfail"] = self.a.Cut('STagSR_failfail_SF','(Diphoton_{2}[0] < {3} && Diphoton_{2}[1] < {3}) && (Dijet_{0}[0] > {1} && Dijet_{0}[1] > {1})'.format(Toptagger, ToptaggerWP, Stagger, StaggerWP))
             passFailSF["failfail"] = self.a.Cut('STagSR_failfail_SF','(DiPhotonCatSF == 0) && (Dijet_{0}[0] > {1} && Dijet_{0}[1] > {1})'.format(Toptagger, ToptaggerWP))
-            self.higgsFF_SR_SF = self.getNweighted()
-            self.AddCutflowColumn(self.higgsFF_SR_SF, "higgsFF_SR_SF")
-            efffailfail = self.higgsFF_SR_SF/nTotOrig
-            print('SR: efffailfail = {}'.format(efffailfail*100))
-            self.eventSumSRfailfail_SF = self.a.DataFrame.Sum("PhotonEffSF").GetValue()
-            effSFfailfail = self.eventSumSRfailfail_SF/nTotSF
-            print('SR: effSFfail fail = {}'.format(effSFfailfail*100))
+            self.a.BookCutflow('higgsFF_SR_SF')
+            self.a.BookCutflow('eventSumSRfailfail_SF', weight='PhotonEffSF')
         else:
             totCR_SF = self.a.Cut('STagCR_SF','((Dijet_{0}[0] > {1} && Dijet_{0}[1] <{1}) || (Dijet_{0}[1] > {1} && Dijet_{0}[0] <{1}))'.format(Toptagger, ToptaggerWP))
-            self.higgs_CR_SF = self.getNweighted()
-            self.AddCutflowColumn(self.higgs_CR_SF, "higgs_CR_SF")
-            print('Obtaining efficiencies for CR_SF')
-            eff = self.higgs_CR_SF/nTotOrig
-            print('CR: eff = {}'.format(eff*100.))
+            self.a.BookCutflow('higgs_CR_SF')
 #            passFailSF["pass"] = self.a.Cut('STagCR_pass_SF','(Diphoton_{2}[0] >= {3} && Diphoton_{2}[1] >= {3}) && ((Dijet_{0}[0] > {1} && Dijet_{0}[1] <{1}) || (Dijet_{0}[1] > {1} && Dijet_{0}[0] <{1}))'.format(Toptagger, ToptaggerWP, Stagger, StaggerWP))
             passFailSF["pass"] = self.a.Cut('STagCR_pass_SF','(DiPhotonCatCRSF == 2) && ((Dijet_{0}[0] > {1} && Dijet_{0}[1] <{1}) || (Dijet_{0}[1] > {1} && Dijet_{0}[0] <{1}))'.format(Toptagger, ToptaggerWP))
-            self.higgsP_CR_SF = self.getNweighted()
-            self.AddCutflowColumn(self.higgsP_CR_SF, "higgsP_CR_SF")
+            self.a.BookCutflow('higgsP_CR_SF')
         # Higgs Fail + cutflow info
             self.a.SetActiveNode(checkpoint)
 #            passFailSF["fail"] = self.a.Cut('STagCR_fail_SF','((Diphoton_{2}[0] >= {3} && Diphoton_{2}[1] < {3}) || (Diphoton_{2}[1] >= {3} && Diphoton_{2}[0] < {3})) && ((Dijet_{0}[0] > {1} && Dijet_{0}[1] <{1}) || (Dijet_{0}[1] > {1} && Dijet_{0}[0] <{1}))'.format(Toptagger, ToptaggerWP, Stagger, StaggerWP))
             passFailSF["fail"] = self.a.Cut('STagCR_fail_SF','(DiPhotonCatCRSF == 1) && ((Dijet_{0}[0] > {1} && Dijet_{0}[1] <{1}) || (Dijet_{0}[1] > {1} && Dijet_{0}[0] <{1}))'.format(Toptagger, ToptaggerWP))
-            self.higgsF_CR_SF = self.getNweighted()
-            self.AddCutflowColumn(self.higgsF_CR_SF, "higgsF_CR_SF")
+            self.a.BookCutflow('higgsF_CR_SF')
             self.a.SetActiveNode(checkpoint)
 #            passFailSF["failfail"] = self.a.Cut('STagCR_failfail_SF','(Diphoton_{2}[0] < {3} && Diphoton_{2}[1] < {3}) && ((Dijet_{0}[0] > {1} && Dijet_{0}[1] <{1}) || (Dijet_{0}[1] > {1} && Dijet_{0}[0] <{1}))'.format(Toptagger, ToptaggerWP, Stagger, StaggerWP))
             passFailSF["failfail"] = self.a.Cut('STagCR_failfail_SF','(DiPhotonCatCRSF == 0) && ((Dijet_{0}[0] > {1} && Dijet_{0}[1] <{1}) || (Dijet_{0}[1] > {1} && Dijet_{0}[0] <{1}))'.format(Toptagger, ToptaggerWP))
-            self.higgsFF_CR_SF = self.getNweighted()
-            self.AddCutflowColumn(self.higgsFF_CR_SF, "higgsFF_CR_SF")
+            self.a.BookCutflow('higgsFF_CR_SF')
         # reset node state, return dict
         self.a.SetActiveNode(checkpoint)
         return passFailSF
@@ -964,12 +1061,17 @@ class TTClass:
         self.a.ObjectFromCollection('Higgs','Dijet','hIdx')
         return self.a.GetActiveNode()
 
-    def GetXsecScale(self):
+    def GetXsecScale(self,massPoint=None):
+        # genEventSumw is summed once when the analyzer is built (or read from the file index)
         lumi = self.config['lumi{}'.format(self.year if 'APV' not in self.year else 16)]
         xsec = self.config['XSECS'][self.setname]
-        if self.a.genEventSumw == 0:
+        if massPoint == None:
+            sumw = self.a.genEventSumw
+        else:
+            sumw = self.a.GetGenEventSumw([str(massPoint)]).get(str(massPoint),0)
+        if sumw == 0:
             raise ValueError('%s %s: genEventSumw is 0'%(self.setname, self.year))
-        return lumi*xsec/self.a.genEventSumw
+        return lumi*xsec/sumw
 
     def GetNminus1Group(self,tagger):
         # Use after ApplyTopPickViaMatch
@@ -980,6 +1082,85 @@ class TTClass:
         cutgroup.Add('%s_top_cut'%tagger,'LeadTop_{0}_TvsQCD > {1}'.format(tagger, self.cuts[tagger+'_TvsQCD']))
         return cutgroup
 
+def DerivedColumns(variation,isData):
+    '''
+    Columns defined by TTClass.DefineDerived() that can be stored in friend trees, as name -> C++ expression.
+    For variation == 'JME' the nominal expressions are given (the variations are added with analyzer.Vary()).
+    '''
+    cols = OrderedDict()
+    cols['Smass'] = 'hardware::InvariantMass({Photon1_vect,Photon2_vect})'
+    cols['m_javg'] = '(Dijet_msoftdrop[0]+Dijet_msoftdrop[1])/2'
+    if not isData:
+        pt_calibs, top_mass_calibs = JMEvariationStr('Top',variation if variation != 'JME' else 'None')     # the pt calibs are the same for
+        pt_calibs, higgs_mass_calibs = JMEvariationStr('Higgs',variation if variation != 'JME' else 'None') # top and H
+    else:
+        pt_calibs = top_mass_calibs = higgs_mass_calibs = '{Dijet_JES_nom}'
+    cols['Dijet_pt_corr'] = 'hardware::MultiHadamardProduct(Dijet_pt,%s)'%pt_calibs
+    cols['Dijet_msoftdrop_corrT'] = 'hardware::MultiHadamardProduct(Dijet_msoftdrop,%s)'%top_mass_calibs
+    cols['Dijet_msoftdrop_corrH'] = 'hardware::MultiHadamardProduct(Dijet_msoftdrop,%s)'%higgs_mass_calibs
+    cols['mth1'] = 'hardware::InvariantMass({Top1_vect,Photon1_vect,Photon2_vect})'
+    cols['mth2'] = 'hardware::InvariantMass({Top2_vect,Photon1_vect,Photon2_vect})'
+    cols['topchoice'] = 'int((Dijet_particleNet_TvsQCD[0]>0.8) || (Dijet_particleNet_TvsQCD[1]<0.8))'
+    cols['mth'] = 'topchoice*mth1+(1-topchoice)*mth2'
+    cols['pt0'] = 'Dijet_pt_corr[0]'
+    cols['pt1'] = 'Dijet_pt_corr[1]'
+    cols['HT'] = 'pt0+pt1'
+    return cols
+
+def FriendFileName(f,variation):
+    return os.path.join(FRIEND_DIR, os.path.basename(f).replace('.root','_%s_friend.root'%variation))
+
+def FriendKey(f,variation):
+    '''
+    Identifies the friend tree of snapshot `f` for `variation`: changes if the snapshot file
+    or the DerivedColumns() expressions change.
+    '''
+    key = hashlib.sha1(FileStamp(f).encode('utf-8'))
+    key.update(variation.encode('utf-8'))
+    key.update(','.join(FRIEND_IDS).encode('utf-8'))
+    for isData in [False, True]:
+        for name, expr in DerivedColumns(variation, isData).items():
+            key.update(('%s=%s;'%(name,expr)).encode('utf-8'))
+    return key.hexdigest()
+
+def FriendAlignmentCut():
+    '''
+    Cut that passes every event whose FRIEND_IDS match those stored in its friend entry and stops the event loop otherwise.
+    '''
+    match = ' && '.join(['%s == %s.%s'%(c,FRIEND_TREE,c) for c in FRIEND_IDS])
+    return '(%s) ? true : throw std::runtime_error("%s entries do not line up with the events (%s differ)")'%(match,FRIEND_TREE,'/'.join(FRIEND_IDS))
+
+def FindFriends(files,variation):
+    '''
+    Returns {file: friend file} for the files in `files` that have a friend tree for `variation` whose key matches FriendKey().
+    '''
+    out = {}
+    for f in files:
+        friend = FriendFileName(f, variation)
+        if not os.path.exists(friend): continue
+        tf = ROOT.TFile.Open(friend, 'READ')
+        key = tf.Get('friendKey') if tf != None and not tf.IsZombie() else None
+        if key != None and key.GetTitle() == FriendKey(f, variation):
+            out[f] = friend
+        if tf != None: tf.Close()
+    return out
+
+JMEvariations = ['%s_%s'%(jme,v) for jme in ['JES','JER','JMS','JMR'] for v in ['up','down']]
+
+def JMEvaryStr():
+    '''
+    C++ expression for analyzer.Vary() giving, for each of Dijet_pt_corr, Dijet_msoftdrop_corrT and Dijet_msoftdrop_corrH,
+    the corrected values under every variation in JMEvariations (same calibrations as JMEvariationStr()).
+    '''
+    cols = {'pt':[], 'T':[], 'H':[]}
+    for variation in JMEvariations:
+        pt_calibs, top_mass_calibs = JMEvariationStr('Top',variation)
+        pt_calibs, higgs_mass_calibs = JMEvariationStr('Higgs',variation)
+        cols['pt'].append('hardware::MultiHadamardProduct(Dijet_pt,%s)'%pt_calibs)
+        cols['T'].append('hardware::MultiHadamardProduct(Dijet_msoftdrop,%s)'%top_mass_calibs)
+        cols['H'].append('hardware::MultiHadamardProduct(Dijet_msoftdrop,%s)'%higgs_mass_calibs)
+    return 'ROOT::RVec<ROOT::RVec<ROOT::RVec<float>>>{{%s},{%s},{%s}}'%(','.join(cols['pt']),','.join(cols['T']),','.join(cols['H']))
+
 def JMEvariationStr(p,variation):
     base_calibs = ['Dijet_JES_nom','Dijet_JER_nom', 'Dijet_JMS_nom', 'Dijet_JMR_nom']
     variationType = variation.split('_')[0]
@@ -2,6 +2,7 @@
 #include "TIMBER/Framework/include/common.h"
 #include <string>
 #include <vector>
+#include <algorithm>
 #include <random> // because TRandom wouldn't work in this case..
 
 using namespace ROOT::VecOps;
@@ -1655,3 +1656,47 @@ RVec<int> PickDijetsNminus1(RVec<float> phi) {
     }
     return {jet0Idx,jet1Idx};
 }
+
+/*****************************************************************
+ *  Generator record slimming
+ *  -------------------------
+ *  GenSlimIdx() returns the indices of the GenPart entries kept in
+ *  slimmed MC snapshots: last-copy tops, W bosons and scalars
+ *  (pdgIds in `scalarIds`), photons coming from a scalar, and all
+ *  hard-process particles. GenSlimMother() gives, for each kept
+ *  particle, the index (in the slimmed collection) of its closest
+ *  kept ancestor, or -1 if there is none.
+ *  statusFlags bits: 7 = isHardProcess, 13 = isLastCopy
+ *****************************************************************/
+RVec<int> GenSlimIdx(RVec<int> pdgId, RVec<int> statusFlags, RVec<int> motherIdx, RVec<int> scalarIds) {
+    RVec<int> out;
+    for (int i = 0; i < pdgId.size(); i++) {
+	int id = std::abs(pdgId[i]);
+	bool lastCopy = (statusFlags[i] >> 13) & 1;
+	bool hardProcess = (statusFlags[i] >> 7) & 1;
+	bool isScalar = std::find(scalarIds.begin(), scalarIds.end(), id) != scalarIds.end();
+	bool fromScalar = false;
+	if (id == 22 && motherIdx[i] > -1) {
+	    fromScalar = std::find(scalarIds.begin(), scalarIds.end(), std::abs(pdgId[motherIdx[i]])) != scalarIds.end();
+	}
+	if (hardProcess || fromScalar || (lastCopy && (id == 6 || id == 24 || isScalar))) {
+	    out.push_back(i);
+	}
+    }
+    return out;
+}
+
+RVec<int> GenSlimMother(RVec<int> slimIdx, RVec<int> motherIdx) {
+    // position of each original index in the slimmed collection
+    std::vector<int> newIdx(motherIdx.size(), -1);
+    for (int j = 0; j < slimIdx.size(); j++) {newIdx[slimIdx[j]] = j;}
+    RVec<int> out(slimIdx.size(), -1);
+    for (int j = 0; j < slimIdx.size(); j++) {
+	int mother = motherIdx[slimIdx[j]];
+	while (mother > -1 && newIdx[mother] < 0) {
+	    mother = motherIdx[mother];
+	}
+	out[j] = mother > -1 ? newIdx[mother] : -1;
+    }
+    return out;
+}
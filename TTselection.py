@@ -1,73 +1,90 @@
 import ROOT, time
 from collections import OrderedDict
-from TIMBER.Analyzer import HistGroup, Correction
+from TIMBER.Analyzer import HistGroup, Correction, DeferredHist, _requireHeaders
 from TIMBER.Tools.Common import CompileCpp
 ROOT.gROOT.SetBatch(True)
 
 #DP EDIT
 from TTClass import TTClass
+from helpers import CompileCppCached
 
-def getSaaEfficiencies(analyzer, SRorCR, Toptagger, ToptaggerWP, Stagger, StaggerWP):
+class EfficiencyPlanner(object):
+    '''
+	Collects the weighted event sums behind the tagging efficiencies so that all of them
+	are filled in a single event loop instead of one loop per GetValue().
+	Book every efficiency first, call Run() once, then read the values back (planner[name])
+	to bind them as constants in the downstream Defines.
+	The sums go through the analyzer's result cache, so if all of them are cached no loop is run.
+    '''
+    def __init__(self, analyzer, node=None, weight='genWeight'):
+	self.a = analyzer
+	self.node = analyzer.GetActiveNode() if node == None else node
+	self.weight = weight
+	self._sums = {}			# (node hash, cut) -> lazy Sum, so identical aggregates are only booked once
+	self._booked = OrderedDict()	# efficiency name -> (numerator, denominator)
+	self._values = OrderedDict()
+
+    def _sum(self, node, cut=''):
+	key = (node.hash, cut)
+	if key not in self._sums:
+	    if cut != '': _requireHeaders(cut)	# the Filter bypasses analyzer.Cut(), which would declare the headers
+	    df = node.DataFrame if cut == '' else node.DataFrame.Filter(cut)
+	    self._sums[key] = self.a.BookCached(lambda: df.Sum(self.weight), ('Sum', self.weight, cut), node)
+	return self._sums[key]
+
+    def Book(self, name, cut, node=None):
+	'''
+	    Book efficiency `name` = sum(weight | cut)/sum(weight) at `node` (planner node by default).
+	    Returns the name to look the value up with after Run().
+	'''
+	if node == None: node = self.node
+	self._booked[name] = (self._sum(node, cut), self._sum(node))
+	return name
+
+    def Run(self):
+	'''
+	    Evaluate every booked efficiency. All sums hang off the same RDataFrame so the first
+	    GetValue() runs the one event loop and the others are already filled.
+	'''
+	print('Obtaining {} efficiencies in one event loop'.format(len(self._booked)))
+	for name, (num, den) in self._booked.items():
+	    self._values[name] = num.GetValue()/den.GetValue()
+	    print('{}: eff = {}%'.format(name, self._values[name]*100.))
+	return self._values
+
+    def Handles(self):
+	'''
+	    Lazy sums behind the booked efficiencies (unless cached), for ROOT.RDF.RunGraphs().
+	'''
+	return [s.GetHandle() for s in self._sums.values() if s.GetHandle() != None]
+
+    def __getitem__(self, name):
+	if name not in self._values:
+	    raise KeyError('Efficiency {} has not been evaluated - call Run() first.'.format(name))
+	return self._values[name]
+
+def getSaaEfficiencies(planner, SRorCR, Toptagger, ToptaggerWP, Stagger, StaggerWP):
     ''' 
-	call this function after ApplyTopPick() has been called
-	Therefore, we have to prepend the tagger with 'Higgs_'
+	Books the photon tag efficiencies (pass, fail, failfail) in the SR or CR top-tag region.
+	These are measured on the planner node (kinematic selection) rather than after ApplyTopPick_SR/CR(),
+	since the HasTop cut from PickTopWithSFs2() keeps every event, and that way they can be filled
+	in the same event loop as the top efficiencies.
+	Returns the names of the three efficiencies in the planner.
     '''
-    print('Obtaining efficiencies in {}'.format(SRorCR))
-#DP EDIT
-    start = analyzer.GetActiveNode()
-    nTot = analyzer.DataFrame.Sum("genWeight").GetValue()
-    print("nTot = {}".format(nTot))
     if (SRorCR == 'SR'):
-       analyzer.Cut("Eff_{}_cut".format(SRorCR),"(Dijet_{0}[0] > {1}) && (Dijet_{0}[1] > {1})".format(Toptagger, ToptaggerWP))
-       nTSR = analyzer.DataFrame.Sum("genWeight").GetValue()
-       print("nTSR = {}".format(nTSR))
-       analyzer.Cut("Eff_{}_PASS_cut".format(SRorCR),"(Diphoton_{2}[0] >= {3}) && (Diphoton_{2}[1] >= {3}) && (Dijet_{0}[0] > {1}) && (Dijet_{0}[1] > {1})".format(Toptagger, ToptaggerWP, Stagger, StaggerWP))
-       nTPASS = analyzer.DataFrame.Sum("genWeight").GetValue()
-       print("nTPASS= {}".format(nTPASS))
-       analyzer.SetActiveNode(start)
-       analyzer.Cut("Eff_{}_FAIL_cut".format(SRorCR),"((Diphoton_{2}[0] >= {3} && Diphoton_{2}[1] < {3}) || (Diphoton_{2}[1] >= {3} && Diphoton_{2}[0] < {3})) && (Dijet_{0}[0] > {1} && Dijet_{0}[1] > {1})".format(Toptagger, ToptaggerWP, Stagger, StaggerWP))
-       nTFAIL = analyzer.DataFrame.Sum("genWeight").GetValue()
-       print("nTFAIL= {}".format(nTFAIL))
-       analyzer.SetActiveNode(start)
-       analyzer.Cut("Eff_{}_FAILFAIL_cut".format(SRorCR),"(Diphoton_{2}[0] < {3} && Diphoton_{2}[1] < {3}) && (Dijet_{0}[0] > {1} && Dijet_{0}[1] > {1})".format(Toptagger, ToptaggerWP, Stagger, StaggerWP))
-       nTFAILFAIL = analyzer.DataFrame.Sum("genWeight").GetValue()
-       print("nTFAILFAIL= {}".format(nTFAILFAIL))
+	region = "(Dijet_{0}[0] > {1}) && (Dijet_{0}[1] > {1})".format(Toptagger, ToptaggerWP)
     else:
-       analyzer.Cut("Eff_{}_cut".format(SRorCR),"((Dijet_{0}[0] > {1}) && (Dijet_{0}[1] < {1})) || ((Dijet_{0}[1] > {1}) && (Dijet_{0}[0] < {1}))".format(Toptagger, ToptaggerWP))
-       nTSR = analyzer.DataFrame.Sum("genWeight").GetValue()
-       print("nTCR = {}".format(nTSR))
-       analyzer.Cut("Eff_{}_PASS_cut".format(SRorCR),"(Diphoton_{2}[0] >= {3} && Diphoton_{2}[1] >= {3}) && ((Dijet_{0}[0] > {1} && Dijet_{0}[1] < {1}) || (Dijet_{0}[1] > {1} && Dijet_{0}[0] < {1}))".format(Toptagger, ToptaggerWP, Stagger, StaggerWP))
-       nTPASS = analyzer.DataFrame.Sum("genWeight").GetValue()
-       print("nTPASS= {}".format(nTPASS))
-       analyzer.SetActiveNode(start)
-       analyzer.Cut("Eff_{}_FAIL_cut".format(SRorCR),"((Diphoton_{2}[0] >= {3} && Diphoton_{2}[1] < {3}) || (Diphoton_{2}[1] >= {3} && Diphoton_{2}[0] < {3})) && ((Dijet_{0}[0] > {1} && Dijet_{0}[1] < {1}) || (Dijet_{0}[1] > {1} && Dijet_{0}[0] < {1}))".format(Toptagger, ToptaggerWP, Stagger, StaggerWP))
-       nTFAIL = analyzer.DataFrame.Sum("genWeight").GetValue()
-       print("nTFAIL= {}".format(nTFAIL))
-       analyzer.SetActiveNode(start)
-       analyzer.Cut("Eff_{}_FAILFAIL_cut".format(SRorCR),"(Diphoton_{2}[0] < {3} && Diphoton_{2}[1] < {3}) && ((Dijet_{0}[0] > {1} && Dijet_{0}[1] < {1}) || (Dijet_{0}[1] > {1} && Dijet_{0}[0] < {1}))".format(Toptagger, ToptaggerWP, Stagger, StaggerWP))
-       nTFAILFAIL = analyzer.DataFrame.Sum("genWeight").GetValue()
-       print("nTFAILFAIL= {}".format(nTFAILFAIL))
-    effPASS = nTPASS/nTot
-    effFAIL = nTFAIL/nTot
-    effFAILFAIL = nTFAILFAIL/nTot
-    analyzer.SetActiveNode(start)
-    print('{}: effPASS = {}%'.format(SRorCR, effPASS*100.))
-    print('{}: effFAIL = {}%'.format(SRorCR, effFAIL*100.))
-    print('{}: effFAILFAIL = {}%'.format(SRorCR, effFAILFAIL*100.))
+	region = "((Dijet_{0}[0] > {1}) && (Dijet_{0}[1] < {1})) || ((Dijet_{0}[1] > {1}) && (Dijet_{0}[0] < {1}))".format(Toptagger, ToptaggerWP)
+    effPASS = planner.Book("Eff_{}_PASS".format(SRorCR), "(Diphoton_{0}[0] >= {1} && Diphoton_{0}[1] >= {1}) && ({2})".format(Stagger, StaggerWP, region))
+    effFAIL = planner.Book("Eff_{}_FAIL".format(SRorCR), "((Diphoton_{0}[0] >= {1} && Diphoton_{0}[1] < {1}) || (Diphoton_{0}[1] >= {1} && Diphoton_{0}[0] < {1})) && ({2})".format(Stagger, StaggerWP, region))
+    effFAILFAIL = planner.Book("Eff_{}_FAILFAIL".format(SRorCR), "(Diphoton_{0}[0] < {1} && Diphoton_{0}[1] < {1}) && ({2})".format(Stagger, StaggerWP, region))
     return effPASS, effFAIL, effFAILFAIL
 
-def getTopEfficiencies(analyzer, tagger, wp, idx, tag):
-    print('Obtaining efficiencies for jet at idx {}'.format(idx))
-    start = analyzer.GetActiveNode()
-    nTot = analyzer.DataFrame.Sum("genWeight").GetValue()
-    print("nTot = {}".format(nTot))
-    analyzer.Cut("Eff_jet{}_{}_cut".format(idx, tag),"{} > {}".format(tagger, wp))
-    nT = analyzer.DataFrame.Sum("genWeight").GetValue()
-    print('nT = {}'.format(nT))
-    eff = nT/nTot
-    print('SR: eff = {}'.format(eff*100.))
-    analyzer.SetActiveNode(start)
-    return eff
+def getTopEfficiencies(planner, tagger, wp, idx, tag):
+    '''
+	Books the top tag efficiency for the jet at idx. Returns its name in the planner.
+    '''
+    return planner.Book("Eff_jet{}_{}".format(idx, tag), "{} > {}".format(tagger, wp))
 
 def getPhotonEfficiencies(analyzer, tagger, wp, idx, tag):
     print('Obtaining efficiencies for photon at idx {}'.format(idx))
@@ -82,136 +99,184 @@ def getPhotonEfficiencies(analyzer, tagger, wp, idx, tag):
     analyzer.SetActiveNode(start)
     return eff
 
-def TTselection(args):
-    ROOT.ROOT.EnableImplicitMT(args.threads)
-    start = time.time()
-    signal = False
+class SelectionJob(object):
+    '''
+	One TTselection() run, split at the points where it needs an event loop so that the graphs
+	of many samples can be built up front and executed together (see perform_selection.RunSelections()).
+	    1) __init__(): open the sample, apply the kinematic selection and book the efficiencies
+	    2) BookTemplates(): with the efficiencies evaluated, apply the SFs and book the template histograms
+	    3) Write(): write the templates and normalization to the output file
+	Handles() returns the lazy results the next stage needs, so they can be passed to ROOT.RDF.RunGraphs().
+    '''
+    def __init__(self, args, cacheNode=True):
+	'''
+	    cacheNode: materialise the columns of the kinematic selection used by BookTemplates() with analyzer.Cache(),
+	    so that the template loop reads them from memory. Turn off when many jobs share one process.
+	'''
+	self.args = args
+	self.start = time.time()
+	self.signal = False
 
-    print('Opening dijet_nano/{}_{}_snapshot.txt'.format(args.setname,args.era))
+	print('Opening dijet_nano/{}_{}_snapshot.txt'.format(args.setname,args.era))
 #DP EDIT
-#    selection = THClass('dijet_nano/{}_{}_snapshot.txt'.format(args.setname,args.era),args.era,1,1)
-    selection = TTClass('dijet_nano/{}_{}_snapshot.txt'.format(args.setname,args.era),args.era,1,1)
-    selection.OpenForSelection(args.variation)
-
-    # apply HT cut due to improved trigger effs
-    before = selection.a.DataFrame.Count()
-    selection.a.Cut('HT_cut','HT > {}'.format(args.HT))
-    after = selection.a.DataFrame.Count()
-
-#    selection.ApplyTrigs(args.trigEff)
-#    args.trigEff = Correction("TriggerEff%s"%args.era,'EffLoader_2DfittedHist.cc',['out_Eff_20%s.root'%args.era,'Eff_20%s'%args.era],corrtype='weight')
-    selection.ApplyTrigs(args.trigEff)
-    # scale factor application
-    TopVar = 0
-    SaaVar = 0
-    if ('StoAA' in args.setname):
-	signal = True
-	# Determine which SF we are varying 
-	if (args.variation == 'PNetTop_up'):
-	    TopVar = 1
-	    SaaVar = 0
-	elif (args.variation == 'PNetTop_down'):
-	    TopVar = 2
-	    SaaVar = 0
-	elif (args.variation == 'PNetSaa_up'):
-	    TopVar = 0
-	    SaaVar = 1
-	elif (args.variation == 'PNetSaa_down'):
-	    TopVar = 0
-	    SaaVar = 2
-	else:	# if doing any other variation, keep Top/Xbb SFs nominal
-	    TopVar = 0
-	    SaaVar = 0
-
-    kinOnly = selection.a.MakeWeightCols(extraNominal='' if selection.a.isData else 'genWeight*%s'%selection.GetXsecScale())
-    out = ROOT.TFile.Open('rootfiles/THselection_HT%s_%s%s_%s%s.root'%(args.HT, args.setname,
-                                                                  '' if args.topcut == '' else '_htag'+args.topcut.replace('.','p'),
-                                                                  args.era,
-                                                                  '' if args.variation == 'None' else '_'+args.variation), 'RECREATE')
-    out.cd()
-
-    for t in ['particleNet']:	# add other taggers to this list if studying more than just ParticleNet
-#DP EDIT: commented out these two lines
-#        if args.topcut != '':
-#            selection.cuts[t+'MD_HbbvsQCD'] = float(args.topcut)
-
-            top_tagger = '%s_TvsQCD'%t
-            photon_tagger = 'cutBased'
-
-	    print('----------------------- CONTROL REGION --------------------------------------------------------------')
-	    # CONTROL REGION - ONE TOP REAL ONE NOT
-	    selection.a.SetActiveNode(kinOnly)
-            e0CR = getTopEfficiencies(analyzer=selection.a, tagger='Dijet_'+top_tagger+'[0]', wp=0.8, idx=0, tag='cr1')
-            e1CR = getTopEfficiencies(analyzer=selection.a, tagger='Dijet_'+top_tagger+'[1]', wp=0.8, idx=1, tag='cr2')
-            selection.ApplyTopPick_CR(TopTagger='Dijet_'+top_tagger, pt='Dijet_pt_corr', TopScoreCut=0.8, eff0=e0CR, eff1=e1CR, year=args.era, TopVariation=TopVar)
-            eff_CR_PASS, eff_CR_FAIL, eff_CR_FAILFAIL = getSaaEfficiencies(selection.a, 'CR', top_tagger, 0.8, photon_tagger, 1)
-#            eA0CR = getPhotonEfficiencies(analyzer=selection.a, tagger='Diphoton_'+photon_tagger+'[0]', wp=1, idx=0, tag='cr1')
-#            eA1CR = getPhotonEfficiencies(analyzer=selection.a, tagger='Diphoton_'+photon_tagger+'[1]', wp=1, idx=1, tag='cr2')
-            selection.a.Define('DiPhotonCatCRSF','updatePhotonTag(DiPhotonCat,Diphoton_pt,Diphoton_eta,Diphoton_cutBased,1.0,{0},{1})'.format(eff_CR_PASS, eff_CR_FAIL))
-#            passfailCR = selection.ApplySTagTopTag('CR', top_tagger, 0.8, photon_tagger, 1)
-            passfailCR_SF = selection.ApplySTagTopTagSF('CR', top_tagger, 0.8, photon_tagger, 1)
-	    # SIGNAL REGION
-            print('----------------------- SIGNAL REGION --------------------------------------------------------------')
-            selection.a.SetActiveNode(kinOnly)
+#	selection = THClass('dijet_nano/{}_{}_snapshot.txt'.format(args.setname,args.era),args.era,1,1)
+	# JME mode varies the derived columns in the same loop, so they cannot come from a friend tree
+	self.selection = TTClass('dijet_nano/{}_{}_snapshot.txt'.format(args.setname,args.era),args.era,1,1,friendVariation=args.variation if args.variation != 'JME' else None)
+	selection = self.selection
+	selection.OpenForSelection(args.variation)
+
+	# apply HT cut due to improved trigger effs
+	self.before = selection.a.BookCached(lambda: selection.a.DataFrame.Count(), ('Count',))
+	selection.a.Cut('HT_cut','HT > {}'.format(args.HT))
+	self.after = selection.a.BookCached(lambda: selection.a.DataFrame.Count(), ('Count',))
+
+#	selection.ApplyTrigs(args.trigEff)
+#	args.trigEff = Correction("TriggerEff%s"%args.era,'EffLoader_2DfittedHist.cc',['out_Eff_20%s.root'%args.era,'Eff_20%s'%args.era],corrtype='weight')
+	selection.ApplyTrigs(args.trigEff)
+	# scale factor application
+	self.TopVar = 0
+	self.SaaVar = 0
+	if ('StoAA' in args.setname):
+	    self.signal = True
+	    # Determine which SF we are varying 
+	    if (args.variation == 'PNetTop_up'):
+		self.TopVar = 1
+	    elif (args.variation == 'PNetTop_down'):
+		self.TopVar = 2
+	    elif (args.variation == 'PNetSaa_up'):
+		self.SaaVar = 1
+	    elif (args.variation == 'PNetSaa_down'):
+		self.SaaVar = 2
+	    # if doing any other variation, keep Top/Xbb SFs nominal
+
+	self.kinOnly = selection.a.MakeWeightCols(extraNominal='' if selection.a.isData else 'genWeight*%s'%selection.GetXsecScale(), asVector=True)
+	if getattr(args, 'checkWeights', False):
+	    print('Checked the weight vector against the string-built weights for %s events'%selection.a.CheckWeightCols(node=self.kinOnly))
+
+	# add other taggers to this list if studying more than just ParticleNet
+	self.top_tagger = '%s_TvsQCD'%'particleNet'
+	self.photon_tagger = 'cutBased'
+
+	# FIRST EVENT LOOP: every efficiency needed by the SF-based Defines in BookTemplates()
+	self.effs = EfficiencyPlanner(selection.a, node=self.kinOnly)
+	self.e0CR = getTopEfficiencies(self.effs, tagger='Dijet_'+self.top_tagger+'[0]', wp=0.8, idx=0, tag='cr1')
+	self.e1CR = getTopEfficiencies(self.effs, tagger='Dijet_'+self.top_tagger+'[1]', wp=0.8, idx=1, tag='cr2')
+	self.e0SR = getTopEfficiencies(self.effs, tagger='Dijet_'+self.top_tagger+'[0]', wp=0.8, idx=0, tag='sr1')
+	self.e1SR = getTopEfficiencies(self.effs, tagger='Dijet_'+self.top_tagger+'[1]', wp=0.8, idx=1, tag='sr2')
+	self.eff_CR = getSaaEfficiencies(self.effs, 'CR', self.top_tagger, 0.8, self.photon_tagger, 1)
+	self.eff_SR = getSaaEfficiencies(self.effs, 'SR', self.top_tagger, 0.8, self.photon_tagger, 1)
+	self.templates = []
+	# the SR and CR branches are built from kinOnly, so read it from memory (or a spill file) in the
+	# template loop. Not worth a loop if the first stage results are all in the result cache.
+	# The size is estimated from the HT cut count, so reading it fills the efficiencies first.
+	if cacheNode and len(self.Handles()) > 0:
+	    self.kinOnly = selection.a.Cache(self.kinOnly, columns=self.CacheColumns(), entries=self.after)
+
+    def CacheColumns(self):
+	'''
+	    Columns of kinOnly read by BookTemplates(): the top tagger and photon inputs of the SR/CR picks,
+	    the masses that are plotted, HT, the weights (the vector and its elements) and the cutflow weights.
+	'''
+	available = [str(c) for c in self.kinOnly.DataFrame.GetColumnNames()]
+	used = ['Dijet_'+self.top_tagger, 'Dijet_pt_corr', 'Diphoton_pt', 'Diphoton_eta', 'Diphoton_'+self.photon_tagger,
+		'DiPhotonCat', 'PhotonEffSF', 'Smass', 'mth', 'HT', 'genWeight']
+	return [c for c in used if c in available] + [c for c in available if c.startswith('weight')]
+
+    def GetOutputName(self):
+	return GetOutputName(self.args)
+
+    def Handles(self):
+	'''
+	    Lazy results that still have to be filled before the next stage: the efficiency sums
+	    (and HT cut counts) before BookTemplates(), the templates and yields after it.
+	'''
+	if len(self.templates) == 0:
+	    return self.effs.Handles() + [h for h in [self.before.GetHandle(), self.after.GetHandle()] if h != None]
+	out = []
+	for templates in self.templates:
+	    for h in templates.items.values():
+		# accumulated templates share one action, varied templates (variation 'JME') are filled with their nominal
+		if isinstance(h, DeferredHist): h = h.GetHandle()
+		if h != None and not any(h is o for o in out): out.append(h)
+	for name, counts in self.selection.a.Cutflow.items():
+	    for h in [c.GetHandle() for c in counts.values()]:
+		if h != None and not any(h is o for o in out): out.append(h)
+	return out
+
+    def BookTemplates(self):
+	selection = self.selection
+	effs = self.effs
+	effs.Run()
+	TopVar = self.TopVar
+
+	print('----------------------- CONTROL REGION --------------------------------------------------------------')
+	# CONTROL REGION - ONE TOP REAL ONE NOT
+	selection.a.SetActiveNode(self.kinOnly)
+	selection.ApplyTopPick_CR(TopTagger='Dijet_'+self.top_tagger, pt='Dijet_pt_corr', TopScoreCut=0.8, eff0=effs[self.e0CR], eff1=effs[self.e1CR], year=self.args.era, TopVariation=TopVar)
+	selection.a.Define('DiPhotonCatCRSF','updatePhotonTag(DiPhotonCat,Diphoton_pt,Diphoton_eta,Diphoton_cutBased,1.0,{0},{1})'.format(effs[self.eff_CR[0]], effs[self.eff_CR[1]]))
+#	passfailCR = selection.ApplySTagTopTag('CR', self.top_tagger, 0.8, self.photon_tagger, 1)
+	passfailCR_SF = selection.ApplySTagTopTagSF('CR', self.top_tagger, 0.8, self.photon_tagger, 1)
+	# SIGNAL REGION
+	print('----------------------- SIGNAL REGION --------------------------------------------------------------')
+	selection.a.SetActiveNode(self.kinOnly)
 #DP EDIT
-            e0SR = getTopEfficiencies(analyzer=selection.a, tagger='Dijet_'+top_tagger+'[0]', wp=0.8, idx=0, tag='sr1')
-            e1SR = getTopEfficiencies(analyzer=selection.a, tagger='Dijet_'+top_tagger+'[1]', wp=0.8, idx=1, tag='sr2')
-            selection.ApplyTopPick_SR(TopTagger='Dijet_'+top_tagger, pt='Dijet_pt_corr', TopScoreCut=0.8, eff0=e0SR, eff1=e1SR, year=args.era, TopVariation=TopVar)
-            eff_SR_PASS, eff_SR_FAIL, eff_SR_FAILFAIL = getSaaEfficiencies(selection.a, 'SR', top_tagger, 0.8, photon_tagger, 1)
-#            eA0SR = getPhotonEfficiencies(analyzer=selection.a, tagger='Diphoton_'+photon_tagger+'[0]', wp=1, idx=0, tag='sr1')
-#            eA1SR = getPhotonEfficiencies(analyzer=selection.a, tagger='Diphoton_'+photon_tagger+'[1]', wp=1, idx=1, tag='sr2')
-            selection.a.Define('DiPhotonCatSF','updatePhotonTag(DiPhotonCat,Diphoton_pt,Diphoton_eta,Diphoton_cutBased,1.0,{0},{1})'.format(eff_SR_PASS, eff_SR_FAIL))
-#            passfailSR = selection.ApplySTagTopTag('SR', top_tagger, 0.8, photon_tagger, 1)
-            passfailSR_SF = selection.ApplySTagTopTagSF('SR', top_tagger, 0.8, photon_tagger, 1)
+	selection.ApplyTopPick_SR(TopTagger='Dijet_'+self.top_tagger, pt='Dijet_pt_corr', TopScoreCut=0.8, eff0=effs[self.e0SR], eff1=effs[self.e1SR], year=self.args.era, TopVariation=TopVar)
+	selection.a.Define('DiPhotonCatSF','updatePhotonTag(DiPhotonCat,Diphoton_pt,Diphoton_eta,Diphoton_cutBased,1.0,{0},{1})'.format(effs[self.eff_SR[0]], effs[self.eff_SR[1]]))
+#	passfailSR = selection.ApplySTagTopTag('SR', self.top_tagger, 0.8, self.photon_tagger, 1)
+	passfailSR_SF = selection.ApplySTagTopTagSF('SR', self.top_tagger, 0.8, self.photon_tagger, 1)
+
+	# SECOND EVENT LOOP: book all templates before writing any of them so they are filled together
 	# rkey: SR/CR, pfkey: pass/loose/fail
+	print('ABOUT TO PLOT....')
+	for rkey,rpair in {"SR":passfailSR_SF,"CR":passfailCR_SF}.items():
+	    for pfkey,n in rpair.items():
+		mod_name = "%s_%s_%s"%('TvsQCD_cutBased',rkey,pfkey)
+		mod_title = "%s %s"%(rkey,pfkey)
+		print(mod_name)
+		selection.a.SetActiveNode(n)
+		self.templates.append(selection.a.MakeTemplateHistos(ROOT.TH2F('MtpvMs_%s'%mod_name,'MtpvMs %s with %s'%(mod_title,'TvsQCD_cutBased'),20,0,800,20,600,2200),['Smass','mth']))
 
-            print('ABOUT TO PLOT....')
-            for rkey,rpair in {"SR":passfailSR_SF,"CR":passfailCR_SF}.items():
-              for pfkey,n in rpair.items():
-                mod_name = "%s_%s_%s"%('TvsQCD_cutBased',rkey,pfkey)
-                print(mod_name)
-                mod_title = "%s %s"%(rkey,pfkey)
-                print(mod_title)
-                selection.a.SetActiveNode(n)
-                templates = selection.a.MakeTemplateHistos(ROOT.TH2F('MtpvMs_%s'%mod_name,'MtpvMs %s with %s'%(mod_title,'TvsQCD_cutBased'),20,0,800,20,600,2200),['Smass','mth'])
-                templates.Do('Write')
-    '''
-    # now process cutflow information
-    cutflowInfo = OrderedDict([
-	('nTop_CR',selection.nTop_CR), 
-	('higgsF_CR',selection.higgsF_CR),
-	('higgsL_CR',selection.higgsL_CR),
-	('higgsP_CR',selection.higgsP_CR),
-	('nTop_SR',selection.nTop_SR),
-	('higgsF_SR',selection.higgsF_SR),
-	('higgsL_SR',selection.higgsL_SR),
-	('higgsP_SR',selection.higgsP_SR),
-    ])
-
-    nLabels = len(cutflowInfo)
-    hCutflow = ROOT.TH1F('cutflow'.format(args.setname, args.era, args.variation), "Number of events after each cut", nLabels, 0.5, nLabels+0.5)
-    nBin = 1
-    for label, value in cutflowInfo.items():
-	hCutflow.GetXaxis().SetBinLabel(nBin, label)
-	hCutflow.AddBinContent(nBin, value)
-	nBin += 1
-    hCutflow.Write()
-    '''
+    def Write(self):
+	selection = self.selection
+	out = ROOT.TFile.Open(self.GetOutputName(), 'RECREATE')
+	out.cd()
+	for templates in self.templates:
+	    templates.Do('Write')
+
+	# yields booked by ApplySTagTopTagSF() were filled in the template loop
+	cutflow = selection.a.GetCutflow()
+	for i in range(1, cutflow.GetNbinsX()+1):
+	    print('{} = {}'.format(cutflow.GetXaxis().GetBinLabel(i), cutflow.GetBinContent(i)))
 
-    if not selection.a.isData:
-        scale = ROOT.TH1F('scale','xsec*lumi/genEventSumw',1,0,1)
-        scale.SetBinContent(1,selection.GetXsecScale())
-        scale.Write()
-#        selection.a.PrintNodeTree('NodeTree_selection.pdf',verbose=True)
-
-    before = before.GetValue()
-    after = after.GetValue()
-    frac = float(after)/float(before)
-    loss = 100.*(1-frac)
-    print('------------------------------------------------------------')
-    print('Fractional loss of {}% of events after HT cut'.format(loss))
-    print('------------------------------------------------------------')
-    print ('%s sec'%(time.time()-start))
+	if not selection.a.isData:
+	    scale = ROOT.TH1F('scale','xsec*lumi/genEventSumw',1,0,1)
+	    scale.SetBinContent(1,selection.GetXsecScale())
+	    scale.Write()
+#	selection.a.PrintNodeTree('NodeTree_selection.pdf',verbose=True)
+	out.Close()
+
+	before = self.before.GetValue()
+	after = self.after.GetValue()
+	frac = float(after)/float(before)
+	loss = 100.*(1-frac)
+	print('------------------------------------------------------------')
+	print('Fractional loss of {}% of events after HT cut'.format(loss))
+	print('------------------------------------------------------------')
+	selection.a.ResultCache.PrintStats()
+	print ('%s sec'%(time.time()-self.start))
+
+def GetOutputName(args):
+    '''Name of the file written by TTselection(args).'''
+    return 'rootfiles/THselection_HT%s_%s%s_%s%s.root'%(args.HT, args.setname,
+							 '' if args.topcut == '' else '_htag'+args.topcut.replace('.','p'),
+							 args.era,
+							 '' if args.variation == 'None' else '_'+args.variation)
+
+def TTselection(args):
+    ROOT.ROOT.EnableImplicitMT(args.threads)
+    job = SelectionJob(args)
+    job.BookTemplates()
+    job.Write()
 
 if __name__ == '__main__':
     from argparse import ArgumentParser
@@ -224,15 +289,20 @@ if __name__ == '__main__':
                         help='Year of set (16, 16APV, 17, 18).')
     parser.add_argument('-v', type=str, dest='variation',
                         action='store', default='None',
-                        help='JES_up, JES_down, JMR_up,...')
+                        help='JES_up, JES_down, JMR_up,... or JME for all JME variations in one pass')
     parser.add_argument('--HT', type=str, dest='HT',
                         action='store', default='0',
                         help='Value of HT to cut on')
     parser.add_argument('--topcut', type=str, dest='topcut',
                         action='store', default='',
                         help='Overrides config entry if non-empty')
+    parser.add_argument('-t', type=int, dest='threads',
+                        action='store', default=2,
+                        help='Number of threads')
+    parser.add_argument('--checkWeights', dest='checkWeights',
+                        action='store_true',
+                        help='Check the weight vector against the string-built weights (extra event loop)')
     args = parser.parse_args()
-    args.threads = 2
 
     # Updated method using the trigger efficiencies parameterized by 2D function
     if ('Data' not in args.setname) and (args.era == '17'): # we are dealing with MC from 2017
@@ -251,5 +321,5 @@ if __name__ == '__main__':
         args.trigEff = Correction("TriggerEff18",'TIMBER/Framework/include/EffLoader_2DfittedHist.h',['out_Eff_2018.root','Eff_2018'],corrtype='weight')
 
 #DP EDIT
-    CompileCpp('TTmodules.cc')
+    CompileCppCached('TTmodules.cc')
     TTselection(args)
@@ -6,6 +6,7 @@ ROOT.gROOT.SetBatch(True)
 
 #DP EDIT
 from TTClass import TTClass
+from helpers import CompileCppCached
 
 def getSaaEfficiencies(analyzer, SRorCR, Toptagger, ToptaggerWP, Stagger, StaggerWP):
     ''' 
@@ -251,5 +252,5 @@ if __name__ == '__main__':
         args.trigEff = Correction("TriggerEff18",'TIMBER/Framework/include/EffLoader_2DfittedHist.h',['out_Eff_2018.root','Eff_2018'],corrtype='weight')
 
 #DP EDIT
-    CompileCpp('TTmodules.cc')
+    CompileCppCached('TTmodules.cc')
     TTselection(args)
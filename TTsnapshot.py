@@ -3,7 +3,9 @@ ROOT.gROOT.SetBatch(True)
 # ROOT.ROOT.EnableImplicitMT(2)
 from TIMBER.Tools.Common import CompileCpp
 from argparse import ArgumentParser
-from TTClass import TTClass
+from collections import OrderedDict
+from TTClass import TTClass, RECORDABLE_CUTS, REDUCED_PRECISION
+from helpers import CompileCppCached
 from array import array
 
 parser = ArgumentParser()
@@ -19,13 +21,45 @@ parser.add_argument('-j', type=int, dest='ijob',
 parser.add_argument('-n', type=int, dest='njobs',
                     action='store', default=1,
                     help='Number of jobs')
+parser.add_argument('--shard', dest='shard',
+                    action='store_true', default=False,
+                    help='Split the set into jobs by entry ranges (so one file can be shared by several jobs) instead of whole files')
+parser.add_argument('--compression', type=str, dest='compression',
+                    action='store', default='ZLIB:1',
+                    help='Snapshot compression as <algorithm>:<level> (ZLIB, LZMA, LZ4, ZSTD). See snapshotBenchmark.py')
+parser.add_argument('--basketSize', type=int, dest='basketSize',
+                    action='store', default=None,
+                    help='Snapshot basket size in bytes')
+parser.add_argument('--autoFlush', type=int, dest='autoFlush',
+                    action='store', default=None,
+                    help='Snapshot cluster size (TTree::SetAutoFlush())')
+parser.add_argument('--slimGen', dest='slimGen',
+                    action='store_true', default=False,
+                    help='Only keep the generator particles used downstream (tops, Ws, scalars and their photons, hard process)')
+parser.add_argument('--record', type=str, dest='record', nargs='+',
+                    action='store', default=[], choices=RECORDABLE_CUTS,
+                    help='Cuts to only record in the CutBits column (applied downstream) instead of applying them')
+parser.add_argument('--packTrigs', dest='packTrigs',
+                    action='store_true', default=False,
+                    help='Store the HLT paths and MET filters as uint64 bit masks instead of one branch each')
+parser.add_argument('--precision', type=str, dest='precision', nargs='*',
+                    action='store', default=None,
+                    help='Store floats with reduced precision: TTClass.REDUCED_PRECISION if given alone, or <column regex>:<mantissa bits> policies. See precisionValidation.py')
 args = parser.parse_args()
+if args.precision == None:
+    precision = None
+elif len(args.precision) == 0:
+    precision = REDUCED_PRECISION
+else:
+    precision = OrderedDict([(p.rsplit(':',1)[0], int(p.rsplit(':',1)[1])) for p in args.precision])
 
 start = time.time()
 
-CompileCpp('TTmodules.cc')
+CompileCppCached('TTmodules.cc')
 print('Pre selection')
-selection = TTClass('raw_nano/%s_%s.txt'%(args.setname,args.era),args.era,args.ijob,args.njobs)
+# the cutflow is filled with the snapshot and never booked again on the same (Condor) disk, so no result cache
+selection = TTClass('raw_nano/%s_%s.txt'%(args.setname,args.era),args.era,args.ijob,args.njobs,shardFiles=args.shard,resultCache=False)
+selection.recordCuts = args.record
 print('Post selection pre analysis1')
 selection.ApplyKinematicsSnap()
 print('After Kinematics Pre Lepton')
@@ -34,5 +68,5 @@ print('After Lepton Pre analysis')
 selection.analysis1()
 print('After analysis1 Pre Out')
 out = selection.ApplyStandardCorrections(snapshot=True)
-selection.Snapshot(out)
+selection.Snapshot(out, compression=args.compression, basketSize=args.basketSize, autoFlush=args.autoFlush, slimGen=args.slimGen, packTrigs=args.packTrigs, precision=precision)
 print ('%s sec'%(time.time()-start))
@@ -4,6 +4,7 @@ from collections import OrderedDict
 from TIMBER.Analyzer import HistGroup
 from TIMBER.Tools.Common import CompileCpp
 from TTClass import TTClass
+from helpers import CompileCppCached
 
 def MakeEfficiency(year, HT=0):
     '''
@@ -37,7 +38,7 @@ def MakeEfficiency(year, HT=0):
     selection.a.Cut('HT_cut', 'HT > {}'.format(HT))
     after = selection.a.DataFrame.Count()
     
-    noTag = selection.a.Cut('pretrig','HLT_Mu50==1')
+    noTag = selection.a.Cut('pretrig',selection.a.GetTriggerString(['HLT_Mu50']))
 
     # Baseline - no tagging
     hists.Add('preTagDenominator',selection.a.DataFrame.Histo1D(('preTagDenominator','',22,800,3000),'mth_trig'))
@@ -86,7 +87,7 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     start = time.time()
-    CompileCpp('TTmodules.cc')
+    CompileCppCached('TTmodules.cc')
 #DP EDIT
     for y in ['16']:
 #    for y in ['16','17','17B','17All','18']:
@@ -6,6 +6,7 @@ from TIMBER.Tools.Common import CompileCpp
 #DP EDIT
 #from THClass import THClass
 from TTClass import TTClass
+from helpers import CompileCppCached
 
 def MakeEfficiency(year, HT=0):
 #DP EDIT
@@ -43,7 +44,7 @@ def MakeEfficiency(year, HT=0):
     selection.a.Cut('HT_cut', 'HT > {}'.format(HT))
     after = selection.a.DataFrame.Count()
 
-    noTag = selection.a.Cut('pretrig','HLT_Mu50==1')
+    noTag = selection.a.Cut('pretrig',selection.a.GetTriggerString(['HLT_Mu50']))
 
     # Baseline - no tagging
     hists.Add('preTagDenominator',selection.a.DataFrame.Histo2D(('preTagDenominator','',20,0,800,20,600,2200),'Smass_trig','mth_trig'))
@@ -92,7 +93,7 @@ if __name__ == '__main__':
                         help='Recycle existing files and just plot.')
     args = parser.parse_args()
     start = time.time()
-    CompileCpp('TTmodules.cc')
+    CompileCppCached('TTmodules.cc')
     if not args.recycle:
 # DP EDIT only do 16
 #        for y in ['16','17','17B','18']:
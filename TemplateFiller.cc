@@ -0,0 +1,119 @@
+#include "ROOT/RDataFrame.hxx"
+#include "ROOT/RVec.hxx"
+#include "TH1.h"
+#include "TROOT.h"
+#include <cmath>
+#include <memory>
+#include <string>
+#include <vector>
+
+/*****************************************************************
+ *  TemplateFiller
+ *  --------------
+ *  RDataFrame action used by analyzer.MakeTemplateHistos() to fill
+ *  the templates of every weight variation in one call per event.
+ *  The bin is looked up once per event and the sums of weights
+ *  (and weights squared) for all variations are kept next to each
+ *  other in one flat array per slot, [bin*nWeights + iWeight],
+ *  instead of one TH1/TH2 clone per weight per slot.
+ *  The histograms (one per weight, binned like the template) are
+ *  only built in Finalize().
+ *****************************************************************/
+class TemplateSet {
+    public:
+	std::vector<std::shared_ptr<TH1>> hists;
+	size_t size() const {return hists.size();}
+	TH1* at(size_t i) const {return hists.at(i).get();}
+};
+
+class TemplateFiller : public ROOT::Detail::RDF::RActionImpl<TemplateFiller> {
+    public:
+	using Result_t = TemplateSet;
+    private:
+	std::shared_ptr<TH1> _template;		// binning only
+	std::vector<std::string> _names;
+	size_t _nWeights;
+	size_t _nCells;
+	bool _is2D;
+	std::vector<std::vector<double>> _sumw;	// per slot
+	std::vector<std::vector<double>> _sumw2;	// per slot
+	std::vector<ULong64_t> _entries;		// per slot
+	std::shared_ptr<TemplateSet> _result;
+    public:
+	TemplateFiller(const TH1 &templateHist, const std::vector<std::string> &names, unsigned int nSlots) :
+	    _names(names), _nWeights(names.size()), _result(std::make_shared<TemplateSet>()) {
+	    TDirectory::TContext ctx(nullptr);
+	    _template.reset(static_cast<TH1*>(templateHist.Clone()));
+	    _template->SetDirectory(nullptr);
+	    _template->Reset();
+	    _nCells = _template->GetNcells();
+	    _is2D = _template->GetDimension() == 2;
+	    _sumw.resize(nSlots);
+	    _sumw2.resize(nSlots);
+	    _entries.resize(nSlots, 0);
+	}
+	TemplateFiller(TemplateFiller &&) = default;
+	TemplateFiller(const TemplateFiller &) = delete;
+
+	std::shared_ptr<TemplateSet> GetResultPtr() const {return _result;}
+	void Initialize() {
+	    for (size_t slot = 0; slot < _sumw.size(); slot++) {
+		_sumw[slot].assign(_nCells*_nWeights, 0.);
+		_sumw2[slot].assign(_nCells*_nWeights, 0.);
+	    }
+	}
+	void InitTask(TTreeReader *, unsigned int) {}
+
+	void Exec(unsigned int slot, double x, double y, const ROOT::RVec<double> &weights) {
+	    // FindFixBin() is const, so one template can be shared by all slots
+	    int bin;
+	    if (_is2D) {
+		bin = _template->GetBin(_template->GetXaxis()->FindFixBin(x), _template->GetYaxis()->FindFixBin(y));
+	    } else {
+		bin = _template->GetXaxis()->FindFixBin(x);
+	    }
+	    double *sumw = &_sumw[slot][bin*_nWeights];
+	    double *sumw2 = &_sumw2[slot][bin*_nWeights];
+	    for (size_t i = 0; i < _nWeights; i++) {
+		sumw[i] += weights[i];
+		sumw2[i] += weights[i]*weights[i];
+	    }
+	    _entries[slot]++;
+	}
+
+	void Finalize() {
+	    // merge the slots into the first one
+	    for (size_t slot = 1; slot < _sumw.size(); slot++) {
+		for (size_t i = 0; i < _sumw[0].size(); i++) {
+		    _sumw[0][i] += _sumw[slot][i];
+		    _sumw2[0][i] += _sumw2[slot][i];
+		}
+		_entries[0] += _entries[slot];
+	    }
+	    TDirectory::TContext ctx(nullptr);
+	    for (size_t iw = 0; iw < _nWeights; iw++) {
+		TH1 *h = static_cast<TH1*>(_template->Clone(_names[iw].c_str()));
+		h->SetDirectory(nullptr);
+		if (h->GetSumw2N() == 0) {h->Sumw2();}
+		for (size_t bin = 0; bin < _nCells; bin++) {
+		    h->SetBinContent(bin, _sumw[0][bin*_nWeights+iw]);
+		    h->SetBinError(bin, std::sqrt(_sumw2[0][bin*_nWeights+iw]));
+		}
+		h->SetEntries(_entries[0]);
+		_result->hists.emplace_back(h);
+	    }
+	    // release the accumulators
+	    std::vector<std::vector<double>>().swap(_sumw);
+	    std::vector<std::vector<double>>().swap(_sumw2);
+	}
+
+	std::string GetActionName() {return "TemplateFiller";}
+};
+
+// Booking helper so the templated Book<>() call does not have to be made from python.
+// For 1D templates pass the x column as y as well (it is not used).
+// The accumulators are sized by the slots of the dataframe (fixed when it was made), not the current thread pool.
+ROOT::RDF::RResultPtr<TemplateSet> BookTemplateFiller(ROOT::RDF::RNode df, const TH1 &templateHist, const std::vector<std::string> &names,
+						      const std::string &x, const std::string &y, const std::string &weights) {
+    return df.Book<double, double, ROOT::RVec<double>>(TemplateFiller(templateHist, names, df.GetNSlots()), {x, y, weights});
+}
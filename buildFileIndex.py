@@ -0,0 +1,25 @@
+'''Build/update the input file metadata index (<list>.index.json) for .txt file lists
+so that jobs do not have to open every file to validate it. Run once after making
+or changing the lists, ex.
+    python buildFileIndex.py -t raw_nano/*.txt -j 16
+    python buildFileIndex.py -t dijet_nano/*_snapshot.txt -j 16
+'''
+from argparse import ArgumentParser
+from helpers import BuildFileIndex
+
+parser = ArgumentParser()
+parser.add_argument('-t', type=str, dest='txtfiles', nargs='+',
+                    action='store', required=True,
+                    help='.txt file lists to index')
+parser.add_argument('-j', type=int, dest='nproc',
+                    action='store', default=8,
+                    help='Number of processes to open files with')
+parser.add_argument('--rebuild', dest='rebuild',
+                    action='store_true',
+                    help='Re-index every file instead of only new/changed ones')
+args = parser.parse_args()
+
+for txtfile in args.txtfiles:
+    index = BuildFileIndex(txtfile, args.nproc, args.rebuild)
+    nEmpty = len([f for f in index.values() if f['empty']])
+    print('{}: {} files ({} empty or missing Events)'.format(txtfile, len(index), nEmpty))
@@ -1,6 +1,6 @@
 '''
 Cutflow information is stored differently in snapshots and selection files. 
-Snapshots: stored in Events TTree
+Snapshots: stored in Histogram (older snapshots: stored in Events TTree)
 	NPROC, NFLAGS, NJETS, NPT, NKIN
 Selection: stored in Histogram
 	nTop_CR, nTop_SR
@@ -40,6 +40,15 @@ def generateCutflow(setName, HT=750, selection=False):
 	    for fName in rFiles:
 	        #print('opening {}'.format(fName))
 	        f = ROOT.TFile.Open(fName, 'READ')
+	        # newer snapshots store the cutflow as a labeled histogram (filled even if no events pass)
+	        cutflow = f.Get('cutflow')
+	        if cutflow:
+		    for i in range(1, cutflow.GetNbinsX()+1):
+			cut = cutflow.GetXaxis().GetBinLabel(i)
+			if cut in varDict:
+			    varDict[cut] += cutflow.GetBinContent(i)
+		    f.Close()
+		    continue
 	        # check for empty TTrees
 	        if not f.Get('Events'):
 		    #print('Skipping file due to no Events TTree:\n\t{}'.format(fName))
@@ -1,15 +1,23 @@
-def SplitUp(filename,npieces,nFiles=False):
+def SplitUp(filename,npieces,nFiles=False,fileIndex=None):
     '''Take in a txt file name where the contents are root
     file names separated by new lines. Split up the files
     into N lists where N is `npieces` in the case that `nFiles == False`.
     In the case that `nFiles == True`, `npieces` is treated as the
     number of files to have per list.
+    If `fileIndex` (see LoadFileIndex()) is given, not empty and `nFiles == False`,
+    the files are split so that each list has about the same number of events
+    instead of the same number of files (see _balancePieces()). With an empty
+    index (no index file) the split is the same as without one.
+    Blank lines are skipped.
     '''
-    files = open(filename,'r').readlines()
+    files = [f.strip() for f in open(filename,'r').readlines() if f.strip() != '']
     nfiles = len(files)
 
     if npieces > nfiles:
         npieces = nfiles
+
+    if fileIndex and not nFiles:
+        return _balancePieces(files,npieces,fileIndex)
     
     if not nFiles: files_per_piece = float(nfiles)/float(npieces)
     else: files_per_piece = npieces
@@ -19,9 +27,425 @@ def SplitUp(filename,npieces,nFiles=False):
     for ipiece in range(1,npieces+1):
         piece = []
         for ifile in range(iend,min(nfiles,int(ipiece*files_per_piece))):
-            piece.append(files[ifile].strip())
+            piece.append(files[ifile])
 
         iend = int(ipiece*files_per_piece)
         out.append(piece)
     
-    return out
\ No newline at end of file
+    return out
+
+def _balancePieces(files,npieces,fileIndex):
+    '''Greedy bin packing of `files` into `npieces` lists with about equal numbers of events.
+    Files are taken from largest to smallest and each goes to the list with the fewest
+    events so far. Ties are broken by position so every job computes the same split.
+    Files missing from the index count as the average file. Within a list the files
+    keep the order of the .txt file.
+    '''
+    entries = [fileIndex[f]['entries'] for f in files if f in fileIndex and fileIndex[f]['exists']]
+    average = float(sum(entries))/len(entries) if len(entries) > 0 else 1.
+    def cost(f):
+        if f not in fileIndex or not fileIndex[f]['exists']:
+            return average
+        return max(fileIndex[f]['entries'],1)
+
+    order = sorted(range(len(files)), key=lambda i: (-cost(files[i]),i))
+    loads = [0.]*npieces
+    pieces = [[] for ipiece in range(npieces)]
+    for i in order:
+        ipiece = min(range(npieces), key=lambda p: (loads[p],p))
+        loads[ipiece]+= cost(files[i])
+        pieces[ipiece].append(i)
+
+    return [[files[i] for i in sorted(piece)] for piece in pieces]
+
+
+def CompileCppCached(filename, cacheDir=None):
+    '''Compile a C++ module (ex. TTmodules.cc) into a shared library with ACLiC
+    and keep it in `cacheDir` so later runs (and condor jobs shipping the cache in
+    their tarball) only have to load it instead of JIT-compiling the source every time.
+    The library is keyed by a hash of the source, the local headers it includes (and the
+    ones they include, recursively), and the ROOT version, so it is rebuilt only when one of those changes. The source is also
+    registered with TIMBER.Analyzer.RegisterModuleSource() for the analyzer's result cache.
+    Falls back to TIMBER's CompileCpp() (JIT) if the library cannot be built.
+
+    @param filename (str): C++ file to compile.
+    @param cacheDir (str, optional): Where to keep the libraries. Defaults to $TTCPPCACHE
+        if set, otherwise TIMBER's cache directory (TIMBER.Analyzer.FUNCINFO_CACHE,
+        $TIMBERCACHE or .cppcache/ in the working directory).
+
+    Returns:
+        str: Path of the loaded library (or '' if the JIT fallback was used).
+    '''
+    import os, hashlib, shutil, time, fcntl
+    import ROOT
+    from TIMBER.Analyzer import RegisterModuleSource, FUNCINFO_CACHE
+    start = time.time()
+    if cacheDir == None:
+        cacheDir = os.environ.get('TTCPPCACHE', FUNCINFO_CACHE)
+    if not os.path.isdir(cacheDir):
+        try: os.makedirs(cacheDir)
+        except OSError: pass	# made by another process in the meantime
+
+    # key: source + quoted (local) includes, recursively + ROOT version
+    timberpath = os.environ.get('TIMBERPATH','')
+    srcdir = os.path.dirname(os.path.abspath(filename))
+    key = hashlib.sha1()
+    seen = set()
+    def addSource(path):
+        path = os.path.abspath(path)
+        if path in seen: return
+        seen.add(path)
+        source = open(path,'r').read()
+        key.update(source.encode('utf-8'))
+        for line in source.splitlines():
+            if line.strip().startswith('#include') and '"' in line:
+                inc = line.split('"')[1]
+                for d in [os.path.dirname(path), srcdir, timberpath]:
+                    if os.path.isfile(os.path.join(d,inc)):
+                        addSource(os.path.join(d,inc))
+                        break
+    addSource(filename)
+    key.update(ROOT.gROOT.GetVersion().encode('utf-8'))
+    # results cached by the analyzer depend on the module (and its includes)
+    RegisterModuleSource(filename, key.hexdigest())
+
+    stem = os.path.basename(filename).rsplit('.',1)
+    cachedSrc = os.path.join(cacheDir,'%s_%s.%s'%(stem[0],key.hexdigest()[:12],stem[1]))
+    lib = cachedSrc.rsplit('.',1)[0]+'_'+stem[1]+'.so'
+
+    # one process builds, the others wait for it and then load
+    lock = open(os.path.join(cacheDir,'.lock'),'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+        if os.path.isfile(lib) and ROOT.gSystem.Load(lib) >= 0:
+            print('CompileCppCached: loaded %s for %s in %.2f s'%(lib,filename,time.time()-start))
+            return lib
+        if not os.path.isfile(cachedSrc):
+            shutil.copy(filename,cachedSrc)
+        if timberpath != '': ROOT.gSystem.AddIncludePath('-I%s'%timberpath)
+        ROOT.gSystem.AddIncludePath('-I%s'%srcdir)
+        if ROOT.gSystem.CompileMacro(cachedSrc,'kO'):
+            print('CompileCppCached: compiled %s into %s in %.2f s'%(filename,lib,time.time()-start))
+            return lib
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    print('CompileCppCached: WARNING could not build %s, falling back to JIT'%filename)
+    from TIMBER.Tools.Common import CompileCpp
+    CompileCpp(filename)
+    print('CompileCppCached: JIT compiled %s in %.2f s'%(filename,time.time()-start))
+    return ''
+
+#---------------------------------------------------------#
+# Input file metadata index                               #
+# Sidecar <list>.index.json next to a raw_nano/dijet_nano #
+# .txt file list so the analyzer does not have to open    #
+# every file to validate it and sum the Runs tree         #
+#---------------------------------------------------------#
+def _xrootdName(f):
+    if 'root://' not in f and f.startswith('/store/'):
+        return 'root://cms-xrd-global.cern.ch/'+f
+    return f
+
+def _indexFile(f):
+    '''Collect the metadata of one input file (run in a worker process by BuildFileIndex()).
+
+    @param f (str): File name as given in the .txt list.
+
+    Returns:
+        tuple: (f, metadata dict).
+    '''
+    import os
+    import ROOT
+    meta = {'exists':False, 'hasEvents':False, 'hasRuns':False, 'entries':0, 'empty':True,
+            'genEventSumw':{}, 'genEventCount':{}, 'LHEPdfWeightTitle':'', 'size':-1, 'mtime':-1}
+    if os.path.isfile(f):
+        meta['size'] = os.path.getsize(f)
+        meta['mtime'] = os.path.getmtime(f)
+    tf = ROOT.TFile.Open(_xrootdName(f),'READ')
+    if tf == None or tf.IsZombie():
+        return f, meta
+    meta['exists'] = True
+    events = tf.Get('Events')
+    if events:
+        meta['hasEvents'] = True
+        meta['entries'] = events.GetEntries()
+        meta['empty'] = meta['entries'] == 0
+        pdfbranch = events.GetBranch('LHEPdfWeight')
+        if pdfbranch != None: meta['LHEPdfWeightTitle'] = pdfbranch.GetTitle()
+    runs = tf.Get('Runs')
+    if runs:
+        meta['hasRuns'] = True
+        branches = [b.GetName() for b in runs.GetListOfBranches()]
+        sumwBranches = [b for b in branches if b == 'genEventSumw' or b.startswith('genEventSumw_')]
+        countBranches = [b for b in branches if b == 'genEventCount' or b.startswith('genEventCount_')]
+        if len(sumwBranches+countBranches) > 0:
+            # one pass over the Runs tree for all branches
+            rdf = ROOT.RDataFrame(runs)
+            sumwPtrs = dict((b,rdf.Sum(b)) for b in sumwBranches)
+            countPtrs = dict((b,rdf.Sum(b)) for b in countBranches)
+            for b in sumwBranches: meta['genEventSumw'][b] = sumwPtrs[b].GetValue()
+            for b in countBranches: meta['genEventCount'][b] = int(countPtrs[b].GetValue())
+    tf.Close()
+    return f, meta
+
+def FileStamp(f):
+    '''String that changes when file `f` is replaced: its name, size and modification time
+    for local files, or its name and TFile UUID for remote ones.
+    '''
+    import os
+    if os.path.isfile(f):
+        return '%s:%s:%s'%(f, os.path.getsize(f), os.path.getmtime(f))
+    import ROOT
+    tf = ROOT.TFile.Open(_xrootdName(f),'READ')
+    if tf == None or tf.IsZombie():
+        raise ReferenceError('File %s does not exist'%f)
+    stamp = '%s:%s'%(f, tf.GetUUID().AsString())
+    tf.Close()
+    return stamp
+
+def GetFileIndexName(txtfile):
+    return txtfile+'.index.json'
+
+def BuildFileIndex(txtfile, nproc=8, rebuild=False):
+    '''Build (or update) the metadata index of the files in `txtfile`. For each file it records
+    whether it exists, has Events/Runs trees, the number of entries (and whether it is empty),
+    the genEventSumw/genEventCount totals of every such Runs branch, the LHEPdfWeight branch title
+    (for the LHA ID), and the size and modification time.
+    Only files that are new or whose size/modification time changed (local files) are opened again,
+    in parallel over `nproc` processes.
+
+    @param txtfile (str): .txt file with one ROOT file per line.
+    @param nproc (int, optional): Number of processes to open files with. Defaults to 8.
+    @param rebuild (bool, optional): Re-index every file. Defaults to False.
+
+    Returns:
+        dict: {file name as in txtfile: metadata}.
+    '''
+    import os, json, multiprocessing
+    files = [l.strip() for l in open(txtfile,'r').readlines() if l.strip() != '']
+    indexname = GetFileIndexName(txtfile)
+    index = {}
+    if os.path.isfile(indexname) and not rebuild:
+        index = dict([(str(f),meta) for f,meta in json.load(open(indexname,'r')).items()])
+
+    todo = []
+    for f in files:
+        if f not in index:
+            todo.append(f)
+        elif os.path.isfile(f) and (os.path.getsize(f) != index[f]['size'] or os.path.getmtime(f) != index[f]['mtime']):
+            todo.append(f)
+    if len(todo) == 0:
+        return dict([(f,index[f]) for f in files])
+
+    print('Indexing {} files from {} with {} processes'.format(len(todo), txtfile, min(nproc,len(todo))))
+    if nproc > 1 and len(todo) > 1:
+        pool = multiprocessing.Pool(min(nproc,len(todo)))
+        results = pool.map(_indexFile, todo)
+        pool.close()
+        pool.join()
+    else:
+        results = [_indexFile(f) for f in todo]
+    for f, meta in results:
+        index[f] = meta
+
+    tmpname = indexname+'.tmp%s'%os.getpid()
+    json.dump(index, open(tmpname,'w'), indent=1)
+    os.rename(tmpname, indexname)
+    return dict([(f,index[f]) for f in files])
+
+def LoadFileIndex(txtfile):
+    '''Read the metadata index of `txtfile` made by BuildFileIndex() (buildFileIndex.py), for use in jobs.
+    The index is only read, never written, so jobs running at the same time do not all build it.
+    Entries of local files whose size or modification time changed since indexing are left out,
+    like files that are not in the index. A job indexes its own such files with IndexFiles().
+
+    @param txtfile (str): .txt file with one ROOT file per line.
+
+    Returns:
+        dict: {file name as in txtfile: metadata}, for the up to date files of the index.
+    '''
+    import os, json
+    indexname = GetFileIndexName(txtfile)
+    index = {}
+    if os.path.isfile(indexname):
+        index = dict([(str(f),meta) for f,meta in json.load(open(indexname,'r')).items()])
+    else:
+        print('WARNING: no file index {} - run buildFileIndex.py -t {}'.format(indexname, txtfile))
+    for f in list(index.keys()):
+        if os.path.isfile(f) and (os.path.getsize(f) != index[f]['size'] or os.path.getmtime(f) != index[f]['mtime']):
+            del index[f]
+    return index
+
+def IndexFiles(files):
+    '''Index `files` in this process, one after the other, without writing the index
+    (ex. the files of a job that are missing from LoadFileIndex()).
+
+    Returns:
+        dict: {file: metadata}.
+    '''
+    if len(files) > 0:
+        print('Indexing {} files missing from the file index (or changed since)'.format(len(files)))
+    return dict([_indexFile(f) for f in files])
+
+def GetClusterBoundaries(f, treename='Events'):
+    '''Entries at which the TTree clusters (baskets flushed together) of file `f` start,
+    plus the number of entries at the end. Entry ranges cut at these boundaries do not
+    make two jobs decompress the same baskets.
+
+    @param f (str): ROOT file name.
+    @param treename (str, optional): Defaults to 'Events'.
+
+    Returns:
+        list(int): Sorted boundaries, starting at 0 and ending at the number of entries.
+    '''
+    import ROOT
+    tf = ROOT.TFile.Open(_xrootdName(f),'READ')
+    tree = tf.Get(treename)
+    nentries = tree.GetEntries()
+    boundaries = []
+    it = tree.GetClusterIterator(0)
+    start = it.Next()
+    while start < nentries:
+        boundaries.append(start)
+        start = it.Next()
+    tf.Close()
+    return sorted(set(boundaries+[0,nentries]))
+
+def ShardUp(filename, npieces, fileIndex, ijob=None):
+    '''Split the events of the files in `filename` into `npieces` contiguous entry ranges
+    of about the same size, so that one large file can be processed by several jobs.
+    Cuts inside a file are moved to the closest cluster boundary (see GetClusterBoundaries()).
+    Files that do not exist or have no events are left out.
+
+    @param filename (str): .txt file with one ROOT file per line.
+    @param npieces (int): Number of jobs.
+    @param fileIndex (dict): Metadata index of `filename` (see LoadFileIndex()). Must have every file.
+    @param ijob (int, optional): Only work out the ranges of job `ijob` (1 to `npieces`), which needs the
+        cluster boundaries of at most the two files its range starts and ends in. Defaults to None (all jobs).
+
+    Raises:
+        ReferenceError: If a file is not in `fileIndex`.
+
+    Returns:
+        list(list(tuple)): For each job, a list of (file, firstEntry, lastEntry) with lastEntry excluded.
+            Only the list of job `ijob` if given.
+    '''
+    files = [f.strip() for f in open(filename,'r').readlines() if f.strip() != '']
+    missing = [f for f in files if f not in fileIndex]
+    if len(missing) > 0:
+        raise ReferenceError('ShardUp: {} files of {} are not indexed (or changed since) - run buildFileIndex.py -t {}'.format(len(missing), filename, filename))
+    files = [f for f in files if fileIndex[f]['exists'] and fileIndex[f]['hasEvents'] and not fileIndex[f]['empty']]
+    offsets = [0] # global entry of the first event of each file
+    for f in files:
+        offsets.append(offsets[-1]+fileIndex[f]['entries'])
+    total = offsets[-1]
+
+    # global cut position ipiece, moved onto a cluster boundary
+    # (nearest boundary is monotonic in the target, so the cuts stay in order)
+    clusters = {}
+    def cut(ipiece):
+        if ipiece <= 0: return 0
+        if ipiece >= npieces: return total
+        target = int(round(float(ipiece)*total/npieces))
+        if len(files) == 0: return target
+        ifile = max(i for i in range(len(files)) if offsets[i] <= target)
+        local = target-offsets[ifile]
+        if 0 < local < fileIndex[files[ifile]]['entries']:
+            if files[ifile] not in clusters:
+                clusters[files[ifile]] = GetClusterBoundaries(files[ifile])
+            local = min(clusters[files[ifile]], key=lambda b: (abs(b-local),b))
+            target = offsets[ifile]+local
+        return target
+
+    out = []
+    for ipiece in (range(npieces) if ijob == None else [ijob-1]):
+        begin, end = cut(ipiece), cut(ipiece+1)
+        piece = []
+        for ifile,f in enumerate(files):
+            first = max(begin,offsets[ifile])-offsets[ifile]
+            last = min(end,offsets[ifile+1])-offsets[ifile]
+            if first < last:
+                piece.append((f,first,last))
+        out.append(piece)
+    return out if ijob == None else out[0]
+
+def MergeHists(merges, nthreads=8, allowMissing=False):
+    '''Merge the histograms of several files into combined files, in place of one `hadd` call per output.
+    Every input file is read once, even if it goes into several outputs, and the outputs are
+    summed in parallel threads. Histograms with the same name are added together.
+    Inputs can be given a scale factor which is applied while adding.
+    Missing inputs are an error, since the combined files would silently be incomplete.
+
+    @param merges (dict): {output file: [input file or (input file, scale)]}.
+    @param nthreads (int, optional): Number of threads to read and add with. Defaults to 8.
+    @param allowMissing (bool, optional): Skip missing inputs with a warning instead (outputs are
+        made from the inputs that exist). Defaults to False.
+
+    Raises:
+        ReferenceError: If an input does not exist (and not allowMissing).
+
+    Returns:
+        list(str): Output files written.
+    '''
+    import os
+    import ROOT
+    from multiprocessing.pool import ThreadPool
+    ROOT.EnableThreadSafety()
+
+    def _parse(i):
+        return i if isinstance(i,tuple) else (i,1.)
+    inputs = sorted(set(_parse(i)[0] for ins in merges.values() for i in ins))
+    missing = [i for i in inputs if not os.path.exists(i)]
+    if len(missing) > 0 and not allowMissing:
+        raise ReferenceError('MergeHists: %s input(s) do not exist:\n\t%s'%(len(missing),'\n\t'.join(missing)))
+    for i in missing: print('WARNING: %s does not exist - not merged'%i)
+
+    def _read(filename):
+        hists = []
+        f = ROOT.TFile.Open(filename,'READ')
+        seen = set()
+        for key in f.GetListOfKeys():
+            if key.GetName() in seen: continue # older cycle
+            seen.add(key.GetName())
+            obj = key.ReadObj()
+            if not obj.InheritsFrom('TH1'):
+                print('WARNING: %s in %s is not a histogram - not merged'%(key.GetName(),filename))
+                continue
+            obj.SetDirectory(0)
+            hists.append(obj)
+        f.Close()
+        return filename, hists
+
+    pool = ThreadPool(max(1,nthreads))
+    contents = dict(pool.map(_read,[i for i in inputs if i not in missing]))
+
+    def _merge(output):
+        merged = []
+        byname = {}
+        for filename,scale in [_parse(i) for i in merges[output]]:
+            if filename not in contents: continue
+            for h in contents[filename]:
+                if h.GetName() not in byname:
+                    hout = h.Clone()
+                    hout.SetDirectory(0)
+                    hout.Reset()
+                    byname[h.GetName()] = hout
+                    merged.append(hout)
+                byname[h.GetName()].Add(h,scale)
+        return output, merged
+
+    written = []
+    for output, merged in pool.imap(_merge,sorted(merges.keys())):
+        if len(merged) == 0:
+            print('WARNING: no inputs found for %s - not written'%output)
+            continue
+        f = ROOT.TFile.Open(output,'RECREATE')
+        f.cd()
+        for h in merged: h.Write()
+        f.Close()
+        written.append(output)
+    pool.close()
+    pool.join()
+    return written
@@ -0,0 +1,93 @@
+'''Write the derived selection columns (TTClass.DerivedColumns(): JME-corrected Dijet pt/msoftdrop,
+Smass, mth, m_javg, HT, ...) of every snapshot file of a set to friend trees in $TTFRIENDDIR (default friends/),
+one per snapshot file and JME variation. TTClass attaches them automatically when they are up to date,
+so the selection scripts do not recompute these columns, ex.
+    python makeFriends.py -s ttbar-allhad -y 18 -v None JES_up JES_down
+Friend trees are rebuilt when the snapshot or the column definitions change.
+They are paired with the events by entry number, so they are written single-threaded
+(a multithreaded Snapshot does not keep the entry order) and store run/event, which
+TTClass checks against the events when it reads them.
+With --check the columns read back from each friend tree are compared, entry by entry,
+with the same columns recomputed from the snapshot, ex.
+    python makeFriends.py -s ttbar-allhad -y 18 -v None --check
+'''
+import ROOT, os
+ROOT.gROOT.SetBatch(True)
+from argparse import ArgumentParser
+from TTClass import TTClass, FriendFileName, FindFriends, DerivedColumns, FRIEND_DIR, FRIEND_TREE, FRIEND_IDS, JMEvariations
+from helpers import CompileCppCached
+
+parser = ArgumentParser()
+parser.add_argument('-s', type=str, dest='setname',
+                    action='store', required=True,
+                    help='Setname to process.')
+parser.add_argument('-y', type=str, dest='era',
+                    action='store', required=True,
+                    help='Year of set (16, 16APV, 17, 18).')
+parser.add_argument('-v', type=str, dest='variations', nargs='+',
+                    action='store', default=['None'],
+                    help='Variations to make friend trees for (None, JES_up, ...)')
+parser.add_argument('--check', dest='check',
+                    action='store_true',
+                    help='Compare every friend tree with the columns recomputed from its snapshot')
+args = parser.parse_args()
+
+def CheckFriend(f, variation, friend):
+    '''Recompute the friend columns of snapshot `f` into a temporary file and compare them,
+    entry by entry, with the ones read back from `friend`.
+
+    Raises:
+        ValueError: If an entry differs (beyond float rounding) or the number of entries differs.
+    '''
+    recomputed = friend.replace('.root','_check.root')
+    selection = TTClass(f, args.era, 1, 1, friendVariation=None)
+    columns = FRIEND_IDS+list(DerivedColumns(variation, selection.a.isData).keys())
+    selection.MakeFriends(variation, recomputed)
+    selection.a.Close()
+
+    stored = ROOT.TChain(FRIEND_TREE)
+    stored.Add(friend)
+    check = ROOT.TChain(FRIEND_TREE)
+    check.Add(recomputed)
+    if stored.GetEntries() != check.GetEntries():
+        os.remove(recomputed)
+        raise ValueError('{} has {} entries but {} has {}'.format(friend, stored.GetEntries(), f, check.GetEntries()))
+    stored.AddFriend(check, 'Recomputed')
+    df = ROOT.RDataFrame(stored)
+    differ = {}
+    for c in columns:
+        ctype = str(df.GetColumnType(c))
+        if c in FRIEND_IDS:
+            differ[c] = df.Filter('%s != Recomputed.%s'%(c,c)).Count()
+        elif 'RVec' in ctype or 'vector' in ctype:
+            differ[c] = df.Filter('%s.size() != Recomputed.%s.size() || ROOT::VecOps::Any(abs(%s-Recomputed.%s) > 1e-6f*abs(Recomputed.%s))'%(c,c,c,c,c)).Count()
+        else:
+            differ[c] = df.Filter('std::abs(double(%s)-double(Recomputed.%s)) > 1e-6*std::abs(double(Recomputed.%s))'%(c,c,c)).Count()
+    bad = ['{} ({} entries)'.format(c, differ[c].GetValue()) for c in columns if differ[c].GetValue() > 0]
+    os.remove(recomputed)
+    if len(bad) > 0:
+        raise ValueError('{} does not match the columns recomputed from {}: {}'.format(friend, f, ', '.join(bad)))
+    print('{} {}: {} columns match for {} entries'.format(f, variation, len(columns), stored.GetEntries()))
+
+# single-threaded on purpose, see above
+ROOT.ROOT.DisableImplicitMT()
+CompileCppCached('TTmodules.cc')
+if not os.path.exists(FRIEND_DIR): os.makedirs(FRIEND_DIR)
+
+txt = 'dijet_nano/{}_{}_snapshot.txt'.format(args.setname, args.era)
+files = [l.strip() for l in open(txt,'r').readlines() if l.strip() != '']
+for variation in args.variations:
+    if variation not in ['None']+JMEvariations:
+        raise ValueError('Friend trees can only be made for None or one of %s'%', '.join(JMEvariations))
+    done = FindFriends(files, variation)
+    for f in files:
+        if f in done:
+            print('{} {}: up to date'.format(f, variation))
+            continue
+        print('{} {}: writing {}'.format(f, variation, FriendFileName(f, variation)))
+        selection = TTClass(f, args.era, 1, 1, friendVariation=None)
+        selection.MakeFriends(variation, FriendFileName(f, variation))
+        selection.a.Close()
+    if args.check:
+        for f in files:
+            CheckFriend(f, variation, FriendFileName(f, variation))
@@ -1,11 +1,16 @@
 from argparse import Namespace
 from glob import glob
-from THselection import THselection
+#DP EDIT
+#from THselection import THselection
+from TTselection import TTselection, SelectionJob, GetOutputName
 from THstudies import THstudies
 from TIMBER.Tools.Common import DictStructureCopy, CompileCpp, ExecuteCmd, OpenJSON, StitchQCD
 from TIMBER.Tools.Plot import CompareShapes
 from TIMBER.Analyzer import Correction
-import multiprocessing, ROOT, time
+from helpers import CompileCppCached, MergeHists
+import multiprocessing, ROOT, time, json, os
+from collections import OrderedDict
+from argparse import ArgumentParser
 
 def GetAllFiles():
     return [f for f in glob('dijet_nano/*_snapshot.txt') if f != '']
@@ -35,72 +40,219 @@ def GetHistDict(histname, all_files):
             all_hists['bkg'][proc] = hist
     return all_hists
 
-def CombineCommonSets(groupname,doStudies=False,modstr=''):
+def SelectionFileName(setname, era, variation='None', HT='0', doStudies=False, modstr=''):
+    '''Output file of a selection (TTselection.GetOutputName()) or studies task, also used for the combined sets.'''
+    if doStudies:
+        return 'rootfiles/THstudies_{0}{2}_{1}{3}.root'.format(setname, era, modstr, '' if variation == 'None' else '_'+variation)
+    return GetOutputName(Namespace(setname=setname, era=era, variation=variation, HT=HT, topcut=''))
+
+def CombineCommonSets(groupname,doStudies=False,modstr='',merges=None,scales={},HT='0',varyJME=False):
     '''Which stitch together either QCD or ttbar (ttbar-allhad+ttbar-semilep)
     @param groupname (str, optional): "QCD" or "ttbar".
+    @param HT (str, optional): HT cut of the selection outputs to combine (see TTselection.GetOutputName()). Defaults to '0'.
+    @param varyJME (bool, optional): The MC selections were run with perform_selection.py --varyJME, so each
+        sample has a single _JME file (nominal and every JME variation) instead of one file per variation. Defaults to False.
+    @param merges (dict, optional): If given, the {output:[inputs]} to combine are added to it and
+        merged later by the caller (see helpers.MergeHists()) so that several groups are merged in one pass.
+        Defaults to None in which case the files are merged here.
+    @param scales (dict, optional): {setname: scale factor} to apply to the histograms of a set while merging.
     '''
 
     if groupname not in ["QCD","ttbar","W","Z"]:
         raise ValueError('Can only combine QCD or ttbar or W/Z')
 
+    run = merges == None
+    if run: merges = OrderedDict()
+    def add(setname, components, y, v):
+        v = v[1:] if v != '' else 'None'
+        merges[SelectionFileName(setname,y,v,HT,doStudies,modstr)] = [(SelectionFileName(c,y,v,HT,doStudies,modstr),scales.get(c,1.)) for c in components]
+
 #DP EDIT      
 #    config = OpenJSON('THconfig.json')
     config = OpenJSON('TTconfig.json')
     for y in ['16','17','18']:
-        baseStr = 'rootfiles/TH%s_{0}{2}_{1}{3}.root'%('studies' if doStudies else 'selection')
         if groupname == 'ttbar':
             to_loop = [''] if doStudies else ['','JES','JER','JMS','JMR']
+            if varyJME and not doStudies:
+                add('ttbar',['ttbar-allhad','ttbar-semilep'],y,'_JME')
+                to_loop = []
             for v in to_loop:
                 if v == '':
-                    ExecuteCmd('hadd -f %s %s %s'%(
-                        baseStr.format('ttbar',y,modstr,''),
-                        baseStr.format('ttbar-allhad',y,modstr,''),
-                        baseStr.format('ttbar-semilep',y,modstr,''))
-                    )
+                    add('ttbar',['ttbar-allhad','ttbar-semilep'],y,'')
                 else:
                     for v2 in ['up','down']:
                         v3 = '_%s_%s'%(v,v2)
-                        ExecuteCmd('hadd -f %s %s %s'%(
-                            baseStr.format('ttbar',y,modstr,v3),
-                            baseStr.format('ttbar-allhad',y,modstr,v3),
-                            baseStr.format('ttbar-semilep',y,modstr,v3))
-                        )
+                        add('ttbar',['ttbar-allhad','ttbar-semilep'],y,v3)
         elif groupname == 'QCD':
-            ExecuteCmd('hadd -f %s %s %s %s %s'%(
-                baseStr.format('QCD',y,modstr,''),
-                baseStr.format('QCDHT700',y,modstr,''),
-                baseStr.format('QCDHT1000',y,modstr,''),
-                baseStr.format('QCDHT1500',y,modstr,''),
-                baseStr.format('QCDHT2000',y,modstr,''))
-            )
+            add('QCD',['QCDHT700','QCDHT1000','QCDHT1500','QCDHT2000'],y,'')
 
 	elif groupname == 'W' or 'Z':
 	    to_loop = [''] if doStudies else ['','JES','JER','JMS','JMR']
+	    components = ['{}JetsHT{}'.format(groupname,ht) for ht in [400,600,800]]
+	    if varyJME and not doStudies:
+		add('{}Jets'.format(groupname),components,y,'_JME')
+		to_loop = []
 	    for v in to_loop:
 		if v == '':
-		    ExecuteCmd('hadd -f %s %s %s %s'%(
-			baseStr.format('{}Jets'.format('W' if groupname == 'W' else 'Z'),y,modstr,''),
-			baseStr.format('{}JetsHT400'.format('W' if groupname == 'W' else 'Z'),y,modstr,''),
-			baseStr.format('{}JetsHT600'.format('W' if groupname == 'W' else 'Z'),y,modstr,''),
-			baseStr.format('{}JetsHT800'.format('W' if groupname == 'W' else 'Z'),y,modstr,''))
-		    )
+		    add('{}Jets'.format(groupname),components,y,'')
 		else:
 		    for v2 in ['up','down']:
 			v3 = '_{}_{}'.format(v,v2)
-			ExecuteCmd('hadd -f %s %s %s %s'%(
-			    baseStr.format('{}Jets'.format('W' if groupname == 'W' else 'Z'),y,modstr,v3),
-			    baseStr.format('{}JetsHT400'.format('W' if groupname == 'W' else 'Z'),y,modstr,v3),
-			    baseStr.format('{}JetsHT600'.format('W' if groupname == 'W' else 'Z'),y,modstr,v3),
-			    baseStr.format('{}JetsHT800'.format('W' if groupname == 'W' else 'Z'),y,modstr,v3))
-			)
+			add('{}Jets'.format(groupname),components,y,v3)
+
+    if run: MergeHists(merges)
+
+MANIFEST = 'rootfiles/selection_manifest.json'
+
+def LoadManifest(manifest=MANIFEST):
+    '''Completion record of the selection tasks, keyed by "setname era variation".'''
+    if not os.path.exists(manifest):
+        return {}
+    return json.load(open(manifest,'r'))
+
+def MarkDone(process, args, attempts=1, manifest=MANIFEST):
+    '''Record that `process` finished and wrote its output.'''
+    done = LoadManifest(manifest)
+    done[process] = {'output':GetOutputName(args), 'attempts':attempts, 'finished':time.strftime("%Y%m%d-%H%M%S")}
+    with open(manifest+'.tmp','w') as f:
+        json.dump(done,f,indent=2,sort_keys=True)
+    os.rename(manifest+'.tmp',manifest)
+
+def IsDone(process, done):
+    '''True if the manifest has `process` and its output file is still there.'''
+    return process in done and os.path.exists(done[process]['output'])
+
+def _runTask(args):
+    # runs in its own process so a crash (ex. segfault) only takes down this task
+    TTselection(args)
+
+def RunIsolated(process_args, nproc, threads, retries=2, backoff=30.):
+    '''Run each TTselection task in its own process, `nproc` at a time with `threads` threads each.
+    A task that crashes or does not write its output is retried up to `retries` times,
+    waiting `backoff`*2^(attempt-1) seconds before each retry. Finished tasks are recorded
+    in the manifest (see MarkDone()) by this (parent) process.
+
+    @param process_args (dict): Namespaces (as passed to TTselection()) keyed by "setname era variation".
+    @param nproc (int): Number of tasks to run at once.
+    @param threads (int): Number of threads per task.
+    @param retries (int, optional): Defaults to 2.
+    @param backoff (float, optional): Seconds to wait before the first retry. Defaults to 30.
+
+    Returns:
+        list(str): Tasks that still failed after all retries.
+    '''
+    queue = [(process, 0, 0.) for process in process_args.keys()] # (process, attempt, not before)
+    running = {}
+    failed = []
+    while len(queue) > 0 or len(running) > 0:
+        # start what we can
+        now = time.time()
+        for item in [q for q in queue if q[2] <= now]:
+            if len(running) >= nproc: break
+            queue.remove(item)
+            process, attempt = item[0], item[1]
+            process_args[process].threads = threads
+            p = multiprocessing.Process(target=_runTask, args=(process_args[process],))
+            p.start()
+            running[process] = (p, attempt)
+            print('STARTED: {} (attempt {})'.format(process, attempt+1))
+
+        time.sleep(1)
+        for process, (p, attempt) in list(running.items()):
+            if p.is_alive(): continue
+            p.join()
+            del running[process]
+            if p.exitcode == 0 and os.path.exists(GetOutputName(process_args[process])):
+                MarkDone(process, process_args[process], attempt+1)
+                print('FINISHED: {}'.format(process))
+                continue
+            reason = 'killed by signal %s'%(-p.exitcode) if p.exitcode < 0 else 'exit code %s'%p.exitcode
+            if attempt < retries:
+                wait = backoff*2**attempt
+                print('FAILED: {} ({}) - retrying in {} sec'.format(process, reason, wait))
+                queue.append((process, attempt+1, time.time()+wait))
+            else:
+                print('FAILED: {} ({}) - giving up'.format(process, reason))
+                failed.append(process)
+    return failed
+
+def RunSelections(process_args, threads, batch=0):
+    '''Run TTselection for many setname/era/variation combinations concurrently.
+    The graphs of all samples in a batch are built up front and every event loop stage
+    is executed for all of them at once with ROOT.RDF.RunGraphs() on one shared
+    ImplicitMT pool, so the cores stay busy after the small samples finish.
+    Each output file is written once its sample's results are ready.
 
+    @param process_args (dict): Namespaces (as passed to TTselection()) keyed by "setname era variation".
+    @param threads (int): Size of the shared thread pool.
+    @param batch (int, optional): Maximum number of samples to build at once (bounds memory). Defaults to 0 (all).
+    '''
+    ROOT.ROOT.EnableImplicitMT(threads)
+    processes = list(process_args.keys())
+    if batch <= 0: batch = len(processes)
+    for ibatch in range(0, len(processes), batch):
+        start = time.time()
+        jobs = OrderedDict()
+        for process in processes[ibatch:ibatch+batch]:
+            print('BOOKING: {}'.format(process))
+            jobs[process] = SelectionJob(process_args[process], cacheNode=False) # Cache() would run each loop on its own
+
+        # first loop - efficiencies for every sample
+        ROOT.RDF.RunGraphs([h for job in jobs.values() for h in job.Handles()])
+        for job in jobs.values():
+            job.BookTemplates()
+        # second loop - templates for every sample
+        ROOT.RDF.RunGraphs([h for job in jobs.values() for h in job.Handles()])
+        for process, job in jobs.items():
+            print('WRITING: {}'.format(process))
+            job.Write()
+            MarkDone(process, process_args[process])
+        print('Batch of {} processed in {} sec'.format(len(jobs), time.time()-start))
 
-def MakeRun2(setname,doStudies=False,modstr=''):
-    t = 'studies' if doStudies else 'selection'
-    ExecuteCmd('hadd -f rootfiles/TH{1}_{0}{2}_Run2.root rootfiles/TH{1}_{0}{2}_16.root rootfiles/TH{1}_{0}{2}_17.root rootfiles/TH{1}_{0}{2}_18.root'.format(setname,t,modstr))
+def MakeRun2(setname,doStudies=False,modstr='',merges=None,scales={},HT='0'):
+    '''Combine the 16, 17 and 18 files of `setname`. See CombineCommonSets() for `merges`, `scales` (keyed by year here) and `HT`.'''
+    run = merges == None
+    if run: merges = OrderedDict()
+    merges[SelectionFileName(setname,'Run2','None',HT,doStudies,modstr)] = [
+        (SelectionFileName(setname,y,'None',HT,doStudies,modstr),scales.get(y,1.)) for y in ['16','17','18']
+    ]
+    if run: MergeHists(merges)
 
 if __name__ == "__main__":
-    CompileCpp('THmodules.cc')
+    parser = ArgumentParser()
+    parser.add_argument('-p', type=int, dest='nproc',
+                        action='store', default=0,
+                        help='Number of tasks to run at once, each in its own process (defaults to number of cores / threads per task)')
+    parser.add_argument('-t', type=int, dest='threads',
+                        action='store', default=0,
+                        help='Number of threads per task (defaults to 2), or shared by all samples with --shared (defaults to number of cores)')
+    parser.add_argument('--retries', type=int, dest='retries',
+                        action='store', default=2,
+                        help='Number of times to retry a task that crashed')
+    parser.add_argument('--shared', dest='shared',
+                        action='store_true',
+                        help='Run all samples in this process on one shared thread pool (ROOT.RDF.RunGraphs) instead of one process per task')
+    parser.add_argument('--batch', type=int, dest='batch',
+                        action='store', default=0,
+                        help='With --shared, number of samples to run concurrently (0 = all at once)')
+    parser.add_argument('--varyJME', dest='varyJME',
+                        action='store_true',
+                        help='Make all JME variation templates of a MC sample in one pass (one output file per sample)')
+    parser.add_argument('--serial', dest='serial',
+                        action='store_true',
+                        help='Process one sample at a time')
+    parser.add_argument('--allow-missing', dest='allowMissing',
+                        action='store_true',
+                        help='Make the combined files from the selection outputs that exist instead of failing on missing ones')
+    cli = parser.parse_args()
+    if cli.threads <= 0:
+        cli.threads = multiprocessing.cpu_count() if cli.shared else 2
+    if cli.nproc <= 0:
+        cli.nproc = max(1, multiprocessing.cpu_count()//cli.threads)
+
+#DP EDIT
+#    CompileCpp('THmodules.cc')
+    CompileCppCached('TTmodules.cc')
     files = GetAllFiles()
 
     teff = {
@@ -124,44 +276,46 @@ if __name__ == "__main__":
 	    continue
 	if 'Data' not in setname and 'QCD' not in setname:
 	    # have to consider that 16APV is not in the trigger eff dict "teff", so have to work around it (see trigEff option below)
-	    process_args['{} {} None'.format(setname, era)] = Namespace(setname=setname, era=era, variation='None', trigEff=teff[era if 'APV' not in era else '16'],topcut='')
+	    if cli.varyJME:	# nominal and all JME variations in one file
+		process_args['{} {} JME'.format(setname,era)] = Namespace(setname=setname,era=era,variation='JME',trigEff=teff[era if 'APV' not in era else '16'],topcut='',HT='0',threads=cli.threads)
+		continue
+	    process_args['{} {} None'.format(setname, era)] = Namespace(setname=setname, era=era, variation='None', trigEff=teff[era if 'APV' not in era else '16'],topcut='',HT='0',threads=cli.threads)
 	    for jme in ['JES','JER','JMS','JMR']:
 		for v in ['up','down']:
-		    process_args['{} {} {}_{}'.format(setname,era,jme,v)] = Namespace(setname=setname,era=era,variation='%s_%s'%(jme,v),trigEff=teff[era if 'APV' not in era else '16'],topcut='')
+		    process_args['{} {} {}_{}'.format(setname,era,jme,v)] = Namespace(setname=setname,era=era,variation='%s_%s'%(jme,v),trigEff=teff[era if 'APV' not in era else '16'],topcut='',HT='0',threads=cli.threads)
 	else:
-	    process_args['{} {} None'.format(setname, era)] = Namespace(setname=setname, era=era, variation='None', trigEff=teff[era if 'APV' not in era else '16'],topcut='')
-
-
-    # Due to (seemingly) random segfaults when running this, we have to check whether or not the given setname/era/variation combo has already been performed
-    SF = glob('rootfiles/*.root')       # will have format THselection_<setname>_<era>_<var>_<up/down>.root
-    combinations = []
-    for f in SF:
-        name = f.split('.')[0].split('/')[1]
-        name = name.split('_')
-        setname = name[1]
-        era = name[2]
-	#print('{} {}'.format(setname, era))
-        if len(name) == 3:      # we're dealing with something without variations
-            var = 'None'
-	else:
-	    var = '{}_{}'.format(name[3],name[4])
-	combinations.append('{} {} {}'.format(setname,era,var))	        
+	    process_args['{} {} None'.format(setname, era)] = Namespace(setname=setname, era=era, variation='None', trigEff=teff[era if 'APV' not in era else '16'],topcut='',HT='0',threads=cli.threads)
+
 
+    # Due to (seemingly) random segfaults when running this, tasks that have already finished
+    # are recorded in the manifest (see MarkDone()) and are skipped here
+    done = LoadManifest()
+    to_process = OrderedDict()
     for process, args in process_args.items():
 	#print(process)
-        if process in combinations:
+        if IsDone(process, done):
 	    print('---- {} ALREADY PERFORMED ----'.format(process))
-	else:
+	elif cli.serial:
 	    start = time.time()
 	    print('PROCESSING: {} {} {}'.format(args.setname, args.era, args.variation))
-	    THselection(args)
+	    TTselection(args)
+	    MarkDone(process, args)
 	    print('Total time: %s'%(time.time()-start))
+	else:
+	    to_process[process] = args
+    if len(to_process) > 0 and cli.shared:
+	RunSelections(to_process, cli.threads, cli.batch)
+    elif len(to_process) > 0:
+	failed = RunIsolated(to_process, cli.nproc, cli.threads, cli.retries)
+	if len(failed) > 0:
+	    print('WARNING: {} task(s) failed after {} retries: {}'.format(len(failed), cli.retries, ', '.join(failed)))
 
-    # housekeeping 
-    CombineCommonSets('QCD',False)
-    CombineCommonSets('ttbar',False)
-    MakeRun2('Data',False)
-
-    CombineCommonSets('W',False)
-    CombineCommonSets('Z',False)
+    # housekeeping - every combined file is made in one pass over the selection outputs
+    merges = OrderedDict()
+    CombineCommonSets('QCD',False,merges=merges)
+    CombineCommonSets('ttbar',False,merges=merges,varyJME=cli.varyJME)
+    MakeRun2('Data',False,merges=merges)
 
+    CombineCommonSets('W',False,merges=merges,varyJME=cli.varyJME)
+    CombineCommonSets('Z',False,merges=merges,varyJME=cli.varyJME)
+    MergeHists(merges, nthreads=multiprocessing.cpu_count(), allowMissing=cli.allowMissing)
@@ -0,0 +1,128 @@
+'''Validate a reduced-precision snapshot (see TTsnapshot.py --precision) against the full-precision one.
+For every float column in both files the distributions are filled with the same binning and compared
+(Kolmogorov-Smirnov probability, largest bin difference in units of its uncertainty, relative shift of the mean),
+next to the compressed size of the branch in each file, ex.
+    python precisionValidation.py -i THsnapshot_ttbar-allhad_18_1of10.root -r THsnapshot_ttbar-allhad_18_1of10_reduced.root
+Without -r the reduced snapshot is made here from the full one with the given policies (TTClass.REDUCED_PRECISION by default):
+    python precisionValidation.py -i THsnapshot_ttbar-allhad_18_1of10.root -p 'Dijet_pt:10' 'Dijet_particleNet.*:8' --keep
+'''
+import ROOT, os, re, time
+ROOT.gROOT.SetBatch(True)
+from argparse import ArgumentParser
+from collections import OrderedDict
+from TIMBER.Analyzer import Node
+from TTClass import REDUCED_PRECISION
+
+parser = ArgumentParser()
+parser.add_argument('-i', type=str, dest='input',
+                    action='store', required=True,
+                    help='Full-precision snapshot')
+parser.add_argument('-r', type=str, dest='reduced',
+                    action='store', default='',
+                    help='Reduced-precision snapshot (made from -i with the -p policies if not given)')
+parser.add_argument('-p', type=str, dest='precision', nargs='+',
+                    action='store', default=[],
+                    help='<column regex>:<mantissa bits> policies to make the reduced snapshot with (defaults to TTClass.REDUCED_PRECISION)')
+parser.add_argument('-t', type=str, dest='tree',
+                    action='store', default='Events',
+                    help='TTree to compare')
+parser.add_argument('-c', type=str, dest='columns',
+                    action='store', default='.*',
+                    help='Only compare the columns matching this regex')
+parser.add_argument('--nbins', type=int, dest='nbins',
+                    action='store', default=100,
+                    help='Number of bins of the comparison histograms')
+parser.add_argument('--ks', type=float, dest='ks',
+                    action='store', default=0.05,
+                    help='Flag columns with a KS probability below this')
+parser.add_argument('-o', type=str, dest='output',
+                    action='store', default='',
+                    help='Write the comparison histograms to this file')
+parser.add_argument('--keep', dest='keep',
+                    action='store_true',
+                    help='Keep the reduced snapshot made here')
+args = parser.parse_args()
+
+def MB(nbytes):
+    return nbytes/1024./1024.
+
+# make the reduced snapshot if needed
+reduced = args.reduced
+if reduced == '':
+    precision = REDUCED_PRECISION if len(args.precision) == 0 else OrderedDict([(p.rsplit(':',1)[0], int(p.rsplit(':',1)[1])) for p in args.precision])
+    reduced = args.input.replace('.root','_reduced.root')
+    tin = ROOT.TFile.Open(args.input,'READ')
+    algo = tin.GetCompressionAlgorithm()
+    level = tin.GetCompressionLevel()
+    tin.Close()
+    algoName = {1:'ZLIB',2:'LZMA',4:'LZ4',5:'ZSTD'}.get(algo,'ZLIB')
+    Node('full',ROOT.RDataFrame(args.tree, args.input)).Snapshot('all',reduced,args.tree,
+        compressionAlgorithm=algoName,compressionLevel=level if level > 0 else 1,precision=precision)
+
+full_df = ROOT.RDataFrame(args.tree, args.input)
+reduced_df = ROOT.RDataFrame(args.tree, reduced)
+reduced_cols = [str(c) for c in reduced_df.GetColumnNames()]
+columns = []
+for c in [str(c) for c in full_df.GetColumnNames()]:
+    if c not in reduced_cols or not re.match('(%s)$'%args.columns, c): continue
+    ctype = str(full_df.GetColumnType(c))
+    if ctype in ['Float_t','float'] or ctype.endswith('<Float_t>') or ctype.endswith('<float>'):
+        columns.append(c)
+
+# binning from the full snapshot (one loop), then both sets of histograms (one loop each)
+ranges = OrderedDict([(c,(full_df.Min(c),full_df.Max(c))) for c in columns])
+hists = OrderedDict()
+for c in columns:
+    lo, hi = ranges[c][0].GetValue(), ranges[c][1].GetValue()
+    if hi <= lo: hi = lo+1.
+    hi += (hi-lo)*1e-6 # keep the maximum out of the overflow
+    hists[c] = (full_df.Histo1D(('%s_full'%c,c,args.nbins,lo,hi),c),
+                reduced_df.Histo1D(('%s_reduced'%c,c,args.nbins,lo,hi),c))
+
+# the time to fill each set is the time to read (and decompress) the compared columns
+start = time.time()
+for hfull,hreduced in hists.values(): hfull.GetValue()
+read_full = time.time()-start
+start = time.time()
+for hfull,hreduced in hists.values(): hreduced.GetValue()
+read_reduced = time.time()-start
+
+ffull = ROOT.TFile.Open(args.input,'READ')
+freduced = ROOT.TFile.Open(reduced,'READ')
+tfull = ffull.Get(args.tree)
+treduced = freduced.Get(args.tree)
+
+results = []
+for c,(hfull,hreduced) in hists.items():
+    hfull, hreduced = hfull.GetValue(), hreduced.GetValue()
+    ks = hfull.KolmogorovTest(hreduced) if hfull.Integral() > 0 and hreduced.Integral() > 0 else 1.
+    pull = 0.
+    for i in range(0, hfull.GetNbinsX()+2):
+        err = (hfull.GetBinError(i)**2+hreduced.GetBinError(i)**2)**0.5
+        if err > 0: pull = max(pull, abs(hfull.GetBinContent(i)-hreduced.GetBinContent(i))/err)
+    shift = (hreduced.GetMean()-hfull.GetMean())/hfull.GetMean() if hfull.GetMean() != 0 else 0.
+    bfull = tfull.GetBranch(c).GetZipBytes('*') if tfull.GetBranch(c) != None else 0
+    breduced = treduced.GetBranch(c).GetZipBytes('*') if treduced.GetBranch(c) != None else 0
+    results.append((c, ks, pull, shift, MB(bfull), MB(breduced), 100.*(1-float(breduced)/bfull) if bfull > 0 else 0.))
+
+print('\n{:<40} {:>8} {:>9} {:>11} {:>10} {:>10} {:>8}'.format('Column','KS prob','Max pull','Mean shift','Full [MB]','Red. [MB]','Saved'))
+for r in results:
+    print('{:<40} {:>8.3f} {:>9.2f} {:>11.2e} {:>10.2f} {:>10.2f} {:>7.1f}%{}'.format(*(r+(' <--' if r[1] < args.ks else '',))))
+
+size_full, size_reduced = os.path.getsize(args.input), os.path.getsize(reduced)
+print('\nFile size: {:.1f} MB -> {:.1f} MB ({:.1f}% smaller)'.format(MB(size_full), MB(size_reduced), 100.*(1-float(size_reduced)/size_full)))
+print('Time to read the compared columns: {:.2f} s -> {:.2f} s'.format(read_full, read_reduced))
+bad = [r[0] for r in results if r[1] < args.ks]
+if len(bad) > 0:
+    print('KS probability below {} for: {}'.format(args.ks, ', '.join(bad)))
+
+if args.output != '':
+    out = ROOT.TFile.Open(args.output,'RECREATE')
+    out.cd()
+    for c,(hfull,hreduced) in hists.items():
+        hfull.Write()
+        hreduced.Write()
+    out.Close()
+ffull.Close()
+freduced.Close()
+if args.reduced == '' and not args.keep: os.remove(reduced)
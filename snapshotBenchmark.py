@@ -0,0 +1,86 @@
+'''Compare snapshot settings (compression algorithm/level, basket size, auto-flush) on an existing
+snapshot. For each setting the Events TTree is re-written and the write time, file size and the
+time to read every branch back are reported, ex.
+    python snapshotBenchmark.py -i THsnapshot_ttbar-allhad_18_1of10.root -c ZLIB:1 LZ4:4 ZSTD:5 LZMA:9
+    python snapshotBenchmark.py -i THsnapshot_ttbar-allhad_18_1of10.root -c LZ4:4 --basketSize 32000 64000 --autoFlush -30000000
+The chosen setting can then be given to TTsnapshot.py (--compression, --basketSize, --autoFlush).
+'''
+import ROOT, os, time, itertools
+ROOT.gROOT.SetBatch(True)
+from argparse import ArgumentParser
+from TIMBER.Analyzer import COMPRESSION_ALGORITHMS
+from TIMBER.Tools.Common import CompileCpp
+
+parser = ArgumentParser()
+parser.add_argument('-i', type=str, dest='input',
+                    action='store', required=True,
+                    help='Snapshot to re-write')
+parser.add_argument('-t', type=str, dest='tree',
+                    action='store', default='Events',
+                    help='TTree to re-write')
+parser.add_argument('-c', type=str, dest='compression', nargs='+',
+                    action='store', default=['ZLIB:1','LZ4:4','ZSTD:5','LZMA:9'],
+                    help='Settings to compare as <algorithm>:<level> (%s)'%', '.join(COMPRESSION_ALGORITHMS.keys()))
+parser.add_argument('--basketSize', type=int, dest='basketSize', nargs='+',
+                    action='store', default=[None],
+                    help='Basket sizes (bytes) to compare')
+parser.add_argument('--autoFlush', type=int, dest='autoFlush', nargs='+',
+                    action='store', default=[None],
+                    help='Cluster sizes to compare (see TTree::SetAutoFlush())')
+parser.add_argument('-n', type=int, dest='nreads',
+                    action='store', default=3,
+                    help='Number of times to read each output back (the fastest is kept)')
+parser.add_argument('--keep', dest='keep',
+                    action='store_true',
+                    help='Keep the re-written files')
+args = parser.parse_args()
+
+CompileCpp('''
+Long64_t ReadAllBranches(std::string filename, std::string treename) {
+    TFile *f = TFile::Open(filename.c_str(), "READ");
+    TTree *t = (TTree*)f->Get(treename.c_str());
+    Long64_t nbytes = 0;
+    for (Long64_t i = 0; i < t->GetEntries(); i++) {
+        nbytes += t->GetEntry(i);
+    }
+    f->Close();
+    return nbytes;
+}
+''')
+
+def MB(nbytes):
+    return nbytes/1024./1024.
+
+results = []
+for compression, basketSize, autoFlush in itertools.product(args.compression, args.basketSize, args.autoFlush):
+    algo, level = compression.split(':') if ':' in compression else (compression, 1)
+    if algo.upper() not in COMPRESSION_ALGORITHMS:
+        raise ValueError('Compression algorithm %s not supported. Options are %s.'%(algo,', '.join(COMPRESSION_ALGORITHMS.keys())))
+    name = '%s:%s basket=%s flush=%s'%(algo.upper(),level,basketSize,autoFlush)
+    outname = 'snapshotBenchmark_%s_%s_%s_%s.root'%(algo.upper(),level,basketSize,autoFlush)
+
+    opts = ROOT.RDF.RSnapshotOptions()
+    opts.fCompressionAlgorithm = COMPRESSION_ALGORITHMS[algo.upper()]
+    opts.fCompressionLevel = int(level)
+    if basketSize != None: opts.fBasketSize = basketSize
+    if autoFlush != None: opts.fAutoFlush = autoFlush
+
+    start = time.time()
+    ROOT.RDataFrame(args.tree, args.input).Snapshot(args.tree, outname, '', opts)
+    write = time.time()-start
+    size = os.path.getsize(outname)
+
+    read = None
+    for i in range(args.nreads):
+        start = time.time()
+        nbytes = ROOT.ReadAllBranches(outname, args.tree)
+        read = time.time()-start if read == None else min(read, time.time()-start)
+    entries = ROOT.RDataFrame(args.tree, outname).Count().GetValue()
+
+    results.append((name, write, MB(size), read, entries/read, MB(nbytes)/read))
+    print('{}: written in {:.1f} s, {:.1f} MB, read in {:.1f} s'.format(name, write, MB(size), read))
+    if not args.keep: os.remove(outname)
+
+print('\n{:<40} {:>10} {:>10} {:>10} {:>12} {:>12}'.format('Setting','Write [s]','Size [MB]','Read [s]','Read [ev/s]','Read [MB/s]'))
+for r in results:
+    print('{:<40} {:>10.2f} {:>10.1f} {:>10.2f} {:>12.0f} {:>12.1f}'.format(*r))